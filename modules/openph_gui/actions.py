@@ -207,7 +207,7 @@ def setup_model(self, filename):
     from pmnet import PharmacophoreModel
 
     try:
-        self.pharmacophore_model = PharmacophoreModel.load(filename)
+        self.pharmacophore_model = PharmacophoreModel.load(filename, use_mmap=False)
     except Exception:
         print(f"Fail to load {filename}")
         return
@@ -0,0 +1,229 @@
+import argparse
+import csv
+import logging
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import torch
+
+from .module import PharmacoNet, DEFAULT_FOCUS_THRESHOLD, DEFAULT_BOX_THRESHOLD
+from .utils.profiler import ModelingProfiler
+
+
+DEFAULT_WEIGHT_PATH = Path(__file__).parent.parent / "weight" / "model.tar"
+
+
+@dataclass
+class ModelingJob:
+    name: str
+    protein_path: str
+    ref_ligand_path: str
+    save_path: str
+
+
+# NOTE: PharmacoNet instance of each worker process (checkpoint is loaded once per worker)
+_worker_module: PharmacoNet | None = None
+_worker_profile: bool = False
+
+
+def _init_worker(model_path: str, num_threads: int, module_kwargs: dict, profile: bool = False):
+    global _worker_module, _worker_profile
+    torch.set_num_threads(num_threads)
+    _worker_module = PharmacoNet(model_path, **module_kwargs)
+    _worker_profile = profile
+
+
+def _save_profile(profiler: ModelingProfiler, jobs: list[ModelingJob]):
+    for job in jobs:
+        root = os.path.splitext(job.save_path)[0]
+        profiler.save_json(root + ".profile.json")
+        profiler.save_chrome_trace(root + ".trace.json")
+
+
+def _run_job(job: ModelingJob) -> tuple[ModelingJob, str | None, float]:
+    assert _worker_module is not None
+    st = time.time()
+    profiler = ModelingProfiler(enabled=_worker_profile)
+    try:
+        model = _worker_module.run(job.protein_path, job.ref_ligand_path, profiler=profiler)
+        assert model is not None
+        model.save(job.save_path)
+        if _worker_profile:
+            _save_profile(profiler, [job])
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return job, error, time.time() - st
+
+
+def _run_jobs(jobs: list[ModelingJob]) -> list[tuple[ModelingJob, str | None, float]]:
+    assert _worker_module is not None
+    if len(jobs) == 1:
+        return [_run_job(jobs[0])]
+    st = time.time()
+    profiler = ModelingProfiler(enabled=_worker_profile)
+    try:
+        models = _worker_module.run_batch(
+            [job.protein_path for job in jobs], [job.ref_ligand_path for job in jobs], profiler=profiler
+        )
+        assert models is not None
+    except Exception:
+        # NOTE: find the failed jobs
+        return [_run_job(job) for job in jobs]
+    tick = (time.time() - st) / len(jobs)
+    if _worker_profile:
+        # NOTE: the jobs in a batch share the profile of the batched forward pass
+        _save_profile(profiler, jobs)
+    out = []
+    for job, model in zip(jobs, models, strict=True):
+        try:
+            model.save(job.save_path)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        out.append((job, error, tick))
+    return out
+
+
+def read_job_file(
+    job_file: str | os.PathLike,
+    out_dir: str | os.PathLike,
+) -> list[ModelingJob]:
+    """Read Job List
+
+    Each row of the csv file is `protein_path,ref_ligand_path[,name]`.
+    Relative paths are resolved from the directory of the job file, and
+    empty rows or rows starting with `#` are ignored.
+
+    Args:
+        job_file: csv file
+        out_dir: output directory of pharmacophore models (`<out_dir>/<name>.pm`)
+
+    Returns:
+        jobs: list[ModelingJob]
+    """
+    root_dir = Path(job_file).parent
+    jobs: list[ModelingJob] = []
+    names: set[str] = set()
+    with open(job_file) as f:
+        for row in csv.reader(f):
+            row = [v.strip() for v in row]
+            if len(row) == 0 or row[0] == "" or row[0].startswith("#"):
+                continue
+            assert len(row) in (2, 3), f"invalid row: {row}"
+            protein_path, ref_ligand_path = root_dir / row[0], root_dir / row[1]
+            if len(row) == 3:
+                name = row[2]
+            else:
+                name = f"{protein_path.stem}_{ref_ligand_path.stem}"
+            assert name not in names, f"duplicated job name: {name}"
+            names.add(name)
+            save_path = Path(out_dir) / f"{name}.pm"
+            jobs.append(ModelingJob(name, str(protein_path), str(ref_ligand_path), str(save_path)))
+    return jobs
+
+
+def run_batch(
+    model_path: str | os.PathLike,
+    jobs: list[ModelingJob],
+    num_workers: int = 1,
+    num_threads: int | None = None,
+    overwrite: bool = False,
+    batch_size: int = 1,
+    profile: bool = False,
+    **module_kwargs,
+) -> dict[str, str | None]:
+    """Batch Pharmacophore Modeling
+
+    Args:
+        model_path: PharmacoNet checkpoint path
+        jobs: modeling jobs
+        num_workers: number of worker processes
+        num_threads: torch threads per worker (default: cpu_count // num_workers)
+        overwrite: if False, jobs whose output already exists are skipped
+        batch_size: number of complexes in a forward pass of each worker
+        profile: if True, save the stage profile of each job (`<name>.profile.json`, `<name>.trace.json`)
+        module_kwargs: keyword arguments of PharmacoNet (e.g. score_threshold)
+
+    Returns:
+        errors: {job name: error message or None}
+    """
+    logger = logging.getLogger("PharmacoNet")
+    if num_threads is None:
+        num_threads = max(multiprocessing.cpu_count() // num_workers, 1)
+    if not overwrite:
+        jobs = [job for job in jobs if not os.path.exists(job.save_path)]
+    for job in jobs:
+        os.makedirs(os.path.dirname(os.path.abspath(job.save_path)), exist_ok=True)
+
+    results: dict[str, str | None] = {}
+    initargs = (str(model_path), num_threads, module_kwargs, profile)
+    job_batches = [jobs[i : i + batch_size] for i in range(0, len(jobs), batch_size)]
+    if num_workers == 1:
+        _init_worker(*initargs)
+        iterator = map(_run_jobs, job_batches)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=initargs)
+        iterator = pool.imap_unordered(_run_jobs, job_batches)
+    try:
+        for batch_results in iterator:
+            for job, error, tick in batch_results:
+                results[job.name] = error
+                if error is None:
+                    logger.info(f"[{len(results)}/{len(jobs)}] {job.name}: {job.save_path} ({tick:.1f} sec)")
+                else:
+                    logger.warning(f"[{len(results)}/{len(jobs)}] {job.name}: Fail ({error})")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PharmacoNet: Batch Pharmacophore Modeling")
+    parser.add_argument(
+        "-j", "--jobs", type=str, required=True, help="csv file, each row is `protein_path,ref_ligand_path[,name]`"
+    )
+    parser.add_argument("-o", "--out_dir", type=str, required=True, help="output directory of pharmacophore models")
+    parser.add_argument("--weight", type=str, default=str(DEFAULT_WEIGHT_PATH), help="PharmacoNet checkpoint path")
+    parser.add_argument("--num_workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--num_threads", type=int, default=None, help="torch threads per worker")
+    parser.add_argument("--batch_size", type=int, default=1, help="number of complexes in a forward pass")
+    parser.add_argument("--overwrite", action="store_true", help="rerun jobs whose output already exists")
+    parser.add_argument("--cache_dir", type=str, default=None, help="directory of preprocessing cache")
+    parser.add_argument("--backend", type=str, default="eager", choices=["eager", "torchscript"])
+    parser.add_argument("--backend_path", type=str, default=None, help="directory of exported torchscript modules")
+    parser.add_argument("--precision", type=str, default="fp32", choices=["fp32", "bf16", "int8"])
+    parser.add_argument("--profile", action="store_true", help="save time and memory profile of each job")
+    parser.add_argument("--focus_threshold", type=float, default=DEFAULT_FOCUS_THRESHOLD)
+    parser.add_argument("--box_threshold", type=float, default=DEFAULT_BOX_THRESHOLD)
+    parser.add_argument("--score_threshold", type=float, default=None, help="percentile threshold of hotspot scores")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    assert os.path.exists(args.weight), f"checkpoint is not found: {args.weight}"
+    jobs = read_job_file(args.jobs, args.out_dir)
+    module_kwargs = dict(
+        focus_threshold=args.focus_threshold,
+        box_threshold=args.box_threshold,
+        cache_dir=args.cache_dir,
+        backend=args.backend,
+        backend_path=args.backend_path,
+        precision=args.precision,
+    )
+    if args.score_threshold is not None:
+        module_kwargs["score_threshold"] = args.score_threshold
+    results = run_batch(
+        args.weight, jobs, args.num_workers, args.num_threads, args.overwrite, args.batch_size, args.profile, **module_kwargs
+    )
+    num_fails = sum(error is not None for error in results.values())
+    logging.getLogger("PharmacoNet").info(f"Finish: {len(results) - num_fails} success, {num_fails} fail")
+
+
+if __name__ == "__main__":
+    main()
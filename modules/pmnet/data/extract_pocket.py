@@ -55,3 +55,47 @@ def extract_pocket(
     io.save(out_pocket_pdb_path, DistSelect(center, cutoff))
     command = f"obabel {out_pocket_pdb_path} -O {out_pocket_pdb_path} -d"
     os.system(command)
+
+
+def extract_pocket_pdbblock(
+    pdbblock: str,
+    center: ArrayLike,
+    cutoff: float,
+) -> str:
+    """In-memory pocket extraction (same residue selection as `DistSelect`)
+
+    Args:
+        pdbblock: protein pdb block
+        center: pocket center (3,)
+        cutoff: distance cutoff of residues
+
+    Returns:
+        pocket_pdbblock: pdb block of the pocket residues (first model only)
+    """
+    lines: list[str] = []
+    residue_keys: list[tuple[str, str, str]] = []
+    for line in pdbblock.splitlines():
+        record = line[:6]
+        if record == "ENDMDL":
+            break
+        if record not in ("ATOM  ", "HETATM"):
+            continue
+        lines.append(line)
+        # NOTE: (chain, residue number + insertion code, residue name)
+        residue_keys.append((line[21], line[22:27], line[17:20].strip()))
+    if len(lines) == 0:
+        return "END\n"
+
+    residue_index: dict[tuple[str, str, str], int] = {}
+    atom_residues = np.array([residue_index.setdefault(key, len(residue_index)) for key in residue_keys])
+    is_amino_acid = np.array([key[2] in AMINO_ACID for key in residue_index])
+    # NOTE: same as DistSelect, atoms whose names contain "H" are not used for the distance.
+    is_used = np.array(["H" not in line[12:16] for line in lines])
+    positions = np.array([(line[30:38], line[38:46], line[46:54]) for line in lines], dtype=np.float64)
+    distances = np.linalg.norm(positions - np.asarray(center, dtype=np.float64).reshape(1, 3), axis=-1)
+
+    min_distances = np.full(len(residue_index), np.inf)
+    np.minimum.at(min_distances, atom_residues[is_used], distances[is_used])
+    is_selected = is_amino_acid & (min_distances < cutoff)
+    pocket_lines = [line for line, residue in zip(lines, atom_residues, strict=True) if is_selected[residue]]
+    return "\n".join(pocket_lines + ["END", ""])
@@ -1,8 +1,11 @@
 from __future__ import annotations
 from openbabel import pybel
 from openbabel.pybel import ob
+import numpy as np
 
-from typing import List, Tuple
+from functools import cached_property
+from typing import List
+from numpy.typing import NDArray
 
 from .atom_classes import (
     HydrophobicAtom_P,
@@ -20,124 +23,226 @@ class Protein():
             self,
             pbmol: pybel.Molecule,
             addh: bool = True,
+            _unsafe: bool = False,
     ):
         """
         pbmol: Pybel Mol
         addh: if True, call OBMol.AddPolarHydrogens()
-        setup: if True, find interactable parts
-        ligand: if ligand is not None, extract pocket
+        _unsafe: if True, pbmol is modified in place (it is not cloned)
+
+        The protein is stored as arrays over the heavy atoms (structure of arrays):
+            coords: [float64, (N, 3)]
+            atomic_nums: [int, (N,)]
+            residue_indices: [int, (N,)] index of `residue_names`
+            interactable parts: atom indices (and centers) of each interaction type
         """
 
         self.addh: bool = addh
 
-        self.pbmol = pbmol.clone
-        self.pbmol.removeh()
-        self.obmol = self.pbmol.OBMol
-        self.obatoms: List[ob.OBAtom] = list(ob.OBMolAtomIter(self.obmol))
-        self.num_heavyatoms = len(self.obatoms)
-
-        self.pbmol_hyd: pybel.Molecule
+        pbmol_hyd: pybel.Molecule
         if addh:
-            self.pbmol_hyd = self.pbmol.clone
-            self.pbmol_hyd.OBMol.AddPolarHydrogens()
+            # NOTE: polar hydrogens are appended after the heavy atoms, so a single molecule is enough.
+            pbmol_hyd = pbmol if _unsafe else pbmol.clone
+            pbmol_hyd.removeh()
+            self.num_heavyatoms = pbmol_hyd.OBMol.NumAtoms()
+            pbmol_hyd.OBMol.AddPolarHydrogens()
         else:
-            self.pbmol_hyd = pbmol
-        self.obmol_hyd = self.pbmol_hyd.OBMol
-        self.obatoms_hyd: List[ob.OBAtom] = list(ob.OBMolAtomIter(self.obmol_hyd))[:self.num_heavyatoms]
-        self.obatoms_hyd_nonwater: List[ob.OBAtom] = [
-            obatom for obatom in self.obatoms_hyd
-            if obatom.GetResidue().GetName() != 'HOH'
-            and obatom.GetAtomicNum() in [6, 7, 8, 16]
-        ]
-        self.obresidues_hyd: List[ob.OBResidue] = list(ob.OBResidueIter(self.obmol_hyd))
-
-        self.hydrophobic_atoms_all: List[HydrophobicAtom_P]
-        self.rings_all: List[Ring_P]
-        self.pos_charged_atoms_all: List[PosCharged_P]
-        self.neg_charged_atoms_all: List[NegCharged_P]
-        self.hbond_donors_all: List[HBondDonor_P]
-        self.hbond_acceptors_all: List[HBondAcceptor_P]
-        self.xbond_acceptors_all: List[XBondAcceptor_P]
-
-        self.hydrophobic_atoms_all = self.__find_hydrophobic_atoms()
-        self.rings_all = self.__find_rings()
-        self.pos_charged_atoms_all, self.neg_charged_atoms_all = self.__find_charged_atoms()
-        self.hbond_donors_all = self.__find_hbond_donors()
-        self.hbond_acceptors_all = self.__find_hbond_acceptors()
-        self.xbond_acceptors_all = self.__find_xbond_acceptors()
+            self.num_heavyatoms = sum(obatom.GetAtomicNum() != 1 for obatom in ob.OBMolAtomIter(pbmol.OBMol))
+            pbmol_hyd = pbmol
+        self.pbmol_hyd = pbmol_hyd
+        self.obmol_hyd: ob.OBMol = pbmol_hyd.OBMol
+
+        self.coords: NDArray[np.float64]
+        self.atomic_nums: NDArray[np.int64]
+        self.residue_indices: NDArray[np.int64]
+        self.residue_names: List[str]
+        self.__set_atoms()
+
+        self.hydrophobic_indices: NDArray[np.int64]
+        self.hbond_donor_indices: NDArray[np.int64]
+        self.hbond_acceptor_indices: NDArray[np.int64]
+        self.ring_indices: List[NDArray[np.int64]]
+        self.ring_centers: NDArray[np.float64]
+        self.pos_charged_indices: List[NDArray[np.int64]]
+        self.pos_charged_centers: NDArray[np.float64]
+        self.neg_charged_indices: List[NDArray[np.int64]]
+        self.neg_charged_centers: NDArray[np.float64]
+        self.xbond_acceptor_indices: NDArray[np.int64]  # (O, Y)
+
+        self.__find_hydrophobic_and_xbond_acceptors()
+        self.__find_rings()
+        self.__find_charged_atoms()
 
     @classmethod
     def from_pdbfile(cls, path, addh=True, **kwargs):
         pbmol = next(pybel.readfile('pdb', path))
-        return cls(pbmol, addh, **kwargs)
+        return cls(pbmol, addh, _unsafe=True, **kwargs)
+
+    @classmethod
+    def from_pdbblock(cls, pdbblock, addh=True, **kwargs):
+        pbmol = pybel.readstring('pdb', pdbblock)
+        return cls(pbmol, addh, _unsafe=True, **kwargs)
+
+    # NOTE: compatibility attributes of the former object-based Protein (constructed at the first access)
+    @cached_property
+    def pbmol(self) -> pybel.Molecule:
+        pbmol = self.pbmol_hyd.clone
+        pbmol.removeh()
+        return pbmol
+
+    @property
+    def obmol(self) -> ob.OBMol:
+        return self.pbmol.OBMol
+
+    @property
+    def obatoms(self) -> List[ob.OBAtom]:
+        return list(ob.OBMolAtomIter(self.obmol))
+
+    @property
+    def obatoms_hyd(self) -> List[ob.OBAtom]:
+        return [self.obmol_hyd.GetAtom(idx + 1) for idx in range(self.num_heavyatoms)]
+
+    @property
+    def obatoms_hyd_nonwater(self) -> List[ob.OBAtom]:
+        return [self.obmol_hyd.GetAtom(idx + 1) for idx in np.flatnonzero(self.nonwater_mask).tolist()]
+
+    @property
+    def obresidues_hyd(self) -> List[ob.OBResidue]:
+        return list(ob.OBResidueIter(self.obmol_hyd))
+
+    def __set_atoms(self):
+        """Coordinates, elements and residues of the heavy atoms, and their HBond donor/acceptor flags"""
+        obmol = self.obmol_hyd
+        num_atoms = self.num_heavyatoms
+        coords = np.empty((num_atoms, 3), dtype=np.float64)
+        atomic_nums = np.empty((num_atoms,), dtype=np.int64)
+        residue_indices = np.empty((num_atoms,), dtype=np.int64)
+        is_donor = np.zeros((num_atoms,), dtype=np.bool_)
+        is_acceptor = np.zeros((num_atoms,), dtype=np.bool_)
+
+        residue_names = [obmol.GetResidue(idx).GetName() for idx in range(obmol.NumResidues())]
+        for idx in range(num_atoms):
+            obatom = obmol.GetAtom(idx + 1)
+            coords[idx] = obatom.x(), obatom.y(), obatom.z()
+            atomic_num = atomic_nums[idx] = obatom.GetAtomicNum()
+            residue_idx = residue_indices[idx] = obatom.GetResidue().GetIdx()
+            if atomic_num in (6, 7, 8, 16) and residue_names[residue_idx] != 'HOH':
+                is_donor[idx] = obatom.IsHbondDonor()
+                is_acceptor[idx] = obatom.IsHbondAcceptor()
+
+        self.coords = coords
+        self.atomic_nums = atomic_nums
+        self.residue_indices = residue_indices
+        self.residue_names = residue_names
+        is_water = np.array([name == 'HOH' for name in residue_names], dtype=np.bool_)
+        self.nonwater_mask: NDArray[np.bool_] = np.isin(atomic_nums, (6, 7, 8, 16)) & ~is_water[residue_indices]
+        self.hbond_donor_indices = np.flatnonzero(is_donor)
+        self.hbond_acceptor_indices = np.flatnonzero(is_acceptor)
 
     # Search Interactable Part
-    def __find_hydrophobic_atoms(self) -> List[HydrophobicAtom_P]:
-        hydrophobics = [HydrophobicAtom_P(obatom) for obatom in self.obatoms_hyd_nonwater
-                        if obatom.GetAtomicNum() == 6
-                        and all(neigh.GetAtomicNum() in (1, 6) for neigh in ob.OBAtomAtomIter(obatom))
-                        ]
-        return hydrophobics
-
-    def __find_hbond_acceptors(self) -> List[HBondAcceptor_P]:
-        acceptors = [HBondAcceptor_P(obatom) for obatom in self.obatoms_hyd_nonwater
-                     if obatom.IsHbondAcceptor()
-                     ]
-        return acceptors
-
-    def __find_hbond_donors(self) -> List[HBondDonor_P]:
-        donors = [HBondDonor_P(obatom) for obatom in self.obatoms_hyd_nonwater
-                  if obatom.IsHbondDonor()
-                  ]
-        return donors
-
-    def __find_rings(self) -> List[Ring_P]:
-        rings = []
-        ring_candidates = self.pbmol_hyd.sssr
-        for ring in ring_candidates:
+    def __find_hydrophobic_and_xbond_acceptors(self):
+        """Hydrophobic carbons (C with only C/H neighbors) and halogen bond acceptors (Y-{O|N|S}, with Y=N,C)"""
+        obmol = self.obmol_hyd
+        num_bonds = obmol.NumBonds()
+        bonds = np.empty((num_bonds, 2), dtype=np.int64)
+        for idx in range(num_bonds):
+            obbond = obmol.GetBond(idx)
+            bonds[idx] = obbond.GetBeginAtomIdx() - 1, obbond.GetEndAtomIdx() - 1
+        # NOTE: hydrogens (and the other atoms) after the heavy atoms
+        num_atoms = obmol.NumAtoms()
+        atomic_nums = np.ones((num_atoms,), dtype=np.int64)
+        atomic_nums[:self.num_heavyatoms] = self.atomic_nums
+        if not self.addh:
+            for idx in range(self.num_heavyatoms, num_atoms):
+                atomic_nums[idx] = obmol.GetAtom(idx + 1).GetAtomicNum()
+
+        # NOTE: directed edges (atom, neighbor)
+        edges = np.concatenate([bonds, bonds[:, ::-1]])
+        atoms, neighbors = edges[:, 0], edges[:, 1]
+        neighbor_nums = atomic_nums[neighbors]
+
+        is_polar_neighbor = ~np.isin(neighbor_nums, (1, 6))
+        has_polar_neighbor = np.zeros((num_atoms,), dtype=np.bool_)
+        has_polar_neighbor[atoms[is_polar_neighbor]] = True
+        is_hydrophobic = self.nonwater_mask & (self.atomic_nums == 6) & ~has_polar_neighbor[:self.num_heavyatoms]
+        self.hydrophobic_indices = np.flatnonzero(is_hydrophobic)
+
+        is_y_neighbor = np.isin(neighbor_nums, (6, 7, 16))
+        num_y_neighbors = np.bincount(atoms[is_y_neighbor], minlength=num_atoms)[:self.num_heavyatoms]
+        is_xbond_acceptor = self.nonwater_mask & np.isin(self.atomic_nums, (8, 7, 16)) & (num_y_neighbors == 1)
+        y_neighbors = np.full((num_atoms,), -1, dtype=np.int64)
+        y_neighbors[atoms[is_y_neighbor]] = neighbors[is_y_neighbor]
+        acceptor_indices = np.flatnonzero(is_xbond_acceptor)
+        self.xbond_acceptor_indices = np.stack([acceptor_indices, y_neighbors[acceptor_indices]], axis=1)
+
+    def __find_rings(self):
+        ring_indices = []
+        for ring in self.pbmol_hyd.sssr:
             if not 4 < len(ring._path) <= 6:
                 continue
-            obatoms = [self.obatoms_hyd[idx - 1] for idx in sorted(ring._path)]
-            residue = obatoms[0].GetResidue()
-            if residue.GetName() not in ["TYR", "TRP", "HIS", "PHE"]:
+            indices = np.array(sorted(ring._path), dtype=np.int64) - 1
+            if self.residue_names[self.residue_indices[indices[0]]] not in ["TYR", "TRP", "HIS", "PHE"]:
                 continue
-            rings.append(Ring_P(obatoms))
-        return rings
-
-    def __find_charged_atoms(self) -> Tuple[List[PosCharged_P], List[NegCharged_P]]:
-        pos_charged = []
-        neg_charged = []
+            ring_indices.append(indices)
+        self.ring_indices = ring_indices
+        self.ring_centers = np.array([self.coords[indices].mean(axis=0) for indices in ring_indices]).reshape(-1, 3)
 
-        for obresidue in self.obresidues_hyd:
-            obresname = obresidue.GetName()
+    def __find_charged_atoms(self):
+        pos_charged, neg_charged = [], []
+        for residue_idx, obresname in enumerate(self.residue_names):
             if obresname in ("ARG", "HIS", "LYS"):
-                obatoms = [obatom for obatom in ob.OBResidueAtomIter(obresidue)
-                           if obatom.GetAtomicNum() == 7
-                           and obresidue.GetAtomProperty(obatom, ob.SIDECHAIN)
-                           ]
-                if len(obatoms) > 0:
-                    pos_charged.append(PosCharged_P(obatoms))
-
+                atomic_num, charged = 7, pos_charged
             elif obresname in ("GLU", "ASP"):
-                obatoms = [obatom for obatom in ob.OBResidueAtomIter(obresidue)
-                           if obatom.GetAtomicNum() == 8
-                           and obresidue.GetAtomProperty(obatom, ob.SIDECHAIN)
-                           ]
-                if len(obatoms) > 0:
-                    neg_charged.append(NegCharged_P(obatoms))
-
-        return pos_charged, neg_charged
-
-    def __find_xbond_acceptors(self) -> List[XBondAcceptor_P]:
-        """Look for halogen bond acceptors (Y-{O|N|S}, with Y=N,C)"""
-        acceptors = []
-        for obatom in self.obatoms_hyd_nonwater:
-            if obatom.GetAtomicNum() not in [8, 7, 16]:
+                atomic_num, charged = 8, neg_charged
+            else:
                 continue
-            neighbors = [neigh for neigh in ob.OBAtomAtomIter(obatom)
-                         if neigh.GetAtomicNum() in [6, 7, 16]
-                         ]
-            if len(neighbors) == 1:
-                O, Y = obatom, neighbors[0]
-                acceptors.append(XBondAcceptor_P(O, Y))
-        return acceptors
+            obresidue = self.obmol_hyd.GetResidue(residue_idx)
+            indices = [
+                obatom.GetIdx() - 1 for obatom in ob.OBResidueAtomIter(obresidue)
+                if obatom.GetAtomicNum() == atomic_num
+                and obresidue.GetAtomProperty(obatom, ob.SIDECHAIN)
+            ]
+            if len(indices) > 0:
+                charged.append(np.array(indices, dtype=np.int64))
+        self.pos_charged_indices = pos_charged
+        self.pos_charged_centers = np.array([self.coords[indices].mean(axis=0) for indices in pos_charged]).reshape(-1, 3)
+        self.neg_charged_indices = neg_charged
+        self.neg_charged_centers = np.array([self.coords[indices].mean(axis=0) for indices in neg_charged]).reshape(-1, 3)
+
+    # NOTE: interactable part objects (constructed at the first access)
+    @cached_property
+    def hydrophobic_atoms_all(self) -> List[HydrophobicAtom_P]:
+        return [HydrophobicAtom_P(self.obmol_hyd.GetAtom(idx + 1)) for idx in self.hydrophobic_indices.tolist()]
+
+    @cached_property
+    def hbond_acceptors_all(self) -> List[HBondAcceptor_P]:
+        return [HBondAcceptor_P(self.obmol_hyd.GetAtom(idx + 1)) for idx in self.hbond_acceptor_indices.tolist()]
+
+    @cached_property
+    def hbond_donors_all(self) -> List[HBondDonor_P]:
+        return [HBondDonor_P(self.obmol_hyd.GetAtom(idx + 1)) for idx in self.hbond_donor_indices.tolist()]
+
+    @cached_property
+    def rings_all(self) -> List[Ring_P]:
+        return [Ring_P([self.obmol_hyd.GetAtom(idx + 1) for idx in indices.tolist()]) for indices in self.ring_indices]
+
+    @cached_property
+    def pos_charged_atoms_all(self) -> List[PosCharged_P]:
+        return [
+            PosCharged_P([self.obmol_hyd.GetAtom(idx + 1) for idx in indices.tolist()])
+            for indices in self.pos_charged_indices
+        ]
+
+    @cached_property
+    def neg_charged_atoms_all(self) -> List[NegCharged_P]:
+        return [
+            NegCharged_P([self.obmol_hyd.GetAtom(idx + 1) for idx in indices.tolist()])
+            for indices in self.neg_charged_indices
+        ]
+
+    @cached_property
+    def xbond_acceptors_all(self) -> List[XBondAcceptor_P]:
+        return [
+            XBondAcceptor_P(self.obmol_hyd.GetAtom(o + 1), self.obmol_hyd.GetAtom(y + 1))
+            for o, y in self.xbond_acceptor_indices.tolist()
+        ]
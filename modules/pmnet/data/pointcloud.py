@@ -71,33 +71,38 @@ def protein_atom_function(
     return out
 
 
+# NOTE: lookup tables of the channels (atomic number -> channel, residue name -> channel)
+PROTEIN_ATOM_NUM_TABLE: NDArray[np.int64] = np.full((128,), NUM_PROTEIN_ATOMIC_NUM - 1, dtype=np.int64)
+for _idx, _atomicnum in enumerate(protein_atom_num_list[:-1]):
+    PROTEIN_ATOM_NUM_TABLE[_atomicnum] = _idx
+PROTEIN_AMINOACID_TABLE: dict[str, int] = {resname: idx for idx, resname in enumerate(protein_aminoacid_list)}
+
+
 def get_protein_pointcloud(
     pocket_obj: Protein,
 ) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
-    positions = np.array(
-        [(obatom.x(), obatom.y(), obatom.z()) for obatom in pocket_obj.obatoms],
-        dtype=np.float32,
-    )
+    positions = pocket_obj.coords.astype(np.float32)
 
-    channels = np.zeros(
-        (pocket_obj.num_heavyatoms, NUM_PROTEIN_CHANNEL), dtype=np.float32
+    num_atoms = pocket_obj.num_heavyatoms
+    channels = np.zeros((num_atoms, NUM_PROTEIN_CHANNEL), dtype=np.float32)
+    atom_indices = np.arange(num_atoms)
+    channels[atom_indices, PROTEIN_ATOM_NUM_TABLE[np.clip(pocket_obj.atomic_nums, 0, 127)]] = 1
+    residue_codes = np.array(
+        [PROTEIN_AMINOACID_TABLE.get(resname, NUM_PROTEIN_AMINOACID_NUM - 1) for resname in pocket_obj.residue_names],
+        dtype=np.int64,
     )
-    for i, atom in enumerate(pocket_obj.obatoms):
-        protein_atom_function(atom, channels[i])
+    channels[atom_indices, NUM_PROTEIN_ATOMIC_NUM + residue_codes[pocket_obj.residue_indices]] = 1
 
     offset = NUM_PROTEIN_ATOMIC_NUM + NUM_PROTEIN_AMINOACID_NUM
-    for hydrop in pocket_obj.hydrophobic_atoms_all:
-        channels[hydrop.index, offset] = 1
-    for ring in pocket_obj.rings_all:
-        channels[ring.indices, offset + 1] = 1
-    for donor in pocket_obj.hbond_donors_all:
-        channels[donor.index, offset + 2] = 1
-    for acceptor in pocket_obj.hbond_acceptors_all:
-        channels[acceptor.index, offset + 3] = 1
-    for cation in pocket_obj.pos_charged_atoms_all:
-        channels[cation.indices, offset + 4] = 1
-    for anion in pocket_obj.neg_charged_atoms_all:
-        channels[anion.indices, offset + 5] = 1
-    for acceptor in pocket_obj.xbond_acceptors_all:
-        channels[acceptor.indices, offset + 6] = 1
+    channels[pocket_obj.hydrophobic_indices, offset] = 1
+    channels[_concatenate(pocket_obj.ring_indices), offset + 1] = 1
+    channels[pocket_obj.hbond_donor_indices, offset + 2] = 1
+    channels[pocket_obj.hbond_acceptor_indices, offset + 3] = 1
+    channels[_concatenate(pocket_obj.pos_charged_indices), offset + 4] = 1
+    channels[_concatenate(pocket_obj.neg_charged_indices), offset + 5] = 1
+    channels[pocket_obj.xbond_acceptor_indices.reshape(-1), offset + 6] = 1
     return positions, channels
+
+
+def _concatenate(indices_list: list[NDArray[np.int64]]) -> NDArray[np.int64]:
+    return np.concatenate(indices_list) if len(indices_list) > 0 else np.zeros((0,), dtype=np.int64)
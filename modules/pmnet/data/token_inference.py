@@ -1,6 +1,8 @@
-import numpy as np
+import functools
 import math
 
+import numpy as np
+
 from numpy.typing import NDArray, ArrayLike
 
 from .objects import Protein
@@ -19,74 +21,29 @@ def get_token_informations(
         token_positions: [float, (N, 3)] token center positions
         token_classes: [int, (N,)] token interaction type
     """
-    num_tokens = (
-        len(protein_obj.hydrophobic_atoms_all)
-        + len(protein_obj.rings_all) * 3
-        + len(protein_obj.hbond_donors_all)
-        + len(protein_obj.hbond_acceptors_all)
-        + len(protein_obj.pos_charged_atoms_all) * 2
-        + len(protein_obj.neg_charged_atoms_all)
-        + len(protein_obj.xbond_acceptors_all)
-    )
-
-    positions: list[tuple[float, float, float]] = []
-    classes: list[int] = []
-
-    # NOTE: Hydrophobic
-    positions.extend(
-        tuple(hydrop.coords) for hydrop in protein_obj.hydrophobic_atoms_all
-    )
-    classes.extend([C.HYDROPHOBIC] * len(protein_obj.hydrophobic_atoms_all))
-
-    # NOTE: PiStacking_P
-    positions.extend(tuple(ring.center) for ring in protein_obj.rings_all)
-    classes.extend([C.PISTACKING_P] * len(protein_obj.rings_all))
-
-    # NOTE: PiStacking_T
-    positions.extend(tuple(ring.center) for ring in protein_obj.rings_all)
-    classes.extend([C.PISTACKING_T] * len(protein_obj.rings_all))
-
-    # NOTE: PiCation_lring
-    positions.extend(
-        tuple(cation.center) for cation in protein_obj.pos_charged_atoms_all
-    )
-    classes.extend([C.PICATION_LRING] * len(protein_obj.pos_charged_atoms_all))
-
-    # NOTE: PiCation_pring
-    positions.extend(tuple(ring.center) for ring in protein_obj.rings_all)
-    classes.extend([C.PICATION_PRING] * len(protein_obj.rings_all))
-
-    # NOTE: HBond_ldon
-    positions.extend(
-        tuple(acceptor.coords) for acceptor in protein_obj.hbond_acceptors_all
-    )
-    classes.extend([C.HBOND_LDON] * len(protein_obj.hbond_acceptors_all))
-
-    # NOTE: HBond_pdon
-    positions.extend(tuple(donor.coords) for donor in protein_obj.hbond_donors_all)
-    classes.extend([C.HBOND_PDON] * len(protein_obj.hbond_donors_all))
-
-    # NOTE: Saltbridge_lneg
-    positions.extend(
-        tuple(cation.center) for cation in protein_obj.pos_charged_atoms_all
-    )
-    classes.extend([C.SALTBRIDGE_LNEG] * len(protein_obj.pos_charged_atoms_all))
-
-    # NOTE: Saltbridge_pneg
-    positions.extend(tuple(anion.center) for anion in protein_obj.neg_charged_atoms_all)
-    classes.extend([C.SALTBRIDGE_PNEG] * len(protein_obj.neg_charged_atoms_all))
-
-    # NOTE: XBond
-    positions.extend(
-        tuple(acceptor.O_coords) for acceptor in protein_obj.xbond_acceptors_all
-    )
-    classes.extend([C.XBOND] * len(protein_obj.xbond_acceptors_all))
-
-    assert len(positions) == len(classes) == num_tokens
-    return (
-        np.array(positions, dtype=np.float32),
-        np.array(classes, dtype=np.int16),
-    )
+    hydrophobic_coords = protein_obj.coords[protein_obj.hydrophobic_indices]
+    hbond_acceptor_coords = protein_obj.coords[protein_obj.hbond_acceptor_indices]
+    hbond_donor_coords = protein_obj.coords[protein_obj.hbond_donor_indices]
+    xbond_acceptor_coords = protein_obj.coords[protein_obj.xbond_acceptor_indices[:, 0]]
+    ring_centers = protein_obj.ring_centers
+    pos_charged_centers = protein_obj.pos_charged_centers
+    neg_charged_centers = protein_obj.neg_charged_centers
+
+    token_groups: list[tuple[NDArray[np.float64], int]] = [
+        (hydrophobic_coords, C.HYDROPHOBIC),
+        (ring_centers, C.PISTACKING_P),
+        (ring_centers, C.PISTACKING_T),
+        (pos_charged_centers, C.PICATION_LRING),
+        (ring_centers, C.PICATION_PRING),
+        (hbond_acceptor_coords, C.HBOND_LDON),
+        (hbond_donor_coords, C.HBOND_PDON),
+        (pos_charged_centers, C.SALTBRIDGE_LNEG),
+        (neg_charged_centers, C.SALTBRIDGE_PNEG),
+        (xbond_acceptor_coords, C.XBOND),
+    ]
+    positions = np.concatenate([coords for coords, _ in token_groups]).astype(np.float32)
+    classes = np.concatenate([np.full((len(coords),), typ, dtype=np.int16) for coords, typ in token_groups])
+    return positions.reshape(-1, 3), classes
 
 
 def get_token_and_filter(
@@ -95,7 +52,7 @@ def get_token_and_filter(
     center: NDArray[np.float32],
     resolution: float,
     dimension: int,
-) -> tuple[NDArray[np.int16], NDArray[np.int16]]:
+) -> tuple[NDArray[np.int16], NDArray[np.int64]]:
     """Create token and Filtering valid instances
 
     Args:
@@ -109,21 +66,66 @@ def get_token_and_filter(
         token: [int, (N_token, 4)]
         filter: [int, (N_token,)]
     """
-    filter = []
-    tokens = []
-    x_center, y_center, z_center = center
-    x_start = x_center - (dimension / 2) * resolution
-    y_start = y_center - (dimension / 2) * resolution
-    z_start = z_center - (dimension / 2) * resolution
-    for i, ((x, y, z), c) in enumerate(zip(positions, classes)):
-        _x = int((x - x_start) // resolution)
-        _y = int((y - y_start) // resolution)
-        _z = int((z - z_start) // resolution)
-        if (0 <= _x < dimension) and (0 <= _y < dimension) and (0 <= _z < dimension):
-            filter.append(i)
-            tokens.append((_x, _y, _z, c))
-
-    return np.array(tokens, dtype=np.int16), np.array(filter, dtype=np.int16)
+    # NOTE: the grids are quantized in float64 regardless of the numpy version.
+    # (the former scalar loop was float64 on numpy 1.x but float32 on numpy 2 (NEP 50))
+    start = np.array([float(c) - (dimension / 2) * resolution for c in center], dtype=np.float64)
+    grid_coords = np.floor_divide(positions.astype(np.float64) - start, resolution).astype(np.int64)
+    filter = np.flatnonzero(np.all((grid_coords >= 0) & (grid_coords < dimension), axis=1))
+    tokens = np.concatenate([grid_coords[filter], classes[filter, None]], axis=1).astype(np.int16)
+    return tokens.reshape(-1, 4), filter
+
+
+@functools.lru_cache
+def get_box_stencil(radius: int) -> NDArray[np.bool_]:
+    """Spherical stencil of box area
+
+    Args:
+        radius: int, grid points whose distance from the center is less than radius are included
+
+    Returns:
+        stencil: BoolArray [2 * radius - 1, 2 * radius - 1, 2 * radius - 1] (center: [radius - 1] * 3)
+    """
+    offsets = np.arange(-(radius - 1), radius)
+    grids = np.stack(np.meshgrid(offsets, offsets, offsets, indexing="ij"), 3)
+    stencil = np.linalg.norm(grids, axis=-1) < radius
+    stencil.flags.writeable = False
+    return stencil
+
+
+def get_box_radius(interaction_type: int, pharmacophore_size: float, resolution: float) -> int:
+    """Radius of the box area stencil (grid unit)"""
+    return math.ceil((C.INTERACTION_DIST[interaction_type] + pharmacophore_size) / resolution)
+
+
+def get_box_area_crops(
+    tokens: ArrayLike,
+    pharmacophore_size: float,
+    resolution: float,
+    dimension: int,
+) -> list[tuple[tuple[slice, slice, slice], NDArray[np.bool_]]]:
+    """Create Box Area (Bounding Box Form)
+
+    Args:
+        tokens: [Ntoken, 4]
+        resolution: float, default = 0.5
+        dimension: int, default = 64,
+
+    Returns:
+        box_area_crops: List[(bounding box slices (x, y, z), BoolArray [Dbox, Hbox, Wbox])]
+    """
+    box_area_crops = []
+    for x, y, z, t in tokens:
+        x, y, z, t = int(x), int(y), int(z), int(t)
+        radius = get_box_radius(t, pharmacophore_size, resolution)
+        stencil = get_box_stencil(radius)
+        bbox, stencil_bbox = [], []
+        for center in (x, y, z):
+            start, end = center - (radius - 1), center + radius
+            clipped_start, clipped_end = max(start, 0), min(end, dimension)
+            bbox.append(slice(clipped_start, clipped_end))
+            stencil_bbox.append(slice(clipped_start - start, clipped_end - start))
+        box_area_crops.append((tuple(bbox), stencil[tuple(stencil_bbox)]))
+    return box_area_crops
 
 
 def get_box_area(
@@ -144,20 +146,8 @@ def get_box_area(
     """
     num_tokens = len(tokens)
     box_areas = np.zeros((num_tokens, dimension, dimension, dimension), dtype=np.bool_)
-    grids = np.stack(
-        np.meshgrid(
-            np.arange(dimension),
-            np.arange(dimension),
-            np.arange(dimension),
-            indexing="ij",
-        ),
-        3,
-    )
-    for i, (x, y, z, t) in enumerate(tokens):
-        x, y, z, t = int(x), int(y), int(z), int(t)
-        distances = np.linalg.norm(grids - np.array([[x, y, z]]), axis=-1)
-        threshold = math.ceil(
-            (C.INTERACTION_DIST[int(t)] + pharmacophore_size) / resolution
-        )
-        box_areas[i] = distances < threshold
+    for i, (bbox, box_area) in enumerate(
+        get_box_area_crops(tokens, pharmacophore_size, resolution, dimension)
+    ):
+        box_areas[i][bbox] = box_area
     return box_areas
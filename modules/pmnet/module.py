@@ -1,26 +1,33 @@
 import os
-import tempfile
 import math
+import contextlib
+import threading
 from openbabel import pybel
 
 import logging
+from dataclasses import dataclass
 import torch
 import numpy as np
 
 from omegaconf import OmegaConf
-from torch import Tensor
-from numpy.typing import NDArray
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from torch import nn, Tensor
+from numpy.typing import NDArray, ArrayLike
 
 from molvoxel import create_voxelizer, BaseVoxelizer
 
 from .network import build_model
+from .network import jit
 from .network.detector import PharmacoFormer
 from .data import token_inference, pointcloud
 from .data import constant as C
-from .data import INTERACTION_LIST
+from .data import INTERACTION_LIST, PROTEIN_CHANNEL_LIST
 from .data.objects import Protein
-from .data.extract_pocket import extract_pocket
+from .data.extract_pocket import extract_pocket_pdbblock
 from .utils.smoothing import GaussianSmoothing
+from .utils.density_map import SparseDensityMap
+from .utils.cache import PreprocessingCache
+from .utils.profiler import ModelingProfiler
 
 from .pharmacophore_model import PharmacophoreModel
 
@@ -34,6 +41,9 @@ except Exception:
 
 DEFAULT_FOCUS_THRESHOLD = 0.5
 DEFAULT_BOX_THRESHOLD = 0.5
+DEFAULT_SEGMENTATION_MEMORY_BUDGET = 2048  # MB
+DEFAULT_CACHE_SIZE = 4096  # MB
+COMPILE_TOLERANCE = 1e-3
 DEFAULT_SCORE_THRESHOLD = {
     "PiStacking_P": 0.7,  # Top 40%
     "PiStacking_T": 0.7,
@@ -48,6 +58,71 @@ DEFAULT_SCORE_THRESHOLD = {
 }
 
 
+def _no_progress(message: str, percentage: int):
+    pass
+
+
+def _no_stop() -> bool:
+    return False
+
+
+_NO_PROFILER = ModelingProfiler(enabled=False)
+
+
+def load_checkpoint(model_path: str | os.PathLike) -> dict:
+    """Load the checkpoint whose tensors are memory-mapped (torch>=2.1, zip format)
+
+    Args:
+        model_path: checkpoint path
+
+    Returns:
+        checkpoint: {config, model, score_distributions}
+    """
+    try:
+        return torch.load(model_path, map_location="cpu", mmap=True, weights_only=False)
+    except (TypeError, RuntimeError):
+        # NOTE: old torch or legacy (non-zip) checkpoint
+        return torch.load(model_path, map_location="cpu")
+
+
+def get_ligand_center(ref_ligand_path: str | os.PathLike) -> NDArray[np.float32]:
+    extension = os.path.splitext(ref_ligand_path)[1]
+    ref_ligand = next(pybel.readfile(extension[1:], str(ref_ligand_path)))
+    return np.mean(
+        [atom.coords for atom in ref_ligand.atoms], axis=0, dtype=np.float32
+    )
+
+
+@dataclass
+class ModelingResult:
+    """Retained network outputs of a modeling run, see `PharmacoNet.rebuild_model`"""
+
+    pdbblock: str
+    center: tuple[float, float, float]
+    tokens: NDArray[np.int64]  # [Ntoken, 4] - (x, y, z, interaction type)
+    token_positions: NDArray[np.float32]  # [Ntoken, 3]
+    token_scores: NDArray[np.float32]  # [Ntoken,]
+    relative_scores: NDArray[np.float64]  # [Ntoken,]
+    cavity_narrow: NDArray[np.float32]  # [D, H, W], probability
+    cavity_wide: NDArray[np.float32]  # [D, H, W], probability
+    non_protein_area: NDArray[np.bool_] | None  # [D, H, W]
+    hotspot_indices: NDArray[np.int64]  # [Nhotspot,], tokens whose density maps are calculated
+    density_map_crops: list[NDArray[np.float32]]  # [Nhotspot,], raw density maps in the box area bounding boxes
+    focus_threshold: float  # thresholds of the inference
+    score_threshold: dict[str, float]
+
+
+@dataclass
+class BindingSiteCandidate:
+    """Candidate binding site of the whole-protein scanning, see `PharmacoNet.scan_binding_sites`"""
+
+    center: tuple[float, float, float]  # hotspot-weighted center, input of `PharmacoNet.run`
+    score: float  # sum of the relative scores of the hotspots
+    num_hotspots: int
+    cavity_volume: float  # A^3, narrow cavity within the site radius
+    tile_center: tuple[float, float, float]  # center of the scanning tile which detected the site
+
+
 class PharmacoNet:
     def __init__(
         self,
@@ -55,18 +130,50 @@ class PharmacoNet:
         focus_threshold: float = DEFAULT_FOCUS_THRESHOLD,
         box_threshold: float = DEFAULT_BOX_THRESHOLD,
         score_threshold: float | dict[str, float] = DEFAULT_SCORE_THRESHOLD,
+        segmentation_memory_budget: int = DEFAULT_SEGMENTATION_MEMORY_BUDGET,
+        cache_dir: str | os.PathLike | None = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        backend: str = "eager",
+        backend_path: str | os.PathLike | None = None,
+        precision: str = "fp32",
+        roi_segmentation: bool = True,
     ):
-        checkpoint = torch.load(model_path, map_location="cpu")
+        """PharmacoNet
+
+        Args:
+            model_path: checkpoint path
+            focus_threshold: probability threshold of cavity
+            box_threshold: probability threshold of density maps
+            score_threshold: percentile threshold of hotspot scores (for each interaction type)
+            segmentation_memory_budget: memory (MB) for batched density map calculation
+            cache_dir: directory of preprocessing cache (if None, cache is not used)
+            cache_size: maximum size (MB) of preprocessing cache
+            backend: "eager" or "torchscript" (traced, frozen and optimized network stages)
+            backend_path: directory of exported torchscript modules (loaded if exists, otherwise saved)
+            precision: "fp32", "bf16" (autocast) or "int8" (dynamic quantization of linear layers)
+            roi_segmentation: if True, density maps are decoded in the region of interest of each hotspot
+        """
+        checkpoint = load_checkpoint(model_path)
         self.config = config = OmegaConf.create(checkpoint["config"])
-        model = build_model(config.MODEL)
-        model.load_state_dict(checkpoint["model"])
-        model.eval()
-        self.model: PharmacoFormer = model
+        self.logger = logging.getLogger("PharmacoNet")
+        assert precision in ("fp32", "bf16", "int8"), f"unknown precision: {precision}"
+        assert backend in ("eager", "torchscript"), f"unknown backend: {backend}"
+        if backend == "torchscript":
+            assert precision != "bf16", "bf16 autocast is not supported for torchscript backend"
+        self.precision = precision
+        self.backend = backend
+        self.backend_path = backend_path
+
+        # NOTE: the network is constructed at the first modeling request (see `PharmacoNet.model`).
+        # the weights stay memory-mapped, so that worker processes share the page-cached checkpoint.
+        self._state_dict: dict[str, Tensor] | None = checkpoint["model"]
+        self._model: PharmacoFormer | None = None
+        self._model_lock = threading.Lock()
         self.smoothing = GaussianSmoothing(kernel_size=5, sigma=0.5)
         self.focus_threshold = focus_threshold
         self.box_threshold = box_threshold
         self.score_distributions = {
-            typ: np.array(distribution["focus"])
+            typ: np.sort(np.array(distribution["focus"], dtype=np.float64))
             for typ, distribution in checkpoint["score_distributions"].items()
         }
 
@@ -86,244 +193,920 @@ class PharmacoNet:
         self.out_resolution = config.VOXEL.OUT.RESOLUTION
         self.out_size = config.VOXEL.OUT.SIZE
 
-        self.logger = logging.getLogger("PharmacoNet")
+        self.segmentation_memory_budget = segmentation_memory_budget
+        self.roi_segmentation = roi_segmentation
+        self.cache: PreprocessingCache | None = (
+            PreprocessingCache(cache_dir, cache_size) if cache_dir is not None else None
+        )
+
+    @property
+    def model(self) -> PharmacoFormer:
+        """PharmacoFormer, which is constructed at the first access"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self.__build_model()
+        return self._model
+
+    def load_model(self) -> PharmacoFormer:
+        """Construct the network now (e.g. before the first modeling request in a background thread)"""
+        return self.model
+
+    def __build_model(self) -> PharmacoFormer:
+        assert self._state_dict is not None
+        model = build_model(self.config.MODEL)
+        try:
+            # NOTE: the parameters share the storage of the memory-mapped checkpoint (torch>=2.1)
+            model.load_state_dict(self._state_dict, assign=True)
+        except TypeError:
+            model.load_state_dict(self._state_dict)
+        model.eval()
+        self._state_dict = None
+        if self.precision == "int8":
+            # NOTE: dynamic quantization does not support Conv3d.
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        if self.backend == "torchscript":
+            model = self.__compile_model(model, self.backend_path)
+        return model
+
+    def __compile_model(
+        self,
+        model: PharmacoFormer,
+        backend_path: str | os.PathLike | None,
+    ) -> PharmacoFormer:
+        in_channels, in_size = len(PROTEIN_CHANNEL_LIST), self.config.VOXEL.IN.SIZE
+        if backend_path is not None and os.path.exists(backend_path):
+            traced_modules = jit.load_traced_modules(backend_path)
+        else:
+            traced_modules = jit.trace_model(model, in_channels, in_size)
+            if backend_path is not None:
+                jit.save_traced_modules(traced_modules, backend_path)
+        compiled_model = jit.apply_traced_modules(model, traced_modules)
+        max_diff = jit.check_equivalence(model, compiled_model, in_channels, in_size)
+        if max_diff > COMPILE_TOLERANCE:
+            self.logger.warning(f"TorchScript backend is not equivalent (max diff: {max_diff:.2e}), use eager backend")
+            return model
+        self.logger.debug(f"TorchScript backend (max diff: {max_diff:.2e})")
+        return compiled_model
+
+    def _autocast(self) -> contextlib.AbstractContextManager:
+        if self.precision == "bf16":
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def _get_segmentation_chunk_size(
+        self,
+        multi_scale_features: tuple[Tensor, ...],
+        roi_size: int | None = None,
+    ) -> int:
+        """Number of hotspots per segmentation forward call within the memory budget
+
+        Args:
+            multi_scale_features: List[FloatTensor [1, F, D, H, W]]
+            roi_size: size of the region of interest (if None, the full grid is segmented)
+
+        Returns:
+            chunk_size: int
+        """
+        # NOTE: for each hotspot, the mask head holds the box features [F_scale, D, H, W]
+        # and about three decoder feature maps [C, D, H, W] (lateral, upsampled, output) per scale.
+        decoder_channels = self.model.mask_head.decoder.channels
+        num_bytes = 0
+        for features in multi_scale_features:
+            _, F, D, H, W = features.shape
+            num_bytes += (F + 3 * decoder_channels) * D * H * W * features.element_size()
+        if roi_size is not None:
+            num_bytes = num_bytes * (roi_size / self.out_size) ** 3
+        budget = self.segmentation_memory_budget * 1024 * 1024
+        return max(int(budget // num_bytes), 1)
+
+    def __get_rois(self, hotspots: Tensor, margin: int, align: int) -> tuple[Tensor, Tensor]:
+        """Region of interest of each hotspot: box area bounding box with the receptive field margin
+
+        Args:
+            hotspots: LongTensor [Ntoken', 4]
+            margin: receptive field margin of the mask head (output voxels)
+            align: stride of the coarsest feature map
+
+        Returns:
+            roi_sizes: LongTensor [Ntoken',]
+            roi_starts: LongTensor [Ntoken', 3] - (x, y, z), inside of the grid
+        """
+        roi_sizes, roi_starts = [], []
+        for x, y, z, t in hotspots.tolist():
+            radius = token_inference.get_box_radius(t, self.config.VOXEL.RADII.PHARMACOPHORE, self.out_resolution)
+            extent = (2 * radius - 1) + 2 * margin
+            # NOTE: an aligned cube can contain any range of `extent` voxels
+            roi_size = min(math.ceil((extent + align - 1) / align) * align, self.out_size)
+            roi_sizes.append(roi_size)
+            roi_starts.append(
+                [min(max((c - (radius - 1) - margin) // align * align, 0), self.out_size - roi_size) for c in (x, y, z)]
+            )
+        return torch.tensor(roi_sizes, dtype=torch.long), torch.tensor(roi_starts, dtype=torch.long).view(-1, 3)
+
+    def get_relative_scores(self, token_scores: Tensor, token_types: Tensor) -> Tensor:
+        """Percentile of token scores in the score distributions of their interaction types
+
+        Args:
+            token_scores: FloatTensor [Ntoken,]
+            token_types: LongTensor [Ntoken,]
+
+        Returns:
+            relative_scores: DoubleTensor [Ntoken,]
+        """
+        scores = token_scores.double().numpy()
+        types = token_types.numpy()
+        relative_scores = np.zeros(scores.shape, dtype=np.float64)
+        for type_idx, typ in enumerate(INTERACTION_LIST):
+            mask = types == type_idx
+            if mask.any():
+                distribution = self.score_distributions[typ]
+                # NOTE: number of reference scores lower than the token score (distribution is sorted)
+                relative_scores[mask] = np.searchsorted(distribution, scores[mask], side="left") / distribution.size
+        return torch.from_numpy(relative_scores)
 
     @torch.no_grad()
-    def run_gui(
+    def run(
         self,
         protein_pdb_path: str,
-        ref_ligand_path: str,
-        thread,
+        center_or_ref_ligand: str | ArrayLike,
+        progress_fn: Callable[[str, int], object] | None = None,
+        stop_fn: Callable[[], bool] | None = None,
+        profiler: ModelingProfiler | None = None,
     ) -> PharmacophoreModel | None:
+        """Protein-based Pharmacophore Modeling
 
-        thread.progress_updated.emit("Pocket Extraction...", 0)
-        extension = os.path.splitext(ref_ligand_path)[1]
-        ref_ligand = next(pybel.readfile(extension[1:], str(ref_ligand_path)))
-        center = np.mean(
-            [atom.coords for atom in ref_ligand.atoms], axis=0, dtype=np.float32
-        )
-        protein_image, non_protein_area, token_positions, tokens = self.__parse_protein(
-            protein_pdb_path, center
-        )
-        with open(protein_pdb_path) as f:
-            pdbblock: str = "\n".join(f.readlines())
-
-        density_maps = self.__create_density_maps_gui(
-            torch.from_numpy(protein_image),
-            (
-                torch.from_numpy(non_protein_area)
-                if non_protein_area is not None
-                else None
-            ),
-            torch.from_numpy(token_positions),
-            torch.from_numpy(tokens),
-            thread,
+        Args:
+            protein_pdb_path: protein structure file (pdb)
+            center_or_ref_ligand: binding site center (x, y, z) or reference ligand file path
+            progress_fn: called with (message, percentage) at each modeling stage
+            stop_fn: polled between modeling stages, return True to cancel the modeling
+            profiler: records time and memory of each stage
+
+        Returns:
+            pharmacophore_model: PharmacophoreModel, or None if the modeling is cancelled
+        """
+        progress_fn = progress_fn if progress_fn is not None else _no_progress
+        result = self.inference(protein_pdb_path, center_or_ref_ligand, progress_fn, stop_fn, profiler)
+        if result is None:
+            return None
+        progress_fn("Export...", 100)
+        return self.rebuild_model(result, profiler=profiler)
+
+    @torch.no_grad()
+    def inference(
+        self,
+        protein_pdb_path: str,
+        center_or_ref_ligand: str | ArrayLike,
+        progress_fn: Callable[[str, int], object] | None = None,
+        stop_fn: Callable[[], bool] | None = None,
+        profiler: ModelingProfiler | None = None,
+    ) -> ModelingResult | None:
+        """Network inference of Pharmacophore Modeling
+
+        The result is retained to create pharmacophore models with other thresholds (`rebuild_model`).
+
+        Args:
+            protein_pdb_path: protein structure file (pdb)
+            center_or_ref_ligand: binding site center (x, y, z) or reference ligand file path
+            progress_fn: called with (message, percentage) at each modeling stage
+            stop_fn: polled between modeling stages, return True to cancel the modeling
+            profiler: records time and memory of each stage
+
+        Returns:
+            result: ModelingResult, or None if the modeling is cancelled
+        """
+        results = self.inference_batch([protein_pdb_path], [center_or_ref_ligand], progress_fn, stop_fn, profiler)
+        return results[0] if results is not None else None
+
+    @torch.no_grad()
+    def inference_batch(
+        self,
+        protein_pdb_paths: Sequence[str],
+        centers_or_ref_ligands: Sequence[str | ArrayLike],
+        progress_fn: Callable[[str, int], object] | None = None,
+        stop_fn: Callable[[], bool] | None = None,
+        profiler: ModelingProfiler | None = None,
+    ) -> list[ModelingResult] | None:
+        """Batched network inference of Pharmacophore Modeling
+
+        The voxel images of several complexes (or several binding sites of a protein)
+        are stacked into one forward pass.
+
+        Args:
+            protein_pdb_paths: protein structure files (pdb)
+            centers_or_ref_ligands: binding site centers (x, y, z) or reference ligand file paths
+            progress_fn: called with (message, percentage) at each modeling stage
+            stop_fn: polled between modeling stages, return True to cancel the modeling
+            profiler: records time and memory of each stage
+
+        Returns:
+            results: list[ModelingResult], or None if the modeling is cancelled
+        """
+        progress_fn = progress_fn if progress_fn is not None else _no_progress
+        stop_fn = stop_fn if stop_fn is not None else _no_stop
+        profiler = profiler if profiler is not None else _NO_PROFILER
+
+        progress_fn("Pocket Extraction...", 0)
+        protein_blocks: dict[str, str] = {}
+        inputs = []
+        for protein_pdb_path, center_or_ref_ligand in zip(protein_pdb_paths, centers_or_ref_ligands, strict=True):
+            if stop_fn():
+                return None
+            if isinstance(center_or_ref_ligand, (str, os.PathLike)):
+                center = get_ligand_center(center_or_ref_ligand)
+            else:
+                center = np.asarray(center_or_ref_ligand, dtype=np.float32).reshape(3)
+            if protein_pdb_path not in protein_blocks:
+                with open(protein_pdb_path) as f:
+                    protein_blocks[protein_pdb_path] = f.read()
+            protein_block = protein_blocks[protein_pdb_path]
+            inputs.append((protein_block, center, *self.__preprocess(protein_block, center, profiler)))
+
+        results = self.__create_density_maps(
+            torch.from_numpy(np.stack([protein_image for _, _, protein_image, _, _, _ in inputs])),
+            [torch.from_numpy(token_positions) for _, _, _, _, token_positions, _ in inputs],
+            [torch.from_numpy(tokens) for _, _, _, _, _, tokens in inputs],
+            progress_fn,
+            stop_fn,
+            profiler,
         )
-        if density_maps is not None:
+        if results is None:
+            return None
+        out = []
+        for (protein_block, center, _, non_protein_area, _, _), result in zip(inputs, results, strict=True):
             x, y, z = center.tolist()
-            pharmacophore_model = PharmacophoreModel.create(
-                pdbblock, (x, y, z), self.out_resolution, self.out_size, density_maps
+            out.append(
+                ModelingResult(
+                    pdbblock=protein_block,
+                    center=(x, y, z),
+                    non_protein_area=(
+                        np.array(non_protein_area[0], dtype=np.bool_)
+                        if non_protein_area is not None
+                        else None
+                    ),
+                    focus_threshold=self.focus_threshold,
+                    score_threshold=dict(self.score_threshold),
+                    **result,
+                )
             )
-            return pharmacophore_model
-        else:
+        return out
+
+    @torch.no_grad()
+    def run_batch(
+        self,
+        protein_pdb_paths: Sequence[str],
+        centers_or_ref_ligands: Sequence[str | ArrayLike],
+        progress_fn: Callable[[str, int], object] | None = None,
+        stop_fn: Callable[[], bool] | None = None,
+        profiler: ModelingProfiler | None = None,
+    ) -> list[PharmacophoreModel] | None:
+        """Batched Protein-based Pharmacophore Modeling
+
+        Args:
+            protein_pdb_paths: protein structure files (pdb)
+            centers_or_ref_ligands: binding site centers (x, y, z) or reference ligand file paths
+            progress_fn: called with (message, percentage) at each modeling stage
+            stop_fn: polled between modeling stages, return True to cancel the modeling
+            profiler: records time and memory of each stage
+
+        Returns:
+            pharmacophore_models: list[PharmacophoreModel], or None if the modeling is cancelled
+        """
+        progress_fn = progress_fn if progress_fn is not None else _no_progress
+        results = self.inference_batch(protein_pdb_paths, centers_or_ref_ligands, progress_fn, stop_fn, profiler)
+        if results is None:
             return None
+        progress_fn("Export...", 100)
+        return [self.rebuild_model(result, profiler=profiler) for result in results]
 
-    def __parse_protein(
+    @torch.no_grad()
+    def scan_binding_sites(
         self,
         protein_pdb_path: str,
-        center: NDArray[np.float32],
-    ) -> tuple[NDArray, NDArray | None, NDArray, NDArray]:
+        stride: int | None = None,
+        batch_size: int = 4,
+        canvas_size: int = 128,
+        site_radius: float = 8.0,
+        progress_fn: Callable[[str, int], object] | None = None,
+        stop_fn: Callable[[], bool] | None = None,
+        profiler: ModelingProfiler | None = None,
+    ) -> list[BindingSiteCandidate] | None:
+        """Binding site detection for apo protein structures
 
-        self.logger.debug("Extract Pocket...")
-        with tempfile.TemporaryDirectory() as dirname:
-            pocket_path = os.path.join(dirname, "pocket.pdb")
-            extract_pocket(
-                protein_pdb_path, pocket_path, center, self.pocket_cutoff
-            )  # root(3)
-            protein_obj: Protein = Protein.from_pdbfile(pocket_path)
-            with open(protein_pdb_path) as f:
-                pdbblock: str = "\n".join(f.readlines())
-        self.logger.debug("Extract Pocket Finish")
+        The whole protein is tiled with overlapping voxel images whose grids are aligned,
+        so that the protein is voxelized once per canvas (a block of tiles) and each tile is a view of it.
+        The tiles are batched into the feature extraction, token head and cavity head,
+        and the hotspots of each tile are clustered into a candidate site.
 
-        token_positions, token_classes = token_inference.get_token_informations(
-            protein_obj
-        )
-        tokens, filter = token_inference.get_token_and_filter(
-            token_positions, token_classes, center, self.out_resolution, self.out_size
-        )
-        token_positions = token_positions[filter]
+        Args:
+            protein_pdb_path: protein structure file (pdb)
+            stride: distance between the tile centers (input voxels, default: half of the image size)
+            batch_size: number of tiles in a forward pass
+            canvas_size: maximum size of the canvas (input voxels)
+            site_radius: radius (A) of the binding site, for the cavity volume and non-maximum suppression
+            progress_fn: called with (message, percentage) at each modeling stage
+            stop_fn: polled between forward passes, return True to cancel the scanning
+            profiler: records time and memory of each stage
+
+        Returns:
+            candidates: list[BindingSiteCandidate] sorted by score, or None if the scanning is cancelled
+        """
+        progress_fn = progress_fn if progress_fn is not None else _no_progress
+        stop_fn = stop_fn if stop_fn is not None else _no_stop
+        profiler = profiler if profiler is not None else _NO_PROFILER
+        in_resolution, in_size = self.config.VOXEL.IN.RESOLUTION, self.config.VOXEL.IN.SIZE
+        stride = stride if stride is not None else in_size // 2
+        assert 0 < stride <= in_size, f"invalid stride: {stride}"
+
+        progress_fn("Protein Parsing...", 0)
+        with open(protein_pdb_path) as f:
+            protein_block = f.read()
+        with profiler.stage("pocket_extraction"):
+            # NOTE: same residue selection as the pocket of `run` (amino acids only; waters, ions and ligands are removed)
+            protein_block = extract_pocket_pdbblock(protein_block, np.zeros(3), np.inf)
+        with profiler.stage("protein_parsing"):
+            protein_obj: Protein = Protein.from_pdbblock(protein_block)
+        with profiler.stage("token_inference"):
+            token_positions, token_classes = token_inference.get_token_informations(protein_obj)
+        with profiler.stage("voxelization"):
+            protein_positions, protein_features = pointcloud.get_protein_pointcloud(protein_obj)
 
-        protein_positions, protein_features = pointcloud.get_protein_pointcloud(
-            protein_obj
+        # NOTE: tile centers cover the bounding box of the protein
+        step = stride * in_resolution
+        lower, upper = protein_positions.min(axis=0), protein_positions.max(axis=0)
+        num_tiles = np.ceil((upper - lower) / step).astype(np.int64) + 1  # [3,]
+        origin = (lower + upper) / 2 - (num_tiles - 1) * step / 2
+        # NOTE: each canvas contains (block_size)^3 tiles
+        block_size = int(min(max((canvas_size - in_size) // stride + 1, 1), num_tiles.max()))
+        canvas_voxelizer = create_voxelizer(
+            in_resolution, in_size + (block_size - 1) * stride, sigma=(1 / 3), library=MOLVOXEL_LIBRARY
         )
+        num_blocks = np.ceil(num_tiles / block_size).astype(np.int64)
+        total_tiles = int(np.prod(num_tiles))
 
-        self.logger.debug("MolVoxel:Voxelize Pocket...")
-        protein_image = np.asarray(
-            self.in_voxelizer.forward_features(
-                protein_positions,
+        candidates: list[BindingSiteCandidate] = []
+        pending: list[tuple[NDArray[np.float32], NDArray[np.float32], NDArray, NDArray]] = []
+        num_done = 0
+        for block_idx in np.ndindex(*num_blocks.tolist()):
+            tile_indices = [
+                np.asarray(tile_idx) + np.asarray(block_idx) * block_size
+                for tile_idx in np.ndindex(block_size, block_size, block_size)
+            ]
+            tile_indices = [tile_idx for tile_idx in tile_indices if np.all(tile_idx < num_tiles)]
+            # NOTE: the canvas grid point i is the grid point (i - offset) of the tile with the offset
+            first_center = origin + np.asarray(block_idx) * block_size * step
+            canvas_center = (first_center + (block_size - 1) * step / 2).astype(np.float32)
+            canvas = None
+            for tile_idx in tile_indices:
+                num_done += 1
+                center = (origin + tile_idx * step).astype(np.float32)
+                with profiler.stage("token_inference"):
+                    tokens, filter = token_inference.get_token_and_filter(
+                        token_positions, token_classes, center, self.out_resolution, self.out_size
+                    )
+                if len(tokens) == 0:
+                    continue
+                if canvas is None:
+                    with profiler.stage("voxelization"):
+                        canvas = self.__voxelize_canvas(
+                            canvas_voxelizer, protein_positions, protein_features, canvas_center
+                        )
+                offset = (tile_idx - np.asarray(block_idx) * block_size) * stride
+                image = canvas[
+                    :,
+                    offset[0] : offset[0] + in_size,
+                    offset[1] : offset[1] + in_size,
+                    offset[2] : offset[2] + in_size,
+                ]
+                pending.append((center, image, token_positions[filter], tokens))
+                if len(pending) == batch_size:
+                    if stop_fn():
+                        return None
+                    progress_fn(
+                        f"Binding Site Scanning... [{num_done}/{total_tiles}]", int(num_done / total_tiles * 100)
+                    )
+                    candidates.extend(self.__scan_tiles(pending, site_radius, profiler))
+                    pending = []
+        if len(pending) > 0:
+            if stop_fn():
+                return None
+            candidates.extend(self.__scan_tiles(pending, site_radius, profiler))
+
+        # NOTE: non-maximum suppression, the overlapping tiles detect the same site
+        candidates.sort(key=lambda candidate: candidate.score, reverse=True)
+        selected_candidates: list[BindingSiteCandidate] = []
+        for candidate in candidates:
+            if all(math.dist(candidate.center, other.center) >= site_radius for other in selected_candidates):
+                selected_candidates.append(candidate)
+        progress_fn("Binding Site Scanning Finish", 100)
+        return selected_candidates
+
+    def __voxelize_canvas(
+        self,
+        voxelizer: BaseVoxelizer,
+        protein_positions: NDArray[np.float32],
+        protein_features: NDArray[np.float32],
+        center: NDArray[np.float32],
+    ) -> NDArray[np.float32]:
+        # NOTE: atoms far from the canvas have no density on it
+        half_width = voxelizer.resolution * (voxelizer.dimension - 1) / 2 + 3 * self.config.VOXEL.RADII.PROTEIN
+        mask = np.all(np.abs(protein_positions - center) < half_width, axis=1)
+        return np.asarray(
+            voxelizer.forward_features(
+                protein_positions[mask],
                 center,
-                protein_features,
+                protein_features[mask],
                 radii=self.config.VOXEL.RADII.PROTEIN,
             ),
             np.float32,
         )
-        if self.config.VOXEL.RADII.PROTEIN_MASKING > 0:
-            non_protein_area = np.logical_not(
-                np.asarray(
-                    self.in_voxelizer.forward_single(
-                        protein_positions,
-                        center,
-                        radii=self.config.VOXEL.RADII.PROTEIN_MASKING,
-                    ),
-                    np.bool_,
+
+    def __scan_tiles(
+        self,
+        tiles: list[tuple[NDArray[np.float32], NDArray[np.float32], NDArray, NDArray]],
+        site_radius: float,
+        profiler: ModelingProfiler,
+    ) -> list[BindingSiteCandidate]:
+        """Hotspot detection of the scanning tiles
+
+        Args:
+            tiles: List[(center [3,], protein image [C, D, H, W], token positions [Ntoken, 3], tokens [Ntoken, 4])]
+            site_radius: radius (A) of the binding site
+            profiler: records time and memory of each stage
+
+        Returns:
+            candidates: list[BindingSiteCandidate], a candidate for each tile with hotspots
+        """
+        protein_images = torch.from_numpy(np.stack([image for _, image, _, _ in tiles]))
+        tokens_list = [torch.from_numpy(tokens).to(dtype=torch.long) for _, _, _, tokens in tiles]
+        with profiler.stage("forward_feature"), self._autocast():
+            bottom_features = self.model.forward_feature(protein_images)[-1]
+        with profiler.stage("token_head"), self._autocast():
+            token_scores_list, _ = self.model.forward_token_prediction(bottom_features, tokens_list)
+        with profiler.stage("cavity_head"), self._autocast():
+            cavity_narrow, cavity_wide = self.model.forward_cavity_extraction(bottom_features)
+        cavity_narrow = cavity_narrow[:, 0].float().sigmoid() > self.focus_threshold  # [N, D, H, W]
+        cavity_wide = cavity_wide[:, 0].float().sigmoid() > self.focus_threshold  # [N, D, H, W]
+
+        # NOTE: center of the output voxels relative to the tile center
+        grid = (np.arange(self.out_size) + 0.5 - self.out_size / 2) * self.out_resolution
+        candidates = []
+        for tile_idx, (center, _, token_positions, _) in enumerate(tiles):
+            tokens = tokens_list[tile_idx]
+            relative_scores = self.get_relative_scores(token_scores_list[tile_idx].float().sigmoid(), tokens[:, 3])
+            selected_indices = self.__select_hotspots(
+                tokens, relative_scores, cavity_narrow[tile_idx], cavity_wide[tile_idx], self.score_threshold
+            ).numpy()
+            if len(selected_indices) == 0:
+                continue
+            weights = relative_scores.numpy()[selected_indices]
+            site_center = np.average(token_positions[selected_indices], axis=0, weights=weights)
+            dx, dy, dz = ((grid + (center[i] - site_center[i])) ** 2 for i in range(3))
+            in_site = (dx[:, None, None] + dy[None, :, None] + dz[None, None, :]) < site_radius**2
+            cavity_volume = float(np.count_nonzero(cavity_narrow[tile_idx].numpy() & in_site)) * self.out_resolution**3
+            x, y, z = site_center.tolist()
+            candidates.append(
+                BindingSiteCandidate(
+                    center=(x, y, z),
+                    score=float(weights.sum()),
+                    num_hotspots=len(selected_indices),
+                    cavity_volume=cavity_volume,
+                    tile_center=tuple(center.tolist()),
                 )
             )
-        else:
-            non_protein_area = None
-        self.logger.debug("MolVoxel:Voxelize Pocket Finish")
+        return candidates
 
-        return protein_image, non_protein_area, token_positions, tokens
+    @torch.no_grad()
+    def rebuild_model(
+        self,
+        result: ModelingResult,
+        focus_threshold: float | None = None,
+        box_threshold: float | None = None,
+        score_threshold: float | dict[str, float] | None = None,
+        profiler: ModelingProfiler | None = None,
+        keep_density_maps: bool = False,
+    ) -> PharmacophoreModel:
+        """Create Pharmacophore Model from the retained network result
+
+        Density maps are only calculated for the hotspots selected at inference,
+        so `focus_threshold` and `score_threshold` cannot be lower than the thresholds of the inference.
 
-    def __create_density_maps_gui(
+        Args:
+            result: ModelingResult from `inference`
+            focus_threshold: probability threshold of cavity (default: self.focus_threshold)
+            box_threshold: probability threshold of density maps (default: self.box_threshold)
+            score_threshold: percentile threshold of hotspot scores (default: self.score_threshold)
+            profiler: records time and memory of each stage
+            keep_density_maps: if True, the sparse density maps are stored in the model
+
+        Returns:
+            pharmacophore_model: PharmacophoreModel
+        """
+        profiler = profiler if profiler is not None else _NO_PROFILER
+        focus_threshold = self.focus_threshold if focus_threshold is None else focus_threshold
+        box_threshold = self.box_threshold if box_threshold is None else box_threshold
+        if score_threshold is None:
+            score_threshold = self.score_threshold
+        elif not isinstance(score_threshold, dict):
+            score_threshold = {typ: score_threshold for typ in INTERACTION_LIST}
+        if focus_threshold < result.focus_threshold:
+            self.logger.warning(
+                f"focus_threshold ({focus_threshold}) is lower than the inference ({result.focus_threshold})"
+            )
+            focus_threshold = result.focus_threshold
+        for typ in INTERACTION_LIST:
+            if score_threshold[typ] < result.score_threshold[typ]:
+                self.logger.warning(
+                    f"score_threshold of {typ} ({score_threshold[typ]}) is lower than the inference"
+                    f" ({result.score_threshold[typ]})"
+                )
+        score_threshold = {typ: max(score_threshold[typ], result.score_threshold[typ]) for typ in INTERACTION_LIST}
+
+        cavity_narrow = torch.from_numpy(result.cavity_narrow) > focus_threshold  # [D, H, W]
+        cavity_wide = torch.from_numpy(result.cavity_wide) > focus_threshold  # [D, H, W]
+        hotspot_indices = torch.from_numpy(result.hotspot_indices)
+        selected = self.__select_hotspots(
+            torch.from_numpy(result.tokens)[hotspot_indices],
+            torch.from_numpy(result.relative_scores)[hotspot_indices],
+            cavity_narrow,
+            cavity_wide,
+            score_threshold,
+        ).tolist()
+        hotspot_indices = hotspot_indices[selected]
+        hotspots = torch.from_numpy(result.tokens)[hotspot_indices]  # [Ntoken', 4]
+        hotspot_positions = result.token_positions[hotspot_indices.numpy()]  # [Ntoken', 3]
+        relative_scores = result.relative_scores[hotspot_indices.numpy()].tolist()
+
+        density_maps: Iterable[dict] = ()
+        if len(selected) > 0:
+            available_area = cavity_narrow
+            if result.non_protein_area is not None:
+                available_area = available_area & torch.from_numpy(result.non_protein_area)
+            available_area_crops = self.__get_available_area_crops(hotspots, available_area)
+            density_maps = self.__iter_density_maps(
+                hotspots,
+                relative_scores,
+                hotspot_positions,
+                [result.density_map_crops[idx] for idx in selected],
+                available_area_crops,
+                box_threshold,
+                profiler,
+            )
+        with profiler.stage("pharmacophore_model"):
+            # NOTE: the density maps are streamed into the graph (`smoothing` stages are nested here)
+            return PharmacophoreModel.create(
+                result.pdbblock, result.center, self.out_resolution, self.out_size, density_maps, keep_density_maps
+            )
+
+    def __iter_density_maps(
         self,
-        protein_image: Tensor,
-        non_protein_area: Tensor | None,
-        token_positions: Tensor,
-        tokens: Tensor,
+        hotspots: Tensor,
+        relative_scores: list[float],
+        hotspot_positions: NDArray[np.float32],
+        density_map_crops: list[NDArray[np.float32]],
+        available_area_crops: list[tuple[tuple[slice, slice, slice], Tensor]],
+        box_threshold: float,
+        profiler: ModelingProfiler,
+    ) -> Iterator[dict]:
+        """Mask, smooth and threshold the density maps one by one
+
+        Each density map is processed in its box area bounding box (it is zero outside after masking),
+        and yielded as a sparse density map as soon as it is ready.
+
+        Args:
+            hotspots: LongTensor [Ntoken', 4]
+            relative_scores: List[float]
+            hotspot_positions: FloatArray [Ntoken', 3]
+            density_map_crops: List[FloatArray [Dbox, Hbox, Wbox]]
+            available_area_crops: List[(bounding box slices, BoolTensor [Dbox, Hbox, Wbox])]
+            box_threshold: probability threshold of density maps
+            profiler: records time and memory of each stage
+
+        Yields:
+            density_map: {coords, type, position, score, map (SparseDensityMap)}
+        """
+        for token, score, position, density_map_crop, (bbox, available_area_crop) in zip(
+            hotspots, relative_scores, hotspot_positions, density_map_crops, available_area_crops, strict=True
+        ):
+            with profiler.stage("smoothing"):
+                # NOTE: masking should be performed before smoothing - masked area is not trained.
+                density_map = torch.from_numpy(density_map_crop) * available_area_crop
+                density_map = self.smoothing.forward_support(density_map) * available_area_crop
+                density_map[density_map < box_threshold] = 0.0
+                offset = (bbox[0].start, bbox[1].start, bbox[2].start)
+                sparse_map = SparseDensityMap.from_crop(density_map.numpy(), offset, self.out_size)
+            if sparse_map.scores.max(initial=0.0) < 1e-6:
+                continue
+            yield {
+                "coords": tuple(token[:3].tolist()),
+                "type": INTERACTION_LIST[int(token[3])],
+                "position": tuple(position.tolist()),
+                "score": float(score),
+                "map": sparse_map,
+            }
+
+    def run_gui(
+        self,
+        protein_pdb_path: str,
+        ref_ligand_path: str,
         thread,
-    ):
-        protein_image = protein_image.to(dtype=torch.float)
-        token_positions = token_positions.to(dtype=torch.float)
-        tokens = tokens.to(dtype=torch.long)
-        non_protein_area = (
-            non_protein_area.to(dtype=torch.bool)
-            if non_protein_area is not None
-            else None
+    ) -> PharmacophoreModel | None:
+        return self.run(
+            protein_pdb_path,
+            ref_ligand_path,
+            thread.progress_updated.emit,
+            lambda: thread.force_stop,
         )
 
-        protein_image = protein_image.unsqueeze(0)
-        if thread.force_stop:
-            return
-        thread.progress_updated.emit("Feature Extraction...", 5)
-        multi_scale_features = self.model.forward_feature(
-            protein_image
-        )  # List[[1, D, H, W, F]]
-        bottom_features = multi_scale_features[-1]
+    def __preprocess(
+        self,
+        protein_block: str,
+        center: NDArray[np.float32],
+        profiler: ModelingProfiler,
+    ) -> tuple[NDArray, NDArray | None, NDArray, NDArray]:
+        if self.cache is None:
+            return self.__parse_protein(protein_block, center, profiler)
 
-        if thread.force_stop:
-            return
-        thread.progress_updated.emit("Hot Spot Detection...", 10)
-        token_scores, token_features = self.model.forward_token_prediction(
-            bottom_features, [tokens]
-        )  # [[Ntoken,]], [[Ntoken, F]]
-        token_scores = token_scores[0].sigmoid()  # [Ntoken,]
-        token_features = token_features[0]  # [Ntoken, F]
-
-        if thread.force_stop:
-            return
-        thread.progress_updated.emit("Cavity Detection...", 15)
-        cavity_narrow, cavity_wide = self.model.forward_cavity_extraction(
-            bottom_features
-        )  # [1, 1, D, H, W], [1, 1, D, H, W]
-        cavity_narrow = (
-            cavity_narrow[0].sigmoid() > self.focus_threshold
-        )  # [1, D, H, W]
-        cavity_wide = cavity_wide[0].sigmoid() > self.focus_threshold  # [1, D, H, W]
-
-        num_tokens = tokens.shape[0]
-        indices = []
-        relative_scores = []
-        for i in range(num_tokens):
-            if thread.force_stop:
-                return
-            x, y, z, typ = tokens[i].tolist()
-            # NOTE: Check the token score
-            absolute_score = token_scores[i].item()
-            relative_score = float(
-                (
-                    self.score_distributions[INTERACTION_LIST[int(typ)]]
-                    < absolute_score
-                ).mean()
+        key = self.cache.make_key(
+            protein_block,
+            np.asarray(center, dtype=np.float32).tobytes(),
+            OmegaConf.to_yaml(self.config.VOXEL),
+        )
+        with profiler.stage("cache_load"):
+            arrays = self.cache.get(key)
+        if arrays is not None:
+            self.logger.debug("Load Preprocessed Pocket from Cache")
+            return (
+                arrays["protein_image"],
+                arrays.get("non_protein_area", None),
+                arrays["token_positions"],
+                arrays["tokens"],
             )
-            if relative_score < self.score_threshold[INTERACTION_LIST[int(typ)]]:
-                continue
-            # NOTE: Check the token exists in cavity
-            if typ in C.LONG_INTERACTION:
-                if not cavity_wide[0, x, y, z]:
-                    continue
-            else:
-                if not cavity_narrow[0, x, y, z]:
-                    continue
-            indices.append(i)
-            relative_scores.append(relative_score)
-        selected_indices = torch.tensor(indices, dtype=torch.long)  # [Ntoken',]
-
-        hotspots = tokens[selected_indices]  # [Ntoken',]
-        hotspot_positions = token_positions[selected_indices]  # [Ntoken', 3]
-        hotspot_features = token_features[selected_indices]  # [Ntoken', F]
-        del tokens
-        del token_positions
-        del token_features
-
-        density_maps_list = []
-        for idx in range(0, hotspots.size(0)):
-            if thread.force_stop:
-                return
-            thread.progress_updated.emit(
-                f"Density Calculation... [{len(density_maps_list)}/{hotspots.size(0)}]",
-                int(len(density_maps_list) / hotspots.size(0) * 80) + 20,
+        protein_image, non_protein_area, token_positions, tokens = self.__parse_protein(
+            protein_block, center, profiler
+        )
+        arrays = {"protein_image": protein_image, "token_positions": token_positions, "tokens": tokens}
+        if non_protein_area is not None:
+            arrays["non_protein_area"] = non_protein_area
+        with profiler.stage("cache_save"):
+            self.cache.put(key, arrays)
+        return protein_image, non_protein_area, token_positions, tokens
+
+    def __parse_protein(
+        self,
+        protein_block: str,
+        center: NDArray[np.float32],
+        profiler: ModelingProfiler,
+    ) -> tuple[NDArray, NDArray | None, NDArray, NDArray]:
+
+        self.logger.debug("Extract Pocket...")
+        with profiler.stage("pocket_extraction"):
+            pocket_block = extract_pocket_pdbblock(protein_block, center, self.pocket_cutoff)  # root(3)
+        with profiler.stage("protein_parsing"):
+            protein_obj: Protein = Protein.from_pdbblock(pocket_block)
+        self.logger.debug("Extract Pocket Finish")
+
+        with profiler.stage("token_inference"):
+            token_positions, token_classes = token_inference.get_token_informations(
+                protein_obj
             )
-            _hotspots, _hotspot_features = (
-                hotspots[idx : idx + 1],
-                hotspot_features[idx : idx + 1],
+            tokens, filter = token_inference.get_token_and_filter(
+                token_positions, token_classes, center, self.out_resolution, self.out_size
             )
-            density_maps = self.model.forward_segmentation(
-                multi_scale_features, [_hotspots], [_hotspot_features]
-            )[
-                0
-            ]  # [[4, D, H, W]]
-            density_maps = density_maps[0].sigmoid()  # [4, D, H, W]
-            density_maps_list.append(density_maps)
+            token_positions = token_positions[filter]
 
-        density_maps = torch.cat(density_maps_list, dim=0)  # [Ntoken', D, H, W]
+        self.logger.debug("MolVoxel:Voxelize Pocket...")
+        with profiler.stage("voxelization"):
+            protein_positions, protein_features = pointcloud.get_protein_pointcloud(
+                protein_obj
+            )
+            protein_image = np.asarray(
+                self.in_voxelizer.forward_features(
+                    protein_positions,
+                    center,
+                    protein_features,
+                    radii=self.config.VOXEL.RADII.PROTEIN,
+                ),
+                np.float32,
+            )
+            if self.config.VOXEL.RADII.PROTEIN_MASKING > 0:
+                non_protein_area = np.logical_not(
+                    np.asarray(
+                        self.in_voxelizer.forward_single(
+                            protein_positions,
+                            center,
+                            radii=self.config.VOXEL.RADII.PROTEIN_MASKING,
+                        ),
+                        np.bool_,
+                    )
+                )
+            else:
+                non_protein_area = None
+        self.logger.debug("MolVoxel:Voxelize Pocket Finish")
+
+        return protein_image, non_protein_area, token_positions, tokens
+
+    def __select_hotspots(
+        self,
+        tokens: Tensor,
+        relative_scores: Tensor,
+        cavity_narrow: Tensor,
+        cavity_wide: Tensor,
+        score_threshold: dict[str, float],
+    ) -> Tensor:
+        """Select hotspots from tokens
+
+        Args:
+            tokens: LongTensor [Ntoken, 4]
+            relative_scores: DoubleTensor [Ntoken,]
+            cavity_narrow: BoolTensor [D, H, W]
+            cavity_wide: BoolTensor [D, H, W]
+            score_threshold: percentile threshold of each interaction type
+
+        Returns:
+            selected_indices: LongTensor [Ntoken',]
+        """
+        xs, ys, zs, types = tokens.unbind(dim=1)
+        # NOTE: Check the token score
+        score_thresholds = torch.tensor(
+            [score_threshold[typ] for typ in INTERACTION_LIST], dtype=torch.float64
+        )[types]
+        # NOTE: Check the token exists in cavity
+        is_long_interaction = torch.isin(types, torch.tensor(sorted(C.LONG_INTERACTION)))
+        in_cavity = torch.where(
+            is_long_interaction, cavity_wide[xs, ys, zs], cavity_narrow[xs, ys, zs]
+        )
+        return torch.nonzero((relative_scores >= score_thresholds) & in_cavity).view(-1)
+
+    def __get_available_area_crops(
+        self,
+        hotspots: Tensor,
+        available_area: Tensor,
+    ) -> list[tuple[tuple[slice, slice, slice], Tensor]]:
+        """Available area of each hotspot in its box area bounding box
 
-        box_area = token_inference.get_box_area(
+        Args:
+            hotspots: LongTensor [Ntoken', 4]
+            available_area: BoolTensor [D, H, W]
+
+        Returns:
+            available_area_crops: List[(bounding box slices, BoolTensor [Dbox, Hbox, Wbox])]
+        """
+        box_area_crops = token_inference.get_box_area_crops(
             hotspots,
             self.config.VOXEL.RADII.PHARMACOPHORE,
             self.out_resolution,
             self.out_size,
         )
-        box_area = torch.from_numpy(box_area).to(dtype=torch.bool)  # [Ntoken', D, H, W]
-        unavailable_area = ~(
-            box_area & non_protein_area & cavity_narrow
-        )  # [Ntoken', D, H, W]
-
-        # NOTE: masking should be performed before smoothing - masked area is not trained.
-        density_maps.masked_fill_(unavailable_area, 0.0)
-        density_maps = self.smoothing(density_maps)
-        density_maps.masked_fill_(unavailable_area, 0.0)
-        density_maps[density_maps < self.box_threshold] = 0.0
-
-        if thread.force_stop:
+        return [
+            (bbox, torch.from_numpy(box_area) & available_area[bbox])
+            for bbox, box_area in box_area_crops
+        ]
+
+    def __create_density_maps(
+        self,
+        protein_images: Tensor,
+        token_positions_list: list[Tensor],
+        tokens_list: list[Tensor],
+        progress_fn: Callable[[str, int], object],
+        stop_fn: Callable[[], bool],
+        profiler: ModelingProfiler,
+    ) -> list[dict] | None:
+        """Network inference
+
+        Args:
+            protein_images: FloatTensor [N, C, D, H, W]
+            token_positions_list: List[FloatTensor [Ntoken, 3]]
+            tokens_list: List[IntTensor [Ntoken, 4]]
+
+        Returns:
+            results: list[dict], fields of ModelingResult for each image
+        """
+        num_images = protein_images.size(0)
+        protein_images = protein_images.to(dtype=torch.float)
+        token_positions_list = [token_positions.to(dtype=torch.float) for token_positions in token_positions_list]
+        tokens_list = [tokens.to(dtype=torch.long) for tokens in tokens_list]
+
+        if stop_fn():
             return
-        thread.progress_updated.emit(
-            "Export...",
-            100,
-        )
-        out = []
-        assert len(hotspots) == len(relative_scores)
-        for token, score, position, map in zip(
-            hotspots, relative_scores, hotspot_positions, density_maps, strict=True
-        ):
-            if torch.all(map < 1e-6):
-                continue
-            out.append(
-                {
-                    "coords": tuple(token[:3].tolist()),
-                    "type": INTERACTION_LIST[int(token[3])],
-                    "position": tuple(position.tolist()),
-                    "score": float(score),
-                    "map": map.numpy(),
-                }
+        progress_fn("Feature Extraction...", 5)
+        with profiler.stage("forward_feature"), self._autocast():
+            multi_scale_features = self.model.forward_feature(
+                protein_images
+            )  # List[[N, F, D, H, W]]
+        bottom_features = multi_scale_features[-1]
+
+        if stop_fn():
+            return
+        progress_fn("Hot Spot Detection...", 10)
+        with profiler.stage("token_head"), self._autocast():
+            token_scores_list, token_features_list = self.model.forward_token_prediction(
+                bottom_features, tokens_list
+            )  # List[[Ntoken,]], List[[Ntoken, F]]
+        token_scores_list = [token_scores.float().sigmoid() for token_scores in token_scores_list]
+
+        if stop_fn():
+            return
+        progress_fn("Cavity Detection...", 15)
+        with profiler.stage("cavity_head"), self._autocast():
+            cavity_narrow, cavity_wide = self.model.forward_cavity_extraction(
+                bottom_features
+            )  # [N, 1, D, H, W], [N, 1, D, H, W]
+        cavity_narrow = cavity_narrow[:, 0].float().sigmoid()  # [N, D, H, W]
+        cavity_wide = cavity_wide[:, 0].float().sigmoid()  # [N, D, H, W]
+
+        if stop_fn():
+            return
+        relative_scores_list = []
+        selected_indices_list = []
+        for image_idx in range(num_images):
+            tokens = tokens_list[image_idx]
+            relative_scores = self.get_relative_scores(token_scores_list[image_idx], tokens[:, 3])  # [Ntoken,]
+            selected_indices = self.__select_hotspots(
+                tokens,
+                relative_scores,
+                cavity_narrow[image_idx] > self.focus_threshold,
+                cavity_wide[image_idx] > self.focus_threshold,
+                self.score_threshold,
+            )  # [Ntoken',]
+            relative_scores_list.append(relative_scores)
+            selected_indices_list.append(selected_indices)
+
+        num_hotspots = sum(len(selected_indices) for selected_indices in selected_indices_list)
+        roi_layout = None
+        if self.roi_segmentation and self.model.mask_head.supports_roi:
+            roi_layout = self.model.mask_head.get_roi_layout(multi_scale_features)  # (margin, align)
+        num_done = 0
+        density_map_crops_list = []
+        for image_idx in range(num_images):
+            image_features = tuple(features[image_idx : image_idx + 1] for features in multi_scale_features)
+            selected_indices = selected_indices_list[image_idx]
+            hotspots = tokens_list[image_idx][selected_indices]  # [Ntoken', 4]
+            hotspot_features = token_features_list[image_idx][selected_indices]  # [Ntoken', F]
+            box_area_crops = token_inference.get_box_area_crops(
+                hotspots,
+                self.config.VOXEL.RADII.PHARMACOPHORE,
+                self.out_resolution,
+                self.out_size,
             )
-        return out
+            if roi_layout is None:
+                groups = [(torch.arange(hotspots.size(0)), None, None)]
+            else:
+                # NOTE: hotspots with the same ROI size are segmented together
+                roi_sizes, roi_starts = self.__get_rois(hotspots, *roi_layout)
+                groups = []
+                for roi_size in sorted(set(roi_sizes.tolist())):
+                    indices = torch.nonzero(roi_sizes == roi_size).view(-1)
+                    groups.append((indices, roi_starts[indices], roi_size))
+
+            density_map_crops: list[NDArray[np.float32]] = [None] * hotspots.size(0)
+            for indices, group_roi_starts, roi_size in groups:
+                chunk_size = self._get_segmentation_chunk_size(multi_scale_features, roi_size)
+                for start in range(0, indices.size(0), chunk_size):
+                    if stop_fn():
+                        return
+                    progress_fn(
+                        f"Density Calculation... [{num_done}/{num_hotspots}]",
+                        int(num_done / num_hotspots * 80) + 20,
+                    )
+                    chunk = indices[start : start + chunk_size]
+                    with profiler.stage("segmentation"), self._autocast():
+                        if roi_size is None:
+                            density_maps = self.model.forward_segmentation(
+                                image_features,
+                                [hotspots[chunk]],
+                                [hotspot_features[chunk]],
+                            )[0][0]
+                        else:
+                            density_maps = self.model.forward_segmentation_roi(
+                                image_features,
+                                hotspots[chunk],
+                                hotspot_features[chunk],
+                                group_roi_starts[start : start + chunk_size],
+                                roi_size,
+                            )
+                    density_maps = density_maps.float().sigmoid()  # [Nchunk, D, H, W] or [Nchunk, Droi, Hroi, Wroi]
+                    # NOTE: density outside of the box area is always masked.
+                    for i, idx in enumerate(chunk.tolist()):
+                        bbox = box_area_crops[idx][0]
+                        if roi_size is not None:
+                            roi_start = group_roi_starts[start + i].tolist()
+                            bbox = tuple(slice(sl.start - o, sl.stop - o) for sl, o in zip(bbox, roi_start, strict=True))
+                        density_map_crops[idx] = density_maps[i][bbox].numpy().copy()
+                    num_done += chunk.size(0)
+            density_map_crops_list.append(density_map_crops)
+
+        return [
+            dict(
+                tokens=tokens_list[image_idx].numpy(),
+                token_positions=token_positions_list[image_idx].numpy(),
+                token_scores=token_scores_list[image_idx].numpy(),
+                relative_scores=relative_scores_list[image_idx].numpy(),
+                cavity_narrow=cavity_narrow[image_idx].numpy(),
+                cavity_wide=cavity_wide[image_idx].numpy(),
+                hotspot_indices=selected_indices_list[image_idx].numpy(),
+                density_map_crops=density_map_crops_list[image_idx],
+            )
+            for image_idx in range(num_images)
+        ]
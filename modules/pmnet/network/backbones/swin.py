@@ -17,6 +17,12 @@ from .timm import trunc_normal_, DropPath, to_3tuple
 from ..builder import BACKBONE
 
 
+# NOTE: fused scaled dot product attention with `scale` argument (torch>=2.1)
+SDPA_AVAILABLE = hasattr(F, "scaled_dot_product_attention") and tuple(
+    int(v) for v in torch.__version__.split(".")[:2]
+) >= (2, 1)
+
+
 class Mlp(nn.Module):
     """Multilayer perceptron."""
 
@@ -137,6 +143,23 @@ class WindowAttention(nn.Module):
 
         trunc_normal_(self.relative_position_bias_table, std=0.02)
         self.softmax = nn.Softmax(dim=-1)
+        self._bias_cache: tuple[tuple, Tensor] | None = None
+
+    def get_relative_position_bias(self) -> Tensor:
+        """Relative position bias (nH, Wd*Wh*Ww, Wd*Wh*Ww), cached until the parameter is modified in eval mode"""
+        table = self.relative_position_bias_table
+        key = (table._version, table.data_ptr(), table.device, table.dtype)
+        use_cache = not self.training and not torch.jit.is_tracing()
+        if use_cache and self._bias_cache is not None and self._bias_cache[0] == key:
+            return self._bias_cache[1]
+        num_windows = self.window_size[0] * self.window_size[1] * self.window_size[2]  # Wd*Wh*Ww
+        relative_position_bias = table[self.relative_position_index.view(-1)].view(
+            num_windows, num_windows, -1
+        )  # Wd*Wh*Ww, Wd*Wh*Ww, nH
+        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wd*Wh*Ww, Wd*Wh*Ww
+        if use_cache and not torch.is_grad_enabled():
+            self._bias_cache = (key, relative_position_bias)
+        return relative_position_bias
 
     def forward(self, x, mask=None):
         """Forward function.
@@ -149,32 +172,61 @@ class WindowAttention(nn.Module):
         qkv = self.qkv(x).reshape(B_, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]  # make torchscript happy (cannot use tensor as tuple)
 
-        q = q * self.scale
-        attn = q @ k.transpose(-2, -1)
-
-        num_windows = self.window_size[0] * self.window_size[1] * self.window_size[2]  # Wd*Wh*Ww
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            num_windows, num_windows, -1
-        )  # Wd*Wh*Ww, Wd*Wh*Ww, nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wd*Wh*Ww, Wd*Wh*Ww
-        attn = attn + relative_position_bias.unsqueeze(0)
-
-        if mask is not None:
-            nW = mask.shape[0]
-            attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
-            attn = attn.view(-1, self.num_heads, N, N)
-            attn = self.softmax(attn)
+        relative_position_bias = self.get_relative_position_bias()
+        if SDPA_AVAILABLE and (not self.training or self.attn_drop.p == 0.0):
+            x = scaled_dot_product_window_attention(q, k, v, relative_position_bias, mask, self.scale)
         else:
-            attn = self.softmax(attn)
-
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B_, N, C)
+            q = q * self.scale
+            attn = q @ k.transpose(-2, -1)
+            attn = attn + relative_position_bias.unsqueeze(0)
+
+            if mask is not None:
+                nW = mask.shape[0]
+                attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
+                attn = attn.view(-1, self.num_heads, N, N)
+                attn = self.softmax(attn)
+            else:
+                attn = self.softmax(attn)
+
+            attn = self.attn_drop(attn)
+            x = attn @ v
+
+        x = x.transpose(1, 2).reshape(B_, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
 
 
+def scaled_dot_product_window_attention(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    relative_position_bias: Tensor,
+    mask: Tensor | None,
+    scale: float,
+) -> Tensor:
+    """Window attention with fused scaled dot product attention
+
+    Args:
+        q, k, v: (num_windows*B, nH, N, head_dim)
+        relative_position_bias: (nH, N, N)
+        mask: (0/-inf) mask with shape of (num_windows, N, N) or None
+        scale: scale of attention logits
+
+    Returns:
+        x: (num_windows*B, nH, N, head_dim)
+    """
+    B_ = q.shape[0]
+    if mask is None:
+        return F.scaled_dot_product_attention(q, k, v, attn_mask=relative_position_bias.unsqueeze(0), scale=scale)
+    nW = mask.shape[0]
+    attn_mask = relative_position_bias.unsqueeze(0) + mask.unsqueeze(1)  # nW, nH, N, N
+    if B_ > nW:
+        # NOTE: 4D inputs only use the fused kernel (5D inputs fall back to the math implementation)
+        attn_mask = attn_mask.repeat(B_ // nW, 1, 1, 1)  # nW*B, nH, N, N
+    return F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, scale=scale)
+
+
 class SwinTransformerBlock(nn.Module):
     """Swin Transformer Block.
 
@@ -249,10 +301,11 @@ class SwinTransformerBlock(nn.Module):
 
         # pad feature maps to multiples of window size
         pad_w0 = pad_h0 = pad_d0 = 0
-        pad_w1 = (self.window_size - H % self.window_size) % self.window_size
-        pad_h1 = (self.window_size - W % self.window_size) % self.window_size
+        pad_w1 = (self.window_size - W % self.window_size) % self.window_size
+        pad_h1 = (self.window_size - H % self.window_size) % self.window_size
         pad_d1 = (self.window_size - D % self.window_size) % self.window_size
-        x = F.pad(x, (0, 0, pad_w0, pad_w1, pad_h0, pad_h1, pad_d0, pad_d1))
+        if pad_d1 > 0 or pad_h1 > 0 or pad_w1 > 0:
+            x = F.pad(x, (0, 0, pad_w0, pad_w1, pad_h0, pad_h1, pad_d0, pad_d1))
         _, Dp, Hp, Wp, _ = x.shape
 
         # cyclic shift
@@ -375,6 +428,8 @@ class BasicLayer(nn.Module):
         self.window_size = window_size
         self.shift_size = window_size // 2
         self.depth = depth
+        # NOTE: mask of the last padded input resolution (the input size is fixed in inference)
+        self._attn_mask_cache: tuple[tuple[int, int, int, torch.device], Tensor] | None = None
 
         # build blocks
         self.blocks = nn.ModuleList(
@@ -402,19 +457,13 @@ class BasicLayer(nn.Module):
         else:
             self.downsample = None
 
-    def forward(self, x: Tensor) -> tuple[Tensor, int, int, int, Tensor, int, int, int]:
-        """Forward function.
-
-        Args:
-            x: Input feature, tensor size (B, D, H, W, C).
-        """
-        B, D, H, W, C = x.shape
-
-        # calculate attention mask for SW-MSA
-        Dp = int(np.ceil(D / self.window_size)) * self.window_size
-        Hp = int(np.ceil(H / self.window_size)) * self.window_size
-        Wp = int(np.ceil(W / self.window_size)) * self.window_size
-        img_mask = torch.zeros((1, Dp, Hp, Wp, 1), device=x.device)  # 1 Dp Hp Wp 1
+    def get_attn_mask(self, Dp: int, Hp: int, Wp: int, device: torch.device) -> Tensor:
+        """Attention mask for SW-MSA (num_windows, Wd*Wh*Ww, Wd*Wh*Ww), cached for the last padded input resolution"""
+        key = (Dp, Hp, Wp, device)
+        use_cache = not torch.jit.is_tracing()
+        if use_cache and self._attn_mask_cache is not None and self._attn_mask_cache[0] == key:
+            return self._attn_mask_cache[1]
+        img_mask = torch.zeros((1, Dp, Hp, Wp, 1), device=device)  # 1 Dp Hp Wp 1
         d_slices = (
             slice(0, -self.window_size),
             slice(-self.window_size, -self.shift_size),
@@ -441,6 +490,23 @@ class BasicLayer(nn.Module):
         mask_windows = mask_windows.view(-1, self.window_size * self.window_size * self.window_size)
         attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
         attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+        if use_cache:
+            self._attn_mask_cache = (key, attn_mask)
+        return attn_mask
+
+    def forward(self, x: Tensor) -> tuple[Tensor, int, int, int, Tensor, int, int, int]:
+        """Forward function.
+
+        Args:
+            x: Input feature, tensor size (B, D, H, W, C).
+        """
+        B, D, H, W, C = x.shape
+
+        # calculate attention mask for SW-MSA
+        Dp = int(np.ceil(D / self.window_size)) * self.window_size
+        Hp = int(np.ceil(H / self.window_size)) * self.window_size
+        Wp = int(np.ceil(W / self.window_size)) * self.window_size
+        attn_mask = self.get_attn_mask(Dp, Hp, Wp, x.device)
 
         for blk in self.blocks:
             x = blk(x, attn_mask)
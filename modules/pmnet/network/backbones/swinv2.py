@@ -14,7 +14,7 @@ from collections.abc import Sequence
 from torch import Tensor
 
 from .timm import DropPath, to_3tuple, trunc_normal_
-from .swin import Mlp, window_partition, window_reverse
+from .swin import Mlp, window_partition, window_reverse, scaled_dot_product_window_attention, SDPA_AVAILABLE
 from ..builder import BACKBONE
 
 
@@ -99,6 +99,25 @@ class WindowAttention(nn.Module):
         self.proj = nn.Linear(dim, dim)
         self.proj_drop = nn.Dropout(proj_drop)
         self.softmax = nn.Softmax(dim=-1)
+        self._bias_cache: tuple[tuple, Tensor] | None = None
+
+    def get_relative_position_bias(self) -> Tensor:
+        """Relative position bias (nH, Wd*Wh*Ww, Wd*Wh*Ww), cached until the parameters are modified in eval mode"""
+        params = tuple(self.cpb_mlp.parameters())
+        key = tuple((param._version, param.data_ptr(), param.device, param.dtype) for param in params)
+        use_cache = not self.training and not torch.jit.is_tracing()
+        if use_cache and self._bias_cache is not None and self._bias_cache[0] == key:
+            return self._bias_cache[1]
+        num_windows = self.window_size[0] * self.window_size[1] * self.window_size[2]  # Wd*Wh*Ww
+        relative_position_bias_table = self.cpb_mlp(self.relative_coords_table).view(-1, self.num_heads)
+        relative_position_bias = relative_position_bias_table[self.relative_position_index.view(-1)].view(
+            num_windows, num_windows, -1
+        )  # Wd*Wh*Ww, Wd*Wh*Ww, nH
+        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wd*Wh*Ww, Wd*Wh*Ww
+        relative_position_bias = 16 * torch.sigmoid(relative_position_bias)
+        if use_cache and not torch.is_grad_enabled():
+            self._bias_cache = (key, relative_position_bias)
+        return relative_position_bias
 
     def forward(self, x, mask=None):
         """
@@ -115,30 +134,30 @@ class WindowAttention(nn.Module):
         q, k, v = qkv[0], qkv[1], qkv[2]  # make torchscript happy (cannot use tensor as tuple)
 
         # cosine attention
-        attn = F.normalize(q, dim=-1) @ F.normalize(k, dim=-1).transpose(-2, -1)
         logit_scale = torch.clamp(self.logit_scale, max=torch.log(torch.tensor(1.0 / 0.01, device=x.device))).exp()
-        attn = attn * logit_scale
-
-        num_windows = self.window_size[0] * self.window_size[1] * self.window_size[2]  # Wd*Wh*Ww
-        relative_position_bias_table = self.cpb_mlp(self.relative_coords_table).view(-1, self.num_heads)
-        relative_position_bias = relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            num_windows, num_windows, -1
-        )  # Wd*Wh*Ww, Wd*Wh*Ww, nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wd*Wh*Ww, Wd*Wh*Ww
-        relative_position_bias = 16 * torch.sigmoid(relative_position_bias)
-        attn = attn + relative_position_bias.unsqueeze(0)
-
-        if mask is not None:
-            nW = mask.shape[0]
-            attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
-            attn = attn.view(-1, self.num_heads, N, N)
-            attn = self.softmax(attn)
+        relative_position_bias = self.get_relative_position_bias()
+        if SDPA_AVAILABLE and (not self.training or self.attn_drop.p == 0.0):
+            # NOTE: logit scale (nH, 1, 1) is folded into the normalized query
+            q = F.normalize(q, dim=-1) * logit_scale
+            k = F.normalize(k, dim=-1)
+            x = scaled_dot_product_window_attention(q, k, v, relative_position_bias, mask, 1.0)
         else:
-            attn = self.softmax(attn)
-
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B_, N, C)
+            attn = F.normalize(q, dim=-1) @ F.normalize(k, dim=-1).transpose(-2, -1)
+            attn = attn * logit_scale
+            attn = attn + relative_position_bias.unsqueeze(0)
+
+            if mask is not None:
+                nW = mask.shape[0]
+                attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
+                attn = attn.view(-1, self.num_heads, N, N)
+                attn = self.softmax(attn)
+            else:
+                attn = self.softmax(attn)
+
+            attn = self.attn_drop(attn)
+            x = attn @ v
+
+        x = x.transpose(1, 2).reshape(B_, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
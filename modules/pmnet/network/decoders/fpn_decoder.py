@@ -76,13 +76,23 @@ class FPNDecoder(nn.Module):
         """
         num_levels = len(features)
         assert num_levels == len(self.feature_channels)
+        laterals = [lateral_conv(feature) for lateral_conv, feature in zip(self.lateral_conv_list, features)]
+        return self.forward_from_laterals(laterals)
+
+    def forward_from_laterals(self, laterals: Sequence[Tensor]) -> List[Tensor]:
+        """Forward function after the lateral convolutions.
+        Args:
+            laterals: Bottom-Up, outputs of `lateral_conv_list` (the top level is the input feature map)
+        Returns:
+            features: Top-Down, [Lowest-Resolution Feature Map, ..., Highest-Resolution Feature Map]
+        """
+        num_levels = len(laterals)
+        assert num_levels == len(self.feature_channels)
         fpn = None
         multi_scale_features = []
         for level in range(num_levels - 1, -1, -1):
-            feature = features[level]
-            lateral_conv = self.lateral_conv_list[level]
+            current_fpn = laterals[level]
             fpn_convs = self.fpn_convs_list[level]
-            current_fpn = lateral_conv(feature)
             if level == (num_levels - 1):    # Top
                 assert fpn is None
                 fpn = current_fpn
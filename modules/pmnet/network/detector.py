@@ -91,3 +91,25 @@ class PharmacoFormer(nn.Module):
             aux_box_masks_list: List[List[FloatTensor [Nbox, D_scale, H_scale, W_scale]]]
         """
         return self.mask_head.forward(multi_scale_features, box_tokens_list, box_token_features_list, return_aux)
+
+    def forward_segmentation_roi(
+        self,
+        multi_scale_features: Tuple[Tensor, ...],
+        box_tokens: IntTensor,
+        box_token_features: Tensor,
+        roi_starts: IntTensor,
+        roi_size: int,
+    ) -> Tensor:
+        """Mask Prediction in the region of interest of each box (single image)
+
+        Args:
+            multi_scales_features: List[FloatTensor [1, F, D_scale, H_scale, W_scale]]
+            box_tokens: IntTensor [Nbox, 4] - (x, y, z, i)
+            box_token_features: FloatTensor [Nbox, F]
+            roi_starts: IntTensor [Nbox, 3] - (x, y, z)
+            roi_size: int
+
+        Returns:
+            box_masks: FloatTensor [Nbox, roi_size, roi_size, roi_size]
+        """
+        return self.mask_head.forward_roi(multi_scale_features, box_tokens, box_token_features, roi_starts, roi_size)
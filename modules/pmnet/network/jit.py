@@ -0,0 +1,163 @@
+import copy
+import os
+import warnings
+
+import torch
+from torch import nn
+
+from typing import Dict, List, Tuple
+from torch import Tensor
+
+from .detector import PharmacoFormer
+
+
+TRACED_STAGES = ('embedding', 'cavity_head', 'mask_decoder')
+
+
+class _TupleOutput(nn.Module):
+    def __init__(self, module: nn.Module):
+        super(_TupleOutput, self).__init__()
+        self.module = module
+
+    def forward(self, *args) -> Tuple[Tensor, ...]:
+        return tuple(self.module(*args))
+
+
+class _TracedEmbedding(nn.Module):
+    """Wrapper of the traced embedding, which is traced with a single image (shape-specialized in Swin windows)"""
+
+    def __init__(self, traced: torch.jit.ScriptModule):
+        super(_TracedEmbedding, self).__init__()
+        self.traced = traced
+
+    def forward(self, in_image: Tensor) -> List[Tensor]:
+        if in_image.size(0) == 1:
+            return list(self.traced(in_image))
+        multi_scale_features_list = [self.traced(image) for image in in_image.split(1)]
+        return [torch.cat(features_list) for features_list in zip(*multi_scale_features_list)]
+
+
+class _MaskDecoder(nn.Module):
+    def __init__(self, decoder: nn.Module):
+        super(_MaskDecoder, self).__init__()
+        self.decoder = decoder
+
+    def forward(self, features: List[Tensor]) -> Tuple[Tensor, ...]:
+        return tuple(self.decoder(features))
+
+
+class _TracedMaskDecoder(nn.Module):
+    """Wrapper of the traced decoder to keep `MaskHead.decoder` interface (List[Tensor] -> List[Tensor])"""
+
+    def __init__(self, traced: torch.jit.ScriptModule, channels: int):
+        super(_TracedMaskDecoder, self).__init__()
+        self.traced = traced
+        self.channels = channels
+
+    def forward(self, features: List[Tensor]) -> List[Tensor]:
+        return list(self.traced(features))
+
+
+def trace_model(model: PharmacoFormer, in_channels: int, in_size: int) -> Dict[str, torch.jit.ScriptModule]:
+    """Trace and freeze the heavy stages (Swin backbone + FPN, cavity head, mask decoder)
+
+    Args:
+        model: PharmacoFormer (eval mode)
+        in_channels: number of protein channels
+        in_size: input voxel size
+
+    Returns:
+        traced_modules: {stage: frozen ScriptModule}
+    """
+    assert not model.training
+    image = torch.randn(1, in_channels, in_size, in_size, in_size)
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        embedding = torch.jit.trace(_TupleOutput(model.embedding), (image,), strict=False)
+        multi_scale_features = embedding(image)
+        cavity_head = torch.jit.trace(_TupleOutput(model.cavity_head), (multi_scale_features[-1],), strict=False)
+
+        # NOTE: input of mask decoder is bottom-up box features [Nbox, F_scale, D_scale, H_scale, W_scale]
+        box_features = [features.expand(2, -1, -1, -1, -1).contiguous() for features in multi_scale_features[::-1]]
+        mask_decoder = torch.jit.trace(_MaskDecoder(model.mask_head.decoder), (box_features,), strict=False)
+
+    return {
+        stage: torch.jit.freeze(traced.eval())
+        for stage, traced in zip(TRACED_STAGES, (embedding, cavity_head, mask_decoder))
+    }
+
+
+def save_traced_modules(traced_modules: Dict[str, torch.jit.ScriptModule], save_dir: str | os.PathLike):
+    os.makedirs(save_dir, exist_ok=True)
+    for stage, traced in traced_modules.items():
+        torch.jit.save(traced, os.path.join(save_dir, f'{stage}.pt'))
+
+
+def load_traced_modules(save_dir: str | os.PathLike) -> Dict[str, torch.jit.ScriptModule]:
+    return {stage: torch.jit.load(os.path.join(save_dir, f'{stage}.pt'), map_location='cpu') for stage in TRACED_STAGES}
+
+
+def apply_traced_modules(
+    model: PharmacoFormer,
+    traced_modules: Dict[str, torch.jit.ScriptModule],
+) -> PharmacoFormer:
+    """Copy of the model whose stages are replaced with the traced modules
+
+    The traced modules are optimized for CPU inference (e.g. Conv-BN folding, oneDNN kernels) here,
+    since the optimized modules cannot be serialized.
+
+    Args:
+        model: PharmacoFormer
+        traced_modules: output of `trace_model` or `load_traced_modules`
+
+    Returns:
+        compiled_model: PharmacoFormer
+    """
+    optimized_modules = {stage: torch.jit.optimize_for_inference(traced) for stage, traced in traced_modules.items()}
+    compiled_model = copy.deepcopy(model)
+    compiled_model.embedding = _TracedEmbedding(optimized_modules['embedding'])
+    compiled_model.cavity_head = optimized_modules['cavity_head']
+    compiled_model.mask_head.decoder = _TracedMaskDecoder(
+        optimized_modules['mask_decoder'], model.mask_head.decoder.channels
+    )
+    return compiled_model
+
+
+@torch.no_grad()
+def check_equivalence(
+    model: PharmacoFormer,
+    compiled_model: PharmacoFormer,
+    in_channels: int,
+    in_size: int,
+    num_tokens: int = 8,
+) -> float:
+    """Maximum absolute difference of the eager and compiled models for a random input
+
+    Args:
+        model: eager PharmacoFormer
+        compiled_model: compiled PharmacoFormer
+        in_channels: number of protein channels
+        in_size: input voxel size
+        num_tokens: number of random tokens
+
+    Returns:
+        max_diff: float
+    """
+    image = torch.rand(1, in_channels, in_size, in_size, in_size)
+    outputs = []
+    for _model in (model, compiled_model):
+        multi_scale_features = _model.forward_feature(image)
+        out_size = multi_scale_features[-1].size(-1)
+        generator = torch.Generator().manual_seed(0)
+        tokens = torch.cat(
+            [
+                torch.randint(0, out_size, (num_tokens, 3), generator=generator),
+                torch.randint(0, model.num_interactions, (num_tokens, 1), generator=generator),
+            ],
+            dim=1,
+        )
+        token_scores, token_features = _model.forward_token_prediction(multi_scale_features[-1], [tokens])
+        cavity_narrow, cavity_wide = _model.forward_cavity_extraction(multi_scale_features[-1])
+        density_maps = _model.forward_segmentation(multi_scale_features, [tokens], token_features)[0]
+        outputs.append((*multi_scale_features, token_scores[0], cavity_narrow, cavity_wide, density_maps[0]))
+    return max(float((x - y).abs().max()) for x, y in zip(*outputs, strict=True))
@@ -5,6 +5,8 @@ from typing import Sequence, List, Optional, Tuple
 from torch import Tensor
 
 from .builder import HEAD
+from .decoders import FPNDecoder
+from .nn.layers import BaseConv3d
 
 
 @HEAD.register()
@@ -98,21 +100,7 @@ class MaskHead(nn.Module):
         Nbox = tokens.size(0)
         multi_scale_size = [features.size()[1:] for features in multi_scale_features]
         if Nbox > 0:
-            Dout, Hout, Wout = multi_scale_size[0]
-            token_indices = torch.split(tokens, 1, dim=1)                           # (x_list, y_list, z_list, i_list)
-            xs, ys, zs, _ = token_indices
-
-            bottom_up_box_features = []
-            for level in range(len(multi_scale_features)):
-                features = multi_scale_features[level]
-                _, D, H, W = features.shape
-                _xs = torch.div(xs, Dout // D, rounding_mode='trunc')
-                _ys = torch.div(ys, Hout // H, rounding_mode='trunc')
-                _zs = torch.div(zs, Wout // W, rounding_mode='trunc')
-                box_features = self.get_box_features(features, (_xs, _ys, _zs), token_features, level)
-                bottom_up_box_features.append(box_features)
-
-            top_down_features = self.decoder(bottom_up_box_features)
+            top_down_features = self.decode_box_features(multi_scale_features, tokens, token_features)
             top_down_box_masks = [self.conv_logits(features).squeeze(1) for features in top_down_features]
             return top_down_box_masks
         else:
@@ -138,24 +126,139 @@ class MaskHead(nn.Module):
         multi_scale_size = [features.size()[1:] for features in multi_scale_features]
         Dout, Hout, Wout = multi_scale_size[0]
         if Nbox > 0:
-            token_indices = torch.split(tokens, 1, dim=1)                           # (x_list, y_list, z_list, i_list)
-            xs, ys, zs, _ = token_indices
-
-            bottom_up_box_features = []
-            for level in range(len(multi_scale_features)):
-                features = multi_scale_features[level]
-                _, D, H, W = features.shape
-                _xs = torch.div(xs, Dout // D, rounding_mode='trunc')
-                _ys = torch.div(ys, Hout // H, rounding_mode='trunc')
-                _zs = torch.div(zs, Wout // W, rounding_mode='trunc')
-                box_features = self.get_box_features(features, (_xs, _ys, _zs), token_features, level)
-                bottom_up_box_features.append(box_features)
-
-            top_down_features = self.decoder(bottom_up_box_features)
+            top_down_features = self.decode_box_features(multi_scale_features, tokens, token_features)
             return self.conv_logits(top_down_features[-1]).squeeze(1)
         else:
             return torch.empty((0, Dout, Hout, Wout), dtype=multi_scale_features[0].dtype, device=tokens.device)
 
+    @property
+    def supports_roi(self) -> bool:
+        """ROI segmentation is exact for FPNDecoder with nearest upsampling and voxel-wise normalization
+
+        The normalization layers should not depend on the statistics of the input volume
+        (BatchNorm3d with running statistics in eval mode, or no normalization).
+        """
+        if not (isinstance(self.decoder, FPNDecoder) and self.decoder.interpolate_mode == 'nearest'):
+            return False
+        for module in self.decoder.modules():
+            if not isinstance(module, BaseConv3d):
+                continue
+            norm = module._norm
+            if isinstance(norm, nn.Identity):
+                continue
+            if not (isinstance(norm, nn.BatchNorm3d) and not norm.training and norm.track_running_stats):
+                return False
+        return True
+
+    def get_roi_layout(self, multi_scale_features: Sequence[Tensor]) -> Tuple[int, int]:
+        """Receptive field margin and alignment of ROI segmentation
+
+        Args:
+            multi_scale_features: Top-Down, List[FloatTensor [N, F_scale, D_scale, H_scale, W_scale]]
+
+        Returns:
+            margin: number of output voxels around the ROI which affect the output in the ROI
+            align: stride of the coarsest level, the ROI start and size should be its multiple
+        """
+        assert self.supports_roi
+        out_size = multi_scale_features[-1].size(-1)
+        margin = 0
+        for level, fpn_convs in enumerate(self.decoder.fpn_convs_list):
+            stride = out_size // multi_scale_features[::-1][level].size(-1)
+            for conv in fpn_convs:
+                conv = conv._conv
+                margin += stride * (conv.kernel_size[0] // 2) * conv.dilation[0]
+        align = out_size // multi_scale_features[0].size(-1)
+        return margin, align
+
+    def forward_roi(
+        self,
+        multi_scale_features: Sequence[Tensor],
+        tokens: Tensor,
+        token_features: Tensor,
+        roi_starts: Tensor,
+        roi_size: int,
+    ) -> Tensor:
+        """Box Predicting Function in the region of interest (ROI) of each token
+
+        The output is the same to the crop of `do_predict_single`,
+        if the ROI contains the receptive field margin (except for the grid boundary).
+
+        Args:
+            multi_scale_features: Top-Down, List[FloatTensor [1, F_scale, D_scale, H_scale, W_scale]]
+            tokens: IntTensor [Nbox, 4] - (x, y, z, i)
+            token_features: FloatTensor [Nbox, Ftoken]
+            roi_starts: IntTensor [Nbox, 3] - (x, y, z), multiple of the alignment of `get_roi_layout`
+            roi_size: int, multiple of the alignment of `get_roi_layout`
+
+        Returns:
+            box_masks: FloatTensor [Nbox, roi_size, roi_size, roi_size]
+        """
+        assert self.supports_roi
+        assert len(multi_scale_features[0]) == 1
+        multi_scale_features = [features[0] for features in multi_scale_features[::-1]]   # Top-Down -> Bottom-Up
+        if tokens.size(0) == 0:
+            return torch.empty((0, roi_size, roi_size, roi_size), dtype=multi_scale_features[0].dtype, device=tokens.device)
+        top_down_features = self.decode_box_features(multi_scale_features, tokens, token_features, roi_starts, roi_size)
+        return self.conv_logits(top_down_features[-1]).squeeze(1)
+
+    def decode_box_features(
+        self,
+        multi_scale_features: Sequence[Tensor],
+        tokens: Tensor,
+        token_features: Tensor,
+        roi_starts: Optional[Tensor] = None,
+        roi_size: Optional[int] = None,
+    ) -> List[Tensor]:
+        """Decode the box features of each token
+
+        For FPNDecoder, the 1x1 lateral convolution is fused into the box feature construction,
+        so that the box features [Nbox, F_scale, D_scale, H_scale, W_scale] are not materialized.
+
+        Args:
+            multi_scale_features: Bottom-Up, List[FloatTensor [F_scale, D_scale, H_scale, W_scale]]
+            tokens: IntTensor [Nbox, 4] - (x, y, z, i)
+            token_features: FloatTensor [Nbox, Ftoken]
+            roi_starts: IntTensor [Nbox, 3] - (x, y, z), if given, features are cropped to the ROI of each token
+            roi_size: int, size of ROI
+
+        Returns:
+            top_down_features: Top-Down, List[FloatTensor [Nbox, C, D_scale, H_scale, W_scale]]
+        """
+        Dout, Hout, Wout = multi_scale_features[0].size()[1:]
+        token_indices = torch.split(tokens, 1, dim=1)                           # (x_list, y_list, z_list, i_list)
+        xs, ys, zs, _ = token_indices
+        fuse_lateral = isinstance(self.decoder, FPNDecoder)
+
+        bottom_up_box_features = []
+        for level in range(len(multi_scale_features)):
+            features = multi_scale_features[level]
+            _, D, H, W = features.shape
+            strides = (Dout // D, Hout // H, Wout // W)
+            _xs = torch.div(xs, strides[0], rounding_mode='trunc')
+            _ys = torch.div(ys, strides[1], rounding_mode='trunc')
+            _zs = torch.div(zs, strides[2], rounding_mode='trunc')
+            if roi_starts is not None:
+                assert roi_size is not None
+                starts = torch.div(roi_starts, torch.tensor(strides, device=roi_starts.device), rounding_mode='trunc')
+                sizes = [roi_size // stride for stride in strides]
+                features = torch.stack([
+                    features[:, x:x + sizes[0], y:y + sizes[1], z:z + sizes[2]] for x, y, z in starts.tolist()
+                ])                                                                  # [Nbox, F, Droi, Hroi, Wroi]
+                _xs, _ys, _zs = _xs - starts[:, 0:1], _ys - starts[:, 1:2], _zs - starts[:, 2:3]
+            lateral_conv = self.decoder.lateral_conv_list[level] if fuse_lateral else None
+            if isinstance(lateral_conv, BaseConv3d) and lateral_conv._conv.kernel_size == (1, 1, 1):
+                box_features = self.get_box_laterals(features, (_xs, _ys, _zs), token_features, level, lateral_conv)
+            else:
+                box_features = self.get_box_features(features, (_xs, _ys, _zs), token_features, level)
+                if lateral_conv is not None:
+                    box_features = lateral_conv(box_features)
+            bottom_up_box_features.append(box_features)
+
+        if fuse_lateral:
+            return self.decoder.forward_from_laterals(bottom_up_box_features)
+        return self.decoder(bottom_up_box_features)
+
     def get_box_features(
         self,
         features: Tensor,
@@ -166,20 +269,58 @@ class MaskHead(nn.Module):
         """Extract token features
 
         Args:
-            features: FloatTensor [F_scale, D_scale, H_scale, W_scale]
+            features: FloatTensor [F_scale, D_scale, H_scale, W_scale] or [Nbox, F_scale, D_scale, H_scale, W_scale]
             token_indices: Tuple[IntTensor [Nbox,], IntTensor [Nbox,], IntTensor[Nbox,]] - (xs, ys, zs)
             token_features: FloatTensor [Nbox, Ftoken]
 
         Returns:
             box_features: FloatTensor [Nbox, F_scale, D_scale, H_scale, W_scale]
         """
-        F, D, H, W = features.shape
+        if features.dim() == 4:
+            features = features.unsqueeze(0)
+        F, D, H, W = features.shape[1:]
         xs, ys, zs = token_indices
         Nbox = token_features.size(0)
         Nboxs = torch.arange(Nbox, dtype=xs.dtype, device=xs.device)
         background_features = self.background_mlp_list[level](token_features)               # [Nbox, F]
         point_features = self.point_mlp_list[level](token_features)                         # [Nbox, F]
-        box_features = background_features.view(Nbox, F, 1, 1, 1).repeat(1, 1, D, H, W)     # [Nbox, F, D, H, W]
-        box_features[Nboxs, :, xs, ys, zs] += point_features
-        features = features.unsqueeze(0) + box_features
-        return features
+        box_features = features + background_features.view(Nbox, F, 1, 1, 1)               # [Nbox, F, D, H, W]
+        box_features[Nboxs, :, xs.view(-1), ys.view(-1), zs.view(-1)] += point_features
+        return box_features
+
+    def get_box_laterals(
+        self,
+        features: Tensor,
+        token_indices: Tuple[Tensor, Tensor, Tensor],
+        token_features: Tensor,
+        level: int,
+        lateral_conv: BaseConv3d,
+    ) -> Tensor:
+        """Lateral convolution (1x1) of the box features
+
+        The convolution is linear, so it is applied to the shared feature map,
+        the background feature vectors and the point feature vectors separately.
+
+        Args:
+            features: FloatTensor [F_scale, D_scale, H_scale, W_scale] or [Nbox, F_scale, D_scale, H_scale, W_scale]
+            token_indices: Tuple[IntTensor [Nbox,], IntTensor [Nbox,], IntTensor[Nbox,]] - (xs, ys, zs)
+            token_features: FloatTensor [Nbox, Ftoken]
+            lateral_conv: 1x1 BaseConv3d
+
+        Returns:
+            box_laterals: FloatTensor [Nbox, C, D_scale, H_scale, W_scale]
+        """
+        xs, ys, zs = token_indices
+        Nbox = token_features.size(0)
+        Nboxs = torch.arange(Nbox, dtype=xs.dtype, device=xs.device)
+        conv = lateral_conv._conv
+        C = conv.out_channels
+        weight = conv.weight.view(C, -1)                                                    # [C, F]
+        background_features = nn.functional.linear(self.background_mlp_list[level](token_features), weight)  # [Nbox, C]
+        point_features = nn.functional.linear(self.point_mlp_list[level](token_features), weight)            # [Nbox, C]
+        if features.dim() == 4:
+            features = features.unsqueeze(0)
+        shared_features = conv(features)                                                    # [1 or Nbox, C, D, H, W]
+        box_laterals = shared_features + background_features.view(Nbox, C, 1, 1, 1)         # [Nbox, C, D, H, W]
+        box_laterals[Nboxs, :, xs.view(-1), ys.view(-1), zs.view(-1)] += point_features
+        return lateral_conv._act(lateral_conv._norm(box_laterals))
@@ -6,7 +6,8 @@ import os
 import numpy as np
 from openbabel import pybel
 
-from collections.abc import Iterable
+from collections.abc import Callable, Iterable
+from functools import cached_property
 from numpy.typing import NDArray
 
 from .utils.density_map import (
@@ -14,9 +15,11 @@ from .utils.density_map import (
     DensityMapNode,
     DensityMapNodeCluster,
     DensityMapEdge,
+    SparseDensityMap,
 )
+from .utils import binary_format
 from .scoring.ligand import Ligand
-from .scoring.graph_match import GraphMatcher
+from .scoring.graph_match import GraphMatcher, PHARMACOPHORE_TYPES, PHARMACOPHORE_TYPE_CODES, get_type_mask
 
 
 INTERACTION_TO_PHARMACOPHORE = {
@@ -33,15 +36,136 @@ INTERACTION_TO_PHARMACOPHORE = {
 }
 
 
+# NOTE: version of the binary model format (`.pm`)
+FORMAT_VERSION = 1
+
+
+class ModelScoringTables:
+    """Array-backed tables of a pharmacophore model, which are read in scoring
+
+    Attributes:
+        node_type_codes: [N,] pharmacophore type code of each node
+        distance_mean_stds: [N, N, 2] distance mean and std of each node pair
+        cluster_node_indices: [K,] node indices of each cluster (sorted)
+        cluster_type_masks: [K,] bitmask of the node pharmacophore types of each cluster
+        cluster_centers: [K, 3]
+        cluster_sizes: [K,]
+        cluster_distances: [K, K] distances between the cluster centers
+    """
+
+    __slots__ = (
+        "node_type_codes",
+        "distance_mean_stds",
+        "cluster_node_indices",
+        "cluster_type_masks",
+        "cluster_centers",
+        "cluster_sizes",
+        "cluster_distances",
+    )
+
+    def __init__(self, model: PharmacophoreModel):
+        num_nodes = len(model.nodes)
+        self.node_type_codes: NDArray[np.int64] = np.array(
+            [PHARMACOPHORE_TYPE_CODES[node.type] for node in model.nodes], dtype=np.int64
+        )
+
+        # NOTE: binary models keep the edge arrays, so the edge objects are not built here.
+        self.distance_mean_stds: NDArray[np.float32] = np.zeros((num_nodes, num_nodes, 2), dtype=np.float32)
+        if model._edge_arrays is not None:
+            distance_means, distance_stds = model._edge_arrays
+            node_indices2, node_indices1 = np.tril_indices(num_nodes)
+            values = np.stack([distance_means, distance_stds], axis=-1)
+        else:
+            node_indices1 = np.array([edge.node_indices[0] for edge in model.edges], dtype=np.int64)
+            node_indices2 = np.array([edge.node_indices[1] for edge in model.edges], dtype=np.int64)
+            values = np.array([(edge.distance_mean, edge.distance_std) for edge in model.edges], dtype=np.float32)
+        values = values.reshape(-1, 2)
+        self.distance_mean_stds[node_indices1, node_indices2] = values
+        self.distance_mean_stds[node_indices2, node_indices1] = values
+
+        clusters = model.node_clusters
+        self.cluster_node_indices: list[NDArray[np.int64]] = [
+            np.array(sorted(cluster.node_indices), dtype=np.int64) for cluster in clusters
+        ]
+        self.cluster_type_masks: NDArray[np.int64] = np.array(
+            [get_type_mask(cluster.node_types) for cluster in clusters], dtype=np.int64
+        )
+        self.cluster_centers: NDArray[np.float64] = np.array(
+            [cluster.center for cluster in clusters], dtype=np.float64
+        ).reshape(-1, 3)
+        self.cluster_sizes: NDArray[np.float64] = np.array([cluster.size for cluster in clusters], dtype=np.float64)
+        self.cluster_distances: NDArray[np.float64] = np.linalg.norm(
+            self.cluster_centers[:, None] - self.cluster_centers[None, :], axis=-1
+        )
+
+    def get_node_weights(self, weights: dict[str, float]) -> NDArray[np.float32]:
+        """[N,] weight of each node from the per-type weights"""
+        type_weights = np.array([weights[typ] for typ in PHARMACOPHORE_TYPES], dtype=np.float32)
+        return type_weights[self.node_type_codes]
+
+
 # NOTE: Pickle-Friendly Object
 class PharmacophoreModel:
     def __init__(self):
-        self.pdbblock: str
         self.nodes: list[ModelNode]
-        self.edges: list[ModelEdge]
         self.node_dict: dict[str, list[ModelNode]]
         self.node_cluster_dict: dict[str, list[ModelNodeCluster]]
         self.node_clusters: list[ModelNodeCluster]
+        self.density_maps: list[ModelDensityMap] | None = None
+
+        # NOTE: the protein block and the edges of a binary model are loaded at the first access.
+        self._pdbblock: str | None = None
+        self._pdbblock_loader: Callable[[], str] | None = None
+        self._edges: list[ModelEdge] | None = None
+        self._edge_arrays: tuple[NDArray[np.float64], NDArray[np.float64]] | None = None
+
+    @property
+    def pdbblock(self) -> str:
+        if self._pdbblock is None and self._pdbblock_loader is not None:
+            self._pdbblock = self._pdbblock_loader()
+            self._pdbblock_loader = None
+        return self._pdbblock
+
+    @pdbblock.setter
+    def pdbblock(self, pdbblock: str):
+        self._pdbblock = pdbblock
+        self._pdbblock_loader = None
+
+    @property
+    def edges(self) -> list[ModelEdge]:
+        if self._edges is None:
+            distance_means, distance_stds = self._edge_arrays
+            node_indices2, node_indices1 = np.tril_indices(len(self.nodes))
+            self._edges = [
+                ModelEdge(
+                    self,
+                    edge_index,
+                    (index1, index2),
+                    tuple(sorted((self.nodes[index1].interaction_type, self.nodes[index2].interaction_type))),
+                    distance_mean,
+                    distance_std,
+                )
+                for edge_index, (index1, index2, distance_mean, distance_std) in enumerate(
+                    zip(
+                        node_indices1.tolist(),
+                        node_indices2.tolist(),
+                        distance_means.tolist(),
+                        distance_stds.tolist(),
+                        strict=True,
+                    )
+                )
+            ]
+            self._edge_arrays = None
+        return self._edges
+
+    @edges.setter
+    def edges(self, edges: list[ModelEdge]):
+        self._edges = edges
+        self._edge_arrays = None
+
+    @cached_property
+    def scoring_tables(self) -> ModelScoringTables:
+        return ModelScoringTables(self)
 
     def scoring_pbmol(
         self,
@@ -88,19 +212,24 @@ class PharmacophoreModel:
         center: tuple[float, float, float],
         resolution: float,
         size: int,
-        density_maps: list[dict],
+        density_maps: Iterable[dict],
+        keep_density_maps: bool = False,
     ):
         graph = DensityMapGraph(center, resolution, size)
+        kept_density_maps = []
         for node in density_maps:
             graph.add_node(node["type"], node["position"], node["score"], node["map"])
+            if keep_density_maps:
+                kept_density_maps.append(ModelDensityMap.create(node))
         graph.setup()
 
         model = cls()
         model.pdbblock = pdbblock
+        model.density_maps = kept_density_maps if keep_density_maps else None
         model.nodes = [ModelNode.create(model, node) for node in graph.nodes]
-        model.edges = [ModelEdge.create(model, edge) for edge in graph.edges]
-        for node in model.nodes:
-            node.setup()
+        # NOTE: the edges of the complete graph are kept as arrays, and the edge objects are built at the first access.
+        model._edges = None
+        model._edge_arrays = graph.get_edge_arrays()
         model.node_dict = {
             typ: [model.nodes[node.index] for node in node_list]
             for typ, node_list in graph.node_dict.items()
@@ -116,19 +245,37 @@ class PharmacophoreModel:
         return model
 
     def save(self, save_path: str):
+        """Save the model
+
+        Args:
+            save_path: `.pm` (binary format), `.pkl` (pickle) or `.json`
+        """
         extension = os.path.splitext(save_path)[-1]
-        state = self.__getstate__()
-        if extension in (".pkl", ".pm"):
+        if extension == ".pm":
+            self.__save_binary(save_path)
+        elif extension == ".pkl":
             with open(save_path, "wb") as w:
-                pickle.dump(state, w)
-        elif extension in ".json":
+                pickle.dump(self.__getstate__(), w)
+        elif extension == ".json":
             with open(save_path, "w") as w:
-                json.dump(state, w, indent=2)
+                json.dump(self.__getstate__(), w, indent=2)
         else:
             raise NotImplementedError
 
     @classmethod
-    def load(cls, save_path: str):
+    def load(cls, save_path: str, use_mmap: bool = True):
+        """Load the model
+
+        The binary format is detected from the file content, so the old pickled `.pm` files are also loaded.
+
+        Args:
+            save_path: model path
+            use_mmap: if True, the arrays of the binary format are memory-mapped
+        """
+        model = cls()
+        if binary_format.is_binary_file(save_path):
+            model.__load_binary(binary_format.BinaryContainer(save_path, use_mmap))
+            return model
         extension = os.path.splitext(save_path)[-1]
         if extension in (".pkl", ".pm"):
             with open(save_path, "rb") as f:
@@ -138,10 +285,181 @@ class PharmacophoreModel:
                 state = json.load(f)
         else:
             raise NotImplementedError
-        model = cls()
         model.__setstate__(state)
         return model
 
+    @staticmethod
+    def load_pdbblock(save_path: str) -> str:
+        """Load only the protein block of the model"""
+        if binary_format.is_binary_file(save_path):
+            return binary_format.BinaryContainer(save_path).blob("pdbblock").decode()
+        return PharmacophoreModel.load(save_path).pdbblock
+
+    def __save_binary(self, save_path: str):
+        num_nodes = len(self.nodes)
+        if self._edge_arrays is not None:
+            distance_means, distance_stds = self._edge_arrays
+        else:
+            edges = self.edges
+            if len(edges) != num_nodes * (num_nodes + 1) // 2 or any(
+                edge.index != edge_index or edge.index != DensityMapGraph.get_edge_index(*edge.node_indices)
+                for edge_index, edge in enumerate(edges)
+            ):
+                raise ValueError("binary format requires the edges of the complete graph")
+            distance_means = [edge.distance_mean for edge in edges]
+            distance_stds = [edge.distance_std for edge in edges]
+
+        interaction_types = sorted({node.interaction_type for node in self.nodes})
+        cluster_types = list(self.node_cluster_dict.keys())
+        clusters = [cluster for cluster_list in self.node_cluster_dict.values() for cluster in cluster_list]
+        cluster_node_indices = [sorted(cluster.node_indices) for cluster in clusters]
+        overlapped_nodes = [node._overlapped_nodes for node in self.nodes]
+        header = dict(
+            interaction_types=interaction_types,
+            node_dict_types=list(self.node_dict.keys()),
+            cluster_types=cluster_types,
+            has_density_maps=self.density_maps is not None,
+        )
+        arrays = dict(
+            node_interaction_types=np.array(
+                [interaction_types.index(node.interaction_type) for node in self.nodes], dtype=np.int8
+            ),
+            node_hotspot_positions=np.array([node.hotspot_position for node in self.nodes], dtype=np.float64),
+            node_scores=np.array([node.score for node in self.nodes], dtype=np.float64),
+            node_centers=np.array([node.center for node in self.nodes], dtype=np.float64),
+            node_radii=np.array([node.radius for node in self.nodes], dtype=np.float64),
+            node_overlapped_offsets=np.cumsum([0] + [len(indices) for indices in overlapped_nodes], dtype=np.int64),
+            node_overlapped_indices=np.array(
+                [index for indices in overlapped_nodes for index in indices], dtype=np.int32
+            ),
+            edge_distance_means=np.asarray(distance_means, dtype=np.float64),
+            edge_distance_stds=np.asarray(distance_stds, dtype=np.float64),
+            cluster_types=np.array([cluster_types.index(cluster.type) for cluster in clusters], dtype=np.int8),
+            cluster_centers=np.array([cluster.center for cluster in clusters], dtype=np.float64).reshape(-1, 3),
+            cluster_sizes=np.array([cluster.size for cluster in clusters], dtype=np.float64),
+            cluster_node_offsets=np.cumsum([0] + [len(indices) for indices in cluster_node_indices], dtype=np.int64),
+            cluster_node_indices=np.array(
+                [index for indices in cluster_node_indices for index in indices], dtype=np.int32
+            ),
+        )
+        arrays["node_hotspot_positions"] = arrays["node_hotspot_positions"].reshape(-1, 3)
+        arrays["node_centers"] = arrays["node_centers"].reshape(-1, 3)
+        if self.density_maps is not None:
+            header["density_map_types"] = sorted({density_map.interaction_type for density_map in self.density_maps})
+            maps = [density_map.map for density_map in self.density_maps]
+            arrays.update(
+                density_map_interaction_types=np.array(
+                    [
+                        header["density_map_types"].index(density_map.interaction_type)
+                        for density_map in self.density_maps
+                    ],
+                    dtype=np.int8,
+                ),
+                density_map_hotspot_positions=np.array(
+                    [density_map.hotspot_position for density_map in self.density_maps], dtype=np.float64
+                ).reshape(-1, 3),
+                density_map_scores=np.array([density_map.score for density_map in self.density_maps], dtype=np.float64),
+                density_map_sizes=np.array([map.size for map in maps], dtype=np.int32),
+                density_map_offsets=np.cumsum([0] + [len(map) for map in maps], dtype=np.int64),
+                density_map_coords=np.concatenate([map.coords for map in maps] + [np.empty((0, 3), dtype=np.int16)]),
+                density_map_values=np.concatenate([map.scores for map in maps] + [np.empty((0,), dtype=np.float32)]),
+            )
+        blobs = dict(pdbblock=self.pdbblock.encode())
+        binary_format.save(save_path, FORMAT_VERSION, header, arrays, blobs)
+
+    def __load_binary(self, container: binary_format.BinaryContainer):
+        if container.version > FORMAT_VERSION:
+            raise ValueError(f"unsupported model format version: {container.version} (> {FORMAT_VERSION})")
+        header = container.header
+        interaction_types = header["interaction_types"]
+        node_interaction_types = [
+            interaction_types[code] for code in container.array("node_interaction_types").tolist()
+        ]
+        overlapped_offsets = container.array("node_overlapped_offsets").tolist()
+        overlapped_indices = container.array("node_overlapped_indices").tolist()
+        self.nodes = [
+            ModelNode(
+                self,
+                index,
+                INTERACTION_TO_PHARMACOPHORE[interaction_type],
+                interaction_type,
+                tuple(hotspot_position),
+                score,
+                tuple(center),
+                radius,
+                None,
+                overlapped_indices[overlapped_offsets[index] : overlapped_offsets[index + 1]],
+            )
+            for index, (interaction_type, hotspot_position, score, center, radius) in enumerate(
+                zip(
+                    node_interaction_types,
+                    container.array("node_hotspot_positions").tolist(),
+                    container.array("node_scores").tolist(),
+                    container.array("node_centers").tolist(),
+                    container.array("node_radii").tolist(),
+                    strict=True,
+                )
+            )
+        ]
+        self._edges = None
+        self._edge_arrays = (container.array("edge_distance_means"), container.array("edge_distance_stds"))
+        self.node_dict = {typ: [] for typ in header["node_dict_types"]}
+        for node in self.nodes:
+            self.node_dict[node.interaction_type].append(node)
+
+        cluster_types = header["cluster_types"]
+        cluster_node_offsets = container.array("cluster_node_offsets").tolist()
+        cluster_node_indices = container.array("cluster_node_indices").tolist()
+        self.node_cluster_dict = {typ: [] for typ in cluster_types}
+        for cluster_index, (code, center, size) in enumerate(
+            zip(
+                container.array("cluster_types").tolist(),
+                container.array("cluster_centers").tolist(),
+                container.array("cluster_sizes").tolist(),
+                strict=True,
+            )
+        ):
+            start, end = cluster_node_offsets[cluster_index], cluster_node_offsets[cluster_index + 1]
+            node_indices = cluster_node_indices[start:end]
+            cluster = ModelNodeCluster(
+                self,
+                cluster_types[code],
+                node_indices,
+                {self.nodes[index].type for index in node_indices},
+                tuple(center),
+                size,
+            )
+            self.node_cluster_dict[cluster.type].append(cluster)
+        self.node_clusters = []
+        for node_cluster_list in self.node_cluster_dict.values():
+            self.node_clusters.extend(node_cluster_list)
+
+        self.density_maps = None
+        if header["has_density_maps"]:
+            density_map_types = header["density_map_types"]
+            offsets = container.array("density_map_offsets").tolist()
+            coords = container.array("density_map_coords")
+            values = container.array("density_map_values")
+            self.density_maps = [
+                ModelDensityMap(
+                    density_map_types[code],
+                    tuple(hotspot_position),
+                    score,
+                    SparseDensityMap(coords[offsets[i] : offsets[i + 1]], values[offsets[i] : offsets[i + 1]], size),
+                )
+                for i, (code, hotspot_position, score, size) in enumerate(
+                    zip(
+                        container.array("density_map_interaction_types").tolist(),
+                        container.array("density_map_hotspot_positions").tolist(),
+                        container.array("density_map_scores").tolist(),
+                        container.array("density_map_sizes").tolist(),
+                        strict=True,
+                    )
+                )
+            ]
+        self._pdbblock = None
+        self._pdbblock_loader = lambda: container.blob("pdbblock").decode()
+
     def __getstate__(self):
         state = dict(
             pdbblock=self.pdbblock,
@@ -156,14 +474,14 @@ class PharmacophoreModel:
                 for typ, nodes in self.node_dict.items()
             },
         )
+        if self.density_maps is not None:
+            state["density_maps"] = [density_map.get_kwargs() for density_map in self.density_maps]
         return state
 
     def __setstate__(self, state):
         self.pdbblock = state["pdbblock"]
         self.nodes = [ModelNode(self, **kwargs) for kwargs in state["nodes"]]
         self.edges = [ModelEdge(self, **kwargs) for kwargs in state["edges"]]
-        for node in self.nodes:
-            node.setup()
         self.node_dict = {
             typ: [self.nodes[index] for index in indices]
             for typ, indices in state["node_dict"].items()
@@ -175,6 +493,41 @@ class PharmacophoreModel:
         self.node_clusters: list[ModelNodeCluster] = []
         for node_cluster_list in self.node_cluster_dict.values():
             self.node_clusters.extend(node_cluster_list)
+        self.density_maps = None
+        if state.get("density_maps", None) is not None:
+            self.density_maps = [ModelDensityMap(**kwargs) for kwargs in state["density_maps"]]
+
+
+class ModelDensityMap:
+    def __init__(
+        self,
+        interaction_type: str,
+        hotspot_position: tuple[float, float, float],
+        score: float,
+        map: dict | SparseDensityMap,
+    ):
+        self.interaction_type: str = interaction_type
+        self.hotspot_position: tuple[float, float, float] = hotspot_position
+        self.score: float = score
+        self.map: SparseDensityMap = map if isinstance(map, SparseDensityMap) else SparseDensityMap.from_kwargs(**map)
+
+    @classmethod
+    def create(cls, density_map: dict) -> ModelDensityMap:
+        map = density_map["map"]
+        if not isinstance(map, SparseDensityMap):
+            map = SparseDensityMap.from_dense(map)
+        return cls(density_map["type"], density_map["position"], density_map["score"], map)
+
+    def __repr__(self):
+        return f"ModelDensityMap[{self.interaction_type}]({len(self.map)} grids)"
+
+    def get_kwargs(self):
+        return dict(
+            interaction_type=self.interaction_type,
+            hotspot_position=self.hotspot_position,
+            score=self.score,
+            map=self.map.get_kwargs(),
+        )
 
 
 class ModelNodeCluster:
@@ -232,9 +585,14 @@ class ModelNode:
         score: float,
         center: tuple[float, float, float],
         radius: float,
-        neighbor_edge_dict: dict[int, int],
+        neighbor_edge_dict: dict[int, int] | None,
         overlapped_nodes: list[int],
     ):
+        """Pharmacophore model node
+
+        `neighbor_edge_dict` is {neighbor node index: edge index}; if None, the node is connected to all nodes
+        with the edge indices of `DensityMapGraph.get_edge_index` (binary format).
+        """
         self.graph: PharmacophoreModel = graph
         self.index: int = index
         self.type: str = type
@@ -244,21 +602,29 @@ class ModelNode:
         self.center: tuple[float, float, float] = center
         self.radius: float = radius
 
-        self._neighbor_edge_dict: dict[int, int] = neighbor_edge_dict
+        self.__neighbor_edge_dict: dict[int, int] | None = neighbor_edge_dict
         self._overlapped_nodes: list[int] = overlapped_nodes
-        self.neighbor_edge_dict: dict[ModelNode, ModelEdge]
-        self.overlapped_nodes: list[ModelNode]
 
-    def setup(self):
-        self.neighbor_edge_dict = {
+    @property
+    def _neighbor_edge_dict(self) -> dict[int, int]:
+        if self.__neighbor_edge_dict is None:
+            self.__neighbor_edge_dict = {
+                node_index: DensityMapGraph.get_edge_index(self.index, node_index) for node_index in range(len(self.graph.nodes))
+            }
+        return self.__neighbor_edge_dict
+
+    @cached_property
+    def neighbor_edge_dict(self) -> dict[ModelNode, ModelEdge]:
+        return {
             self.graph.nodes[int(node_index)]: self.graph.edges[
                 edge_index
             ]  # json save key as str, so type conversion is needed.
             for node_index, edge_index in self._neighbor_edge_dict.items()
         }
-        self.overlapped_nodes = [
-            self.graph.nodes[node_index] for node_index in self._overlapped_nodes
-        ]
+
+    @cached_property
+    def overlapped_nodes(self) -> list[ModelNode]:
+        return [self.graph.nodes[node_index] for node_index in self._overlapped_nodes]
 
     @classmethod
     def create(cls, graph: PharmacophoreModel, node: DensityMapNode) -> ModelNode:
@@ -273,10 +639,7 @@ class ModelNode:
             node.score,
             center,
             node.radius,
-            {
-                neighbor.index: edge.index
-                for neighbor, edge in node.neighbor_edge_dict.items()
-            },
+            None,
             [node.index for node in node.overlapped_nodes],
         )
 
@@ -0,0 +1,127 @@
+import argparse
+import json
+import logging
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+from .module import PharmacoNet, ModelingResult
+from .pharmacophore_model import PharmacophoreModel
+from .batch import DEFAULT_WEIGHT_PATH
+
+
+def compare_results(
+    reference: ModelingResult,
+    result: ModelingResult,
+    reference_model: PharmacophoreModel,
+    model: PharmacophoreModel,
+    node_tolerance: float = 1.0,
+) -> dict:
+    """Drift of a modeling result from the reference (fp32) result
+
+    Args:
+        reference: reference ModelingResult
+        result: ModelingResult to compare
+        reference_model: pharmacophore model of the reference
+        model: pharmacophore model of the result
+        node_tolerance: distance (A) to match the nodes with the same interaction type
+
+    Returns:
+        report: dict
+    """
+    assert np.array_equal(reference.tokens, result.tokens), "different inputs"
+    token_score_diff = np.abs(reference.token_scores - result.token_scores)
+    relative_score_diff = np.abs(reference.relative_scores - result.relative_scores)
+    cavity_diff = max(
+        float(np.abs(reference.cavity_narrow - result.cavity_narrow).max()),
+        float(np.abs(reference.cavity_wide - result.cavity_wide).max()),
+    )
+
+    reference_hotspots = {int(idx): crop for idx, crop in zip(reference.hotspot_indices, reference.density_map_crops)}
+    hotspots = {int(idx): crop for idx, crop in zip(result.hotspot_indices, result.density_map_crops)}
+    common_hotspots = reference_hotspots.keys() & hotspots.keys()
+    density_map_diffs = [np.abs(reference_hotspots[idx] - hotspots[idx]) for idx in common_hotspots]
+
+    # NOTE: greedy matching of the pharmacophore nodes (same type, nearest center)
+    unmatched_nodes = list(model.nodes)
+    center_shifts = []
+    for reference_node in reference_model.nodes:
+        candidates = [node for node in unmatched_nodes if node.interaction_type == reference_node.interaction_type]
+        if len(candidates) == 0:
+            continue
+        distances = [np.linalg.norm(np.subtract(node.center, reference_node.center)) for node in candidates]
+        nearest = int(np.argmin(distances))
+        if distances[nearest] < node_tolerance:
+            center_shifts.append(float(distances[nearest]))
+            unmatched_nodes.remove(candidates[nearest])
+
+    return {
+        "token_score_max_diff": float(token_score_diff.max(initial=0.0)),
+        "token_score_mean_diff": float(token_score_diff.mean()) if token_score_diff.size > 0 else 0.0,
+        "relative_score_max_diff": float(relative_score_diff.max(initial=0.0)),
+        "cavity_max_diff": cavity_diff,
+        "num_hotspots": [len(reference_hotspots), len(hotspots)],
+        "num_added_hotspots": len(hotspots.keys() - reference_hotspots.keys()),
+        "num_removed_hotspots": len(reference_hotspots.keys() - hotspots.keys()),
+        "density_map_max_diff": max((float(diff.max()) for diff in density_map_diffs), default=0.0),
+        "density_map_mean_diff": (
+            float(np.mean([diff.mean() for diff in density_map_diffs])) if len(density_map_diffs) > 0 else 0.0
+        ),
+        "num_nodes": [len(reference_model.nodes), len(model.nodes)],
+        "num_matched_nodes": len(center_shifts),
+        "node_center_max_shift": max(center_shifts, default=0.0),
+    }
+
+
+def compare_precision(
+    model_path: str,
+    protein_pdb_path: str,
+    center_or_ref_ligand: str | ArrayLike,
+    precision: str,
+    node_tolerance: float = 1.0,
+    **module_kwargs,
+) -> dict:
+    """Compare the reduced-precision modeling with fp32 on a complex
+
+    Args:
+        model_path: PharmacoNet checkpoint path
+        protein_pdb_path: protein structure file (pdb)
+        center_or_ref_ligand: binding site center (x, y, z) or reference ligand file path
+        precision: "bf16" or "int8"
+        node_tolerance: distance (A) to match the nodes with the same interaction type
+        module_kwargs: keyword arguments of PharmacoNet (e.g. score_threshold)
+
+    Returns:
+        report: dict
+    """
+    reference_module = PharmacoNet(model_path, precision="fp32", **module_kwargs)
+    module = PharmacoNet(model_path, precision=precision, **module_kwargs)
+    reference = reference_module.inference(protein_pdb_path, center_or_ref_ligand)
+    result = module.inference(protein_pdb_path, center_or_ref_ligand)
+    assert reference is not None and result is not None
+    report = compare_results(
+        reference,
+        result,
+        reference_module.rebuild_model(reference),
+        module.rebuild_model(result),
+        node_tolerance,
+    )
+    return {"precision": precision, **report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PharmacoNet: Reduced-Precision Drift Check")
+    parser.add_argument("-p", "--protein", type=str, required=True, help="protein pdb file")
+    parser.add_argument("-l", "--ref_ligand", type=str, required=True, help="reference ligand file")
+    parser.add_argument("--precision", type=str, default="int8", choices=["bf16", "int8"])
+    parser.add_argument("--weight", type=str, default=str(DEFAULT_WEIGHT_PATH), help="PharmacoNet checkpoint path")
+    parser.add_argument("--node_tolerance", type=float, default=1.0, help="distance (A) to match the nodes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    report = compare_precision(args.weight, args.protein, args.ref_ligand, args.precision, args.node_tolerance)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
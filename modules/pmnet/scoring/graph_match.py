@@ -3,8 +3,8 @@ from __future__ import annotations
 import itertools
 
 import numpy as np
-import math
 
+from collections.abc import Iterable
 from typing import TYPE_CHECKING
 from numpy.typing import NDArray
 
@@ -21,7 +21,7 @@ if TYPE_CHECKING:
     from pmnet.pharmacophore_model import (
         PharmacophoreModel,
         ModelNodeCluster,
-        ModelNode,
+        ModelScoringTables,
     )
 
     LigandClusterPair = tuple[LigandNodeCluster, LigandNodeCluster]
@@ -39,6 +39,18 @@ DEFAULT_WEIGHTS: dict[str, float] = dict(
     Hydrophobic=1,
 )
 
+# NOTE: pharmacophore types of the model nodes (bit `i` of a type mask is `PHARMACOPHORE_TYPES[i]`)
+PHARMACOPHORE_TYPES: tuple[str, ...] = tuple(DEFAULT_WEIGHTS.keys())
+PHARMACOPHORE_TYPE_CODES: dict[str, int] = {typ: code for code, typ in enumerate(PHARMACOPHORE_TYPES)}
+
+
+def get_type_mask(types: Iterable[str]) -> int:
+    """Bitmask of pharmacophore types"""
+    mask = 0
+    for typ in types:
+        mask |= 1 << PHARMACOPHORE_TYPE_CODES[typ]
+    return mask
+
 
 def priority_fn(cluster: LigandNodeCluster):
     cluster_size_priority = -len(cluster.nodes)
@@ -68,19 +80,22 @@ class GraphMatcher:
         weights: dict[str, float] | None = None,
     ):
         self.model_graph: PharmacophoreModel = model
+        self.model_tables: ModelScoringTables = model.scoring_tables
         self.ligand_graph: LigandGraph = ligand.graph
         self.num_atoms = ligand.num_atoms
         self.num_rotatable_bonds = ligand.num_rotatable_bonds
         self.num_conformers = self.ligand_graph.num_conformers
         self.cluster_match_dict: dict[LigandNodeCluster, list[ModelNodeCluster]]
+        self.cluster_match_index_dict: dict[LigandNodeCluster, NDArray[np.int64]]
         self.ligand_cluster_list: list[LigandNodeCluster]
         self.node_match_dict: dict[
             tuple[LigandNodeCluster, ModelNodeCluster],
-            list[tuple[LigandNode, list[ModelNode], NDArray[np.float32]]],
+            list[tuple[LigandNode, NDArray[np.int64], NDArray[np.float32]]],
         ]
         self.weights: dict[str, float] = DEFAULT_WEIGHTS.copy()
         if weights is not None:
             self.weights.update(weights)
+        self.node_weights: NDArray[np.float32] = self.model_tables.get_node_weights(self.weights)
 
     def setup(self):
         self.cluster_match_dict = self._get_cluster_match_dict()
@@ -120,54 +135,54 @@ class GraphMatcher:
         self,
     ) -> dict[LigandNodeCluster, list[ModelNodeCluster]]:
         cluster_match_dict: dict[LigandNodeCluster, list[ModelNodeCluster]] = {}
-        ligand_graph, model_graph = self.ligand_graph, self.model_graph
-        for ligand_cluster in ligand_graph.node_clusters:
-            match_model_clusters = [
-                model_cluster
-                for model_cluster in model_graph.node_clusters
-                if len(ligand_cluster.node_types.intersection(model_cluster.node_types))
-                > 0
-            ]
-            if len(match_model_clusters) > 0:
-                cluster_match_dict[ligand_cluster] = match_model_clusters
+        self.cluster_match_index_dict = {}
+        model_clusters = self.model_graph.node_clusters
+        cluster_type_masks = self.model_tables.cluster_type_masks
+        for ligand_cluster in self.ligand_graph.node_clusters:
+            match_indices = np.flatnonzero(
+                cluster_type_masks & get_type_mask(ligand_cluster.node_types)
+            )
+            if len(match_indices) > 0:
+                cluster_match_dict[ligand_cluster] = [
+                    model_clusters[index] for index in match_indices.tolist()
+                ]
+                self.cluster_match_index_dict[ligand_cluster] = match_indices
         return cluster_match_dict
 
     def _get_node_match_dict(
         self,
     ) -> dict[
         tuple[LigandNodeCluster, ModelNodeCluster],
-        list[tuple[LigandNode, list[ModelNode], NDArray[np.float32]]],
+        list[tuple[LigandNode, NDArray[np.int64], NDArray[np.float32]]],
     ]:
-        def __get_node_match(
-            ligand_node: LigandNode, model_cluster: ModelNodeCluster
-        ) -> tuple[LigandNode, list[ModelNode], NDArray[np.float32]]:
-            match_model_nodes = [
-                model_node
-                for model_node in model_cluster.nodes
-                if model_node.type in ligand_node.types
-            ]
-            weights = np.array(
-                [self.weights[model_node.type] for model_node in match_model_nodes],
-                dtype=np.float32,
-            )
-            return (ligand_node, match_model_nodes, weights)
-
-        node_match_dict = {
-            (ligand_cluster, model_cluster): [
-                __get_node_match(ligand_node, model_cluster)
+        model_clusters = self.model_graph.node_clusters
+        cluster_node_indices = self.model_tables.cluster_node_indices
+        node_type_codes = self.model_tables.node_type_codes
+        node_match_dict = {}
+        for ligand_cluster, match_indices in self.cluster_match_index_dict.items():
+            ligand_node_masks = [
+                (ligand_node, get_type_mask(ligand_node.types))
                 for ligand_node in ligand_cluster.nodes
             ]
-            for ligand_cluster, model_cluster_list in self.cluster_match_dict.items()
-            for model_cluster in model_cluster_list
-        }
-        node_match_dict = {
-            key: [
-                (ligand_node, model_node_list, weights)
-                for ligand_node, model_node_list, weights in node_matches
-                if len(model_node_list) > 0
-            ]
-            for key, node_matches in node_match_dict.items()
-        }
+            for cluster_index in match_indices.tolist():
+                model_node_indices = cluster_node_indices[cluster_index]
+                model_node_bits = 1 << node_type_codes[model_node_indices]
+                node_matches = []
+                for ligand_node, ligand_node_mask in ligand_node_masks:
+                    match_model_node_indices = model_node_indices[
+                        (model_node_bits & ligand_node_mask) > 0
+                    ]
+                    if len(match_model_node_indices) > 0:
+                        node_matches.append(
+                            (
+                                ligand_node,
+                                match_model_node_indices,
+                                self.node_weights[match_model_node_indices],
+                            )
+                        )
+                node_match_dict[ligand_cluster, model_clusters[cluster_index]] = (
+                    node_matches
+                )
         return node_match_dict
 
     # NOTE: (Not Use) Code with Readability - same to _get_pair_scores().
@@ -178,12 +193,16 @@ class GraphMatcher:
             LigandClusterPair, dict[ModelClusterPair, tuple[float, ...]]
         ] = {
             (ligand_cluster1, ligand_cluster2): {}
-            for ligand_cluster1, ligand_cluster2 in itertools.combinations(
+            for ligand_cluster1, ligand_cluster2 in itertools.combinations_with_replacement(
                 self.ligand_cluster_list, 2
             )
         }
 
         NO_MATCH_SCORE = (-1,) * self.num_conformers
+        distance_mean_stds = self.model_tables.distance_mean_stds
+        cluster_distances = self.model_tables.cluster_distances
+        cluster_sizes = self.model_tables.cluster_sizes
+        model_clusters = self.model_graph.node_clusters
         for ligand_cluster1, ligand_cluster2 in itertools.combinations(
             self.ligand_cluster_list, 2
         ):
@@ -192,21 +211,13 @@ class GraphMatcher:
             )
             ligand_cluster_size = ligand_cluster1.size + ligand_cluster2.size
 
-            model_cluster_list1, model_cluster_list2 = (
-                self.cluster_match_dict[ligand_cluster1],
-                self.cluster_match_dict[ligand_cluster2],
-            )
-            for model_cluster1, model_cluster2 in itertools.product(
-                model_cluster_list1, model_cluster_list2
+            for index1, index2 in itertools.product(
+                self.cluster_match_index_dict[ligand_cluster1].tolist(),
+                self.cluster_match_index_dict[ligand_cluster2].tolist(),
             ):
-                (x1, y1, z1), (x2, y2, z2) = (
-                    model_cluster1.center,
-                    model_cluster2.center,
-                )
-                model_cluster_distance = math.sqrt(
-                    (x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2
-                )
-                model_cluster_size = model_cluster1.size + model_cluster2.size
+                model_cluster1, model_cluster2 = model_clusters[index1], model_clusters[index2]
+                model_cluster_distance = cluster_distances[index1, index2]
+                model_cluster_size = cluster_sizes[index1] + cluster_sizes[index2]
 
                 if (
                     min(
@@ -224,7 +235,10 @@ class GraphMatcher:
                         ligand_cluster2, model_cluster2
                     ]
                     pair_score = scoring_matching_pair(
-                        node_match_list1, node_match_list2, self.num_conformers
+                        node_match_list1,
+                        node_match_list2,
+                        distance_mean_stds,
+                        self.num_conformers,
                     )
                 matching_pair_scores_dict[ligand_cluster1, ligand_cluster2][
                     model_cluster1, model_cluster2
@@ -234,7 +248,7 @@ class GraphMatcher:
             for model_cluster in self.cluster_match_dict[ligand_cluster]:
                 node_match_list = self.node_match_dict[ligand_cluster, model_cluster]
                 self_pair_score = scoring_matching_self(
-                    node_match_list, self.num_conformers
+                    node_match_list, distance_mean_stds, self.num_conformers
                 )
                 matching_pair_scores_dict[ligand_cluster, ligand_cluster][
                     model_cluster, model_cluster
@@ -247,6 +261,10 @@ class GraphMatcher:
         self,
     ) -> dict[LigandClusterPair, dict[ModelClusterPair, tuple[float, ...]]]:
         NO_MATCH_SCORE = (-1,) * self.num_conformers
+        distance_mean_stds = self.model_tables.distance_mean_stds
+        cluster_distances = self.model_tables.cluster_distances
+        cluster_sizes = self.model_tables.cluster_sizes
+        model_clusters = self.model_graph.node_clusters
 
         def __get_score_dict_outer(
             ligand_cluster_pair: LigandClusterPair,
@@ -256,6 +274,7 @@ class GraphMatcher:
                 return {
                     (model_cluster, model_cluster): scoring_matching_self(
                         self.node_match_dict[ligand_cluster1, model_cluster],
+                        distance_mean_stds,
                         self.num_conformers,
                     )
                     for model_cluster in self.cluster_match_dict[ligand_cluster1]
@@ -263,51 +282,35 @@ class GraphMatcher:
             else:
                 ligand_cluster_distance = np.linalg.norm(
                     ligand_cluster1.center - ligand_cluster2.center, axis=-1
-                )
-                ligand_cluster_size = ligand_cluster1.size + ligand_cluster2.size
-                return {
-                    model_cluster_pair: __get_score_dict_inner(
-                        ligand_cluster_pair,
-                        model_cluster_pair,
-                        ligand_cluster_distance,
-                        ligand_cluster_size,
+                )  # [C,]
+                ligand_cluster_size = ligand_cluster1.size + ligand_cluster2.size  # [C,]
+                indices1 = self.cluster_match_index_dict[ligand_cluster1]
+                indices2 = self.cluster_match_index_dict[ligand_cluster2]
+                model_cluster_distance = cluster_distances[np.ix_(indices1, indices2)]  # [K1, K2]
+                model_cluster_size = cluster_sizes[indices1, None] + cluster_sizes[None, indices2]  # [K1, K2]
+                is_no_match = (
+                    np.min(
+                        np.abs(ligand_cluster_distance - model_cluster_distance[..., None])
+                        - ligand_cluster_size,
+                        axis=-1,
                     )
-                    for model_cluster_pair in itertools.product(
-                        self.cluster_match_dict[ligand_cluster1],
-                        self.cluster_match_dict[ligand_cluster2],
+                    > model_cluster_size
+                )  # [K1, K2]
+                return {
+                    (model_clusters[index1], model_clusters[index2]): (
+                        NO_MATCH_SCORE
+                        if no_match
+                        else scoring_matching_pair(
+                            self.node_match_dict[ligand_cluster1, model_clusters[index1]],
+                            self.node_match_dict[ligand_cluster2, model_clusters[index2]],
+                            distance_mean_stds,
+                            self.num_conformers,
+                        )
                     )
+                    for index1, no_match_list in zip(indices1.tolist(), is_no_match.tolist(), strict=True)
+                    for index2, no_match in zip(indices2.tolist(), no_match_list, strict=True)
                 }
 
-        def __get_score_dict_inner(
-            ligand_cluster_pair: LigandClusterPair,
-            model_cluster_pair: ModelClusterPair,
-            ligand_cluster_distance: NDArray[np.float32],
-            ligand_cluster_size: NDArray[np.float32],
-        ) -> tuple[float, ...]:
-            ligand_cluster1, ligand_cluster2 = ligand_cluster_pair
-            model_cluster1, model_cluster2 = model_cluster_pair
-            (x1, y1, z1), (x2, y2, z2) = model_cluster1.center, model_cluster2.center
-            model_cluster_distance = math.sqrt(
-                (x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2
-            )
-            model_cluster_size = model_cluster1.size + model_cluster2.size
-
-            if (
-                min(
-                    np.abs(ligand_cluster_distance - model_cluster_distance)
-                    - ligand_cluster_size
-                )
-                > model_cluster_size
-            ):
-                pair_score = NO_MATCH_SCORE
-            else:
-                node_match_list1 = self.node_match_dict[ligand_cluster1, model_cluster1]
-                node_match_list2 = self.node_match_dict[ligand_cluster2, model_cluster2]
-                pair_score = scoring_matching_pair(
-                    node_match_list1, node_match_list2, self.num_conformers
-                )
-            return pair_score
-
         matching_pair_scores_dict: dict[
             LigandClusterPair, dict[ModelClusterPair, tuple[float, ...]]
         ] = {
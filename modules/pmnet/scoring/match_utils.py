@@ -1,6 +1,8 @@
 import itertools
 import numpy as np
 
+from numpy.typing import NDArray
+
 DISTANCE_SIGMA_THRESHOLD = 2.0
 PASS_THRESHOLD = 0.5
 
@@ -8,11 +10,13 @@ PASS_THRESHOLD = 0.5
 def scoring_matching_pair(
     cluster_node_match_list1,
     cluster_node_match_list2,
+    distance_mean_stds: NDArray[np.float32],
     num_conformers: int,
 ) -> tuple[float, ...]:
     """
-    cluster_node_match_list1: list[tuple[LigandNode, list[ModelNode], NDArray[np.float32]]],
-    cluster_node_match_list2: list[tuple[LigandNode, list[ModelNode], NDArray[np.float32]]],
+    cluster_node_match_list1: list[tuple[LigandNode, NDArray[np.int64], NDArray[np.float32]]],
+    cluster_node_match_list2: list[tuple[LigandNode, NDArray[np.int64], NDArray[np.float32]]],
+    distance_mean_stds: NDArray[np.float32] - [N_model_nodes, N_model_nodes, 2]
     num_conformers: int,
     """
     match_scores = np.zeros((num_conformers,), dtype=np.float32)
@@ -29,30 +33,17 @@ def scoring_matching_pair(
     for cluster_node_match1, cluster_node_match2 in itertools.product(
         cluster_node_match_list1, cluster_node_match_list2
     ):
-        ligand_node1, model_node_list1, weights1 = cluster_node_match1
-        ligand_node2, model_node_list2, weights2 = cluster_node_match2
+        ligand_node1, model_node_indices1, weights1 = cluster_node_match1
+        ligand_node2, model_node_indices2, weights2 = cluster_node_match2
         ligand_edge = ligand_node1.neighbor_edge_dict[ligand_node2]
         distances = ligand_edge.distances
 
-        num_match = len(model_node_list1) * len(model_node_list2)
-        means = np.array(
-            [
-                [model_node1.neighbor_edge_dict[model_node2].distance_mean]
-                for model_node1, model_node2 in itertools.product(
-                    model_node_list1, model_node_list2
-                )
-            ],
-            dtype=np.float32,
-        )  # [M*N, 1]
-        stds = np.array(
-            [
-                [model_node1.neighbor_edge_dict[model_node2].distance_std]
-                for model_node1, model_node2 in itertools.product(
-                    model_node_list1, model_node_list2
-                )
-            ],
-            dtype=np.float32,
-        )  # [M*N, 1]
+        num_match = len(model_node_indices1) * len(model_node_indices2)
+        mean_stds = distance_mean_stds[
+            model_node_indices1[:, None], model_node_indices2[None, :]
+        ].reshape(-1, 2)  # [M*N, 2]
+        means = mean_stds[:, :1]  # [M*N, 1]
+        stds = mean_stds[:, 1:]  # [M*N, 1]
         weights = (weights1.reshape(-1, 1) * weights2.reshape(1, -1)).reshape(
             -1
         )  # [M * N]
@@ -85,10 +76,12 @@ def scoring_matching_pair(
 
 def scoring_matching_self(
     cluster_node_match_list,
+    distance_mean_stds: NDArray[np.float32],
     num_conformers: int,
 ) -> tuple[float, ...]:
     """
-    cluster_node_match_list: list[tuple[LigandNode, list[ModelNode], NDArray[np.float32]]]
+    cluster_node_match_list: list[tuple[LigandNode, NDArray[np.int64], NDArray[np.float32]]]
+    distance_mean_stds: NDArray[np.float32] - [N_model_nodes, N_model_nodes, 2]
     num_conformers: str
     """
     match_scores = np.zeros((num_conformers,), dtype=np.float32)
@@ -96,30 +89,17 @@ def scoring_matching_self(
     for cluster_node_match1, cluster_node_match2 in itertools.combinations(
         cluster_node_match_list, 2
     ):
-        ligand_node1, model_node_list1, weights1 = cluster_node_match1
-        ligand_node2, model_node_list2, weights2 = cluster_node_match2
+        ligand_node1, model_node_indices1, weights1 = cluster_node_match1
+        ligand_node2, model_node_indices2, weights2 = cluster_node_match2
         ligand_edge = ligand_node1.neighbor_edge_dict[ligand_node2]
         distances = ligand_edge.distances
 
-        num_match = len(model_node_list1) * len(model_node_list2)
-        means = np.array(
-            [
-                [model_node1.neighbor_edge_dict[model_node2].distance_mean]
-                for model_node1, model_node2 in itertools.product(
-                    model_node_list1, model_node_list2
-                )
-            ],
-            dtype=np.float32,
-        )  # [M*N, 1]
-        stds = np.array(
-            [
-                [model_node1.neighbor_edge_dict[model_node2].distance_std]
-                for model_node1, model_node2 in itertools.product(
-                    model_node_list1, model_node_list2
-                )
-            ],
-            dtype=np.float32,
-        )  # [M*N, 1]
+        num_match = len(model_node_indices1) * len(model_node_indices2)
+        mean_stds = distance_mean_stds[
+            model_node_indices1[:, None], model_node_indices2[None, :]
+        ].reshape(-1, 2)  # [M*N, 2]
+        means = mean_stds[:, :1]  # [M*N, 1]
+        stds = mean_stds[:, 1:]  # [M*N, 1]
         weights = (weights1.reshape(-1, 1) * weights2.reshape(1, -1)).reshape(
             -1
         )  # [M*N]
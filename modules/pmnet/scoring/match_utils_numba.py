@@ -152,23 +152,16 @@ def __numba_run_self(
         score_array[c] += likelihood * normalize_coeff * score_coeff
 
 
-def __get_distance_mean_std(model_node1, model_node2) -> tuple[float, float]:
-    """
-    model_node1: ModelNode
-    model_node2: ModelNode
-    """
-    edge = model_node1.neighbor_edge_dict[model_node2]
-    return edge.distance_mean, edge.distance_std
-
-
 def scoring_matching_pair(
     cluster_node_match_list1,
     cluster_node_match_list2,
+    distance_mean_stds: NDArray[np.float32],
     num_conformers: int,
 ) -> tuple[float, ...]:
     """
-    cluster_node_match_list1: List[tuple[LigandNode, List[ModelNode], NDArray[np.float32]]],
-    cluster_node_match_list2: List[tuple[LigandNode, List[ModelNode], NDArray[np.float32]]],
+    cluster_node_match_list1: List[tuple[LigandNode, NDArray[np.int64], NDArray[np.float32]]],
+    cluster_node_match_list2: List[tuple[LigandNode, NDArray[np.int64], NDArray[np.float32]]],
+    distance_mean_stds: NDArray[np.float32] - [N_model_nodes, N_model_nodes, 2]
     num_conformers: int,
     """
 
@@ -180,21 +173,12 @@ def scoring_matching_pair(
 
     match_scores = np.zeros((num_conformers,), dtype=np.float32)
     num_fails = np.zeros((num_conformers,), dtype=np.int16)
-    for ligand_node1, model_node_list1, weights1 in cluster_node_match_list1:
-        for ligand_node2, model_node_list2, weights2 in cluster_node_match_list2:
+    for ligand_node1, model_node_indices1, weights1 in cluster_node_match_list1:
+        for ligand_node2, model_node_indices2, weights2 in cluster_node_match_list2:
             ligand_edge = ligand_node1.neighbor_edge_dict[ligand_node2]
             distances = ligand_edge.distances
 
-            mean_stds = np.array(
-                [
-                    [
-                        __get_distance_mean_std(model_node1, model_node2)
-                        for model_node2 in model_node_list2
-                    ]
-                    for model_node1 in model_node_list1
-                ],
-                dtype=np.float32,
-            )  # [M, N, 2]
+            mean_stds = distance_mean_stds[model_node_indices1[:, None], model_node_indices2[None, :]]  # [M, N, 2]
             __numba_run(
                 distances, mean_stds, weights1, weights2, match_scores, num_fails
             )
@@ -209,30 +193,23 @@ def scoring_matching_pair(
 
 def scoring_matching_self(
     cluster_node_match_list,
+    distance_mean_stds: NDArray[np.float32],
     num_conformers: int,
 ) -> tuple[float, ...]:
     """
-    cluster_node_match_list: List[tuple[LigandNode, List[ModelNode], NDArray[np.float32]]],
+    cluster_node_match_list: List[tuple[LigandNode, NDArray[np.int64], NDArray[np.float32]]],
+    distance_mean_stds: NDArray[np.float32] - [N_model_nodes, N_model_nodes, 2]
     num_conformers: int,
     """
     match_scores = np.zeros((num_conformers,), dtype=np.float32)
     for match1, match2 in itertools.combinations(cluster_node_match_list, 2):
-        ligand_node1, model_node_list1, weights1 = match1
-        ligand_node2, model_node_list2, weights2 = match2
+        ligand_node1, model_node_indices1, weights1 = match1
+        ligand_node2, model_node_indices2, weights2 = match2
 
         ligand_edge = ligand_node1.neighbor_edge_dict[ligand_node2]
         distances = ligand_edge.distances
 
-        mean_stds = np.array(
-            [
-                [
-                    __get_distance_mean_std(model_node1, model_node2)
-                    for model_node2 in model_node_list2
-                ]
-                for model_node1 in model_node_list1
-            ],
-            dtype=np.float32,
-        )  # [M, N, 2]
+        mean_stds = distance_mean_stds[model_node_indices1[:, None], model_node_indices2[None, :]]  # [M, N, 2]
         __numba_run_self(
             distances,
             mean_stds,
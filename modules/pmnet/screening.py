@@ -0,0 +1,192 @@
+import argparse
+import csv
+import logging
+import multiprocessing
+import os
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import NDArray
+from openbabel import pybel
+
+from .pharmacophore_model import PharmacophoreModel
+from .scoring.ligand import Ligand
+
+
+LIGAND_EXTENSIONS = (".sdf", ".pdb", ".mol2")
+
+# NOTE: score of the ligands which fail in parsing or scoring
+FAIL_SCORE = -1.0
+
+
+def scoring_ligand(
+    models: Sequence[PharmacophoreModel],
+    ligand: Ligand,
+    weights: dict[str, float] | None = None,
+) -> NDArray[np.float32]:
+    """Score one ligand against multiple pharmacophore models
+
+    The ligand graph is built once and matched against each model.
+
+    Args:
+        models: pharmacophore models
+        ligand: Ligand
+        weights: dict[str, float] | None
+
+    Returns:
+        scores: [N_models,]
+    """
+    return np.array([model._scoring(ligand, weights) for model in models], dtype=np.float32)
+
+
+def scoring_pbmol(
+    models: Sequence[PharmacophoreModel],
+    ligand_pbmol: pybel.Molecule,
+    atom_positions: list[NDArray[np.float32]] | NDArray[np.float32],
+    conformer_axis: int | None = None,
+    weights: dict[str, float] | None = None,
+) -> NDArray[np.float32]:
+    """Multi-model version of `PharmacophoreModel.scoring_pbmol`
+
+    Returns:
+        scores: [N_models,]
+    """
+    ligand = Ligand(ligand_pbmol, atom_positions, conformer_axis)
+    return scoring_ligand(models, ligand, weights)
+
+
+def scoring_file(
+    models: Sequence[PharmacophoreModel],
+    ligand_file: os.PathLike,
+    weights: dict[str, float] | None = None,
+) -> NDArray[np.float32]:
+    """Multi-model version of `PharmacophoreModel.scoring_file`
+
+    Returns:
+        scores: [N_models,]
+    """
+    ligand = Ligand.load_from_file(ligand_file)
+    return scoring_ligand(models, ligand, weights)
+
+
+def collect_files(paths: Iterable[str | os.PathLike], extensions: Sequence[str]) -> list[Path]:
+    """Files of the given paths (directories are expanded to their files with the extensions)"""
+    files: list[Path] = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(file for file in path.iterdir() if file.suffix in extensions))
+        else:
+            files.append(path)
+    return files
+
+
+# NOTE: pharmacophore models of each worker process (models are loaded once per worker)
+_worker_models: list[PharmacophoreModel] | None = None
+_worker_weights: dict[str, float] | None = None
+
+
+def _init_worker(model_paths: list[str], weights: dict[str, float] | None):
+    global _worker_models, _worker_weights
+    _worker_models = [PharmacophoreModel.load(path) for path in model_paths]
+    _worker_weights = weights
+
+
+def _run_ligand(ligand_path: str) -> tuple[str, NDArray[np.float32], str | None]:
+    assert _worker_models is not None
+    try:
+        ligand = Ligand.load_from_file(ligand_path)
+    except Exception as e:
+        return ligand_path, np.full((len(_worker_models),), FAIL_SCORE, dtype=np.float32), f"{type(e).__name__}: {e}"
+    scores = np.empty((len(_worker_models),), dtype=np.float32)
+    error = None
+    for i, model in enumerate(_worker_models):
+        try:
+            scores[i] = model._scoring(ligand, _worker_weights)
+        except Exception as e:
+            scores[i] = FAIL_SCORE
+            error = f"{type(e).__name__}: {e}"
+    return ligand_path, scores, error
+
+
+def run_screening(
+    model_paths: Sequence[str | os.PathLike],
+    ligand_paths: Sequence[str | os.PathLike],
+    out_path: str | os.PathLike,
+    num_workers: int = 1,
+    weights: dict[str, float] | None = None,
+    chunksize: int = 16,
+) -> dict[str, NDArray[np.float32]]:
+    """Multi-Model Virtual Screening
+
+    Each ligand is parsed once and scored against all models.
+    The result is a csv file whose rows are `ligand_path,score_1,...,score_N` (failed scores are -1).
+
+    Args:
+        model_paths: pharmacophore model paths
+        ligand_paths: ligand files (`.sdf`, `.pdb`, `.mol2`)
+        out_path: output csv path
+        num_workers: number of worker processes
+        weights: dict[str, float] | None
+        chunksize: number of ligands sent to a worker at once
+
+    Returns:
+        scores: {ligand path: [N_models,]}
+    """
+    logger = logging.getLogger("PharmacoNet")
+    model_paths = [str(path) for path in model_paths]
+    ligand_paths = [str(path) for path in ligand_paths]
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+
+    results: dict[str, NDArray[np.float32]] = {}
+    initargs = (model_paths, weights)
+    if num_workers == 1:
+        _init_worker(*initargs)
+        iterator = map(_run_ligand, ligand_paths)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=initargs)
+        iterator = pool.imap(_run_ligand, ligand_paths, chunksize=chunksize)
+    try:
+        with open(out_path, "w", newline="") as w:
+            writer = csv.writer(w)
+            writer.writerow(["ligand"] + [Path(path).stem for path in model_paths])
+            for ligand_path, scores, error in iterator:
+                results[ligand_path] = scores
+                writer.writerow([ligand_path] + [f"{score:.4f}" for score in scores.tolist()])
+                if error is not None:
+                    logger.warning(f"[{len(results)}/{len(ligand_paths)}] {ligand_path}: Fail ({error})")
+                elif len(results) % 100 == 0:
+                    logger.info(f"[{len(results)}/{len(ligand_paths)}]")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PharmacoNet: Multi-Model Virtual Screening")
+    parser.add_argument(
+        "-m", "--models", type=str, nargs="+", required=True, help="pharmacophore models (`.pm` files or directories)"
+    )
+    parser.add_argument(
+        "-l", "--ligands", type=str, nargs="+", required=True, help="ligand files (`.sdf`, `.pdb`, `.mol2`) or directories"
+    )
+    parser.add_argument("-o", "--out", type=str, required=True, help="output csv path")
+    parser.add_argument("--num_workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=16, help="number of ligands sent to a worker at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    model_paths = collect_files(args.models, (".pm",))
+    ligand_paths = collect_files(args.ligands, LIGAND_EXTENSIONS)
+    assert len(model_paths) > 0, "no pharmacophore model is found"
+    logger = logging.getLogger("PharmacoNet")
+    logger.info(f"Screening {len(ligand_paths)} ligands against {len(model_paths)} models")
+    results = run_screening(model_paths, ligand_paths, args.out, args.num_workers, chunksize=args.chunksize)
+    logger.info(f"Finish: {len(results)} ligands, {args.out}")
+
+
+if __name__ == "__main__":
+    main()
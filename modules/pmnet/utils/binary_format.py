@@ -0,0 +1,103 @@
+import json
+import mmap
+import os
+import zlib
+
+import numpy as np
+from numpy.typing import NDArray
+
+# NOTE: file layout
+#   MAGIC (8 bytes) | version (uint32) | reserved (uint32) | metadata length (uint64) | metadata (JSON)
+#   | data section (arrays aligned to ALIGNMENT, then zlib-compressed blobs)
+MAGIC = b"PMNETBIN"
+ALIGNMENT = 64
+_PREFIX_SIZE = len(MAGIC) + 16
+
+
+def is_binary_file(path: str | os.PathLike) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save(
+    path: str | os.PathLike,
+    version: int,
+    header: dict,
+    arrays: dict[str, NDArray],
+    blobs: dict[str, bytes],
+):
+    """Save arrays and compressed blobs into a single binary container
+
+    Args:
+        path: save path
+        version: format version of the content
+        header: json-serializable metadata
+        arrays: {name: array}, stored as raw (memory-mappable) bytes
+        blobs: {name: bytes}, stored with zlib compression
+    """
+    array_infos, blob_infos = {}, {}
+    chunks: list[bytes] = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        padding = -offset % ALIGNMENT
+        chunks.append(b"\x00" * padding)
+        offset += padding
+        array_infos[name] = dict(dtype=array.dtype.str, shape=array.shape, offset=offset)
+        chunks.append(array.tobytes())
+        offset += array.nbytes
+    for name, blob in blobs.items():
+        compressed = zlib.compress(blob)
+        blob_infos[name] = dict(offset=offset, nbytes=len(compressed))
+        chunks.append(compressed)
+        offset += len(compressed)
+
+    metadata = json.dumps(dict(header=header, arrays=array_infos, blobs=blob_infos)).encode()
+    metadata += b" " * (-(_PREFIX_SIZE + len(metadata)) % ALIGNMENT)
+    with open(path, "wb") as w:
+        w.write(MAGIC)
+        w.write(np.array([version, 0], dtype="<u4").tobytes())
+        w.write(np.array([len(metadata)], dtype="<u8").tobytes())
+        w.write(metadata)
+        for chunk in chunks:
+            w.write(chunk)
+
+
+class BinaryContainer:
+    def __init__(self, path: str | os.PathLike, use_mmap: bool = True):
+        """Binary container written by `save`
+
+        The arrays are read-only views of the file (memory-mapped if `use_mmap`),
+        and each blob is decompressed only when it is requested.
+
+        Args:
+            path: file path
+            use_mmap: if True, memory-map the file, else read the whole file
+        """
+        with open(path, "rb") as f:
+            if use_mmap:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.buffer = f.read()
+        if self.buffer[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a binary container")
+        self.version, _ = np.frombuffer(self.buffer, dtype="<u4", count=2, offset=len(MAGIC)).tolist()
+        (metadata_length,) = np.frombuffer(self.buffer, dtype="<u8", count=1, offset=len(MAGIC) + 8).tolist()
+        metadata = json.loads(bytes(self.buffer[_PREFIX_SIZE : _PREFIX_SIZE + metadata_length]))
+        self.header: dict = metadata["header"]
+        self.array_infos: dict[str, dict] = metadata["arrays"]
+        self.blob_infos: dict[str, dict] = metadata["blobs"]
+        self.data_offset: int = _PREFIX_SIZE + metadata_length
+
+    def array(self, name: str) -> NDArray:
+        info = self.array_infos[name]
+        dtype = np.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        array = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.data_offset + info["offset"])
+        return array.reshape(shape)
+
+    def blob(self, name: str) -> bytes:
+        info = self.blob_infos[name]
+        start = self.data_offset + info["offset"]
+        return zlib.decompress(self.buffer[start : start + info["nbytes"]])
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import NDArray
+
+# NOTE: increase it when the preprocessing (pocket extraction, tokens, voxelization) is changed.
+CACHE_VERSION = 2
+
+# NOTE: names of the arrays in an entry (an entry without a complete manifest is a cache miss)
+MANIFEST_NAME = "manifest.txt"
+
+
+class PreprocessingCache:
+    def __init__(self, cache_dir: str | os.PathLike, max_size: int = 4096):
+        """On-disk cache of preprocessed pockets
+
+        Each entry is a directory of `.npy` files and a manifest of their names,
+        and the arrays are loaded with memory-mapping.
+        The least recently used entries are evicted when the total size exceeds `max_size`.
+
+        Args:
+            cache_dir: cache directory
+            max_size: maximum cache size (MB)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.logger = logging.getLogger("PharmacoNet")
+
+    @staticmethod
+    def make_key(*items: str | bytes) -> str:
+        """Hash the cache key items (e.g. protein block, center, voxel config)"""
+        hasher = hashlib.sha256(f"version={CACHE_VERSION}".encode())
+        for item in items:
+            item = item.encode() if isinstance(item, str) else item
+            hasher.update(len(item).to_bytes(8, "little"))
+            hasher.update(item)
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> dict[str, NDArray] | None:
+        """Load the cached arrays (copy-on-write memory-map)
+
+        Args:
+            key: cache key
+
+        Returns:
+            arrays: {name: array}, or None if there is no complete entry (e.g. it is being evicted)
+        """
+        entry_dir = self.cache_dir / key
+        try:
+            with open(entry_dir / MANIFEST_NAME) as f:
+                names = f.read().split()
+            arrays = {name: np.load(entry_dir / f"{name}.npy", mmap_mode="c") for name in names}
+            os.utime(entry_dir)  # NOTE: for LRU eviction
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return arrays
+
+    def put(self, key: str, arrays: dict[str, NDArray]):
+        """Save the arrays (atomic)
+
+        Args:
+            key: cache key
+            arrays: {name: array}
+        """
+        entry_dir = self.cache_dir / key
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+            with open(os.path.join(tmp_dir, MANIFEST_NAME), "w") as w:
+                w.write("\n".join(arrays.keys()))
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # NOTE: the same entry is written by another process.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache size is within `max_size`"""
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            if not entry_dir.is_dir() or entry_dir.name.startswith(".tmp-"):
+                continue
+            try:
+                size = sum(path.stat().st_size for path in entry_dir.iterdir())
+                entries.append((entry_dir.stat().st_mtime, size, entry_dir))
+            except FileNotFoundError:
+                continue
+        total_size = sum(size for _, size, _ in entries)
+        max_size = self.max_size * 1024 * 1024
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= max_size:
+                break
+            self.logger.debug(f"Preprocessing cache: evict {entry_dir.name}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
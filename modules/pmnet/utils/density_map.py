@@ -2,13 +2,19 @@ from __future__ import annotations
 
 import numpy as np
 import math
-import itertools
 
-from collections.abc import Iterator
+from functools import cached_property
+
+from dataclasses import dataclass
 from numpy.typing import NDArray
 
 from pmnet.data.constant import INTERACTION_LIST
 
+try:
+    from .label_utils_numba import label_components
+except Exception:
+    from .label_utils import label_components
+
 
 OVERLAP_DISTANCE = 1.5
 CLUSTER_DISTANCE = 3.0
@@ -26,6 +32,82 @@ def coords_to_position(coords, center, resolution, size) -> tuple[float, float,
     return (x_pos, y_pos, z_pos)
 
 
+@dataclass
+class SparseDensityMap:
+    """Nonzero voxels of a density map (COO format)
+
+    Attributes:
+        coords: IntArray[N, 3] - (x, y, z) grid indices in C order
+        scores: FloatArray[N,]
+        size: grid size of the dense map
+    """
+
+    coords: NDArray[np.int16]
+    scores: NDArray[np.float32]
+    size: int
+
+    @classmethod
+    def from_dense(
+        cls,
+        density_map: NDArray[np.float32],
+        bbox: tuple[slice, slice, slice] | None = None,
+    ) -> SparseDensityMap:
+        """Sparsify a dense density map
+
+        Args:
+            density_map: FloatArray[D, H, W]
+            bbox: bounding box of the nonzero area (if None, the whole grid is scanned)
+
+        Returns:
+            sparse_density_map: SparseDensityMap
+        """
+        if bbox is None:
+            return cls.from_crop(density_map, (0, 0, 0), density_map.shape[0])
+        offset = (bbox[0].start, bbox[1].start, bbox[2].start)
+        return cls.from_crop(density_map[bbox], offset, density_map.shape[0])
+
+    @classmethod
+    def from_crop(
+        cls,
+        crop: NDArray[np.float32],
+        offset: tuple[int, int, int],
+        size: int,
+    ) -> SparseDensityMap:
+        """Sparsify a bounding box crop of a density map
+
+        Args:
+            crop: FloatArray[Dbox, Hbox, Wbox]
+            offset: grid index of the first voxel of the crop
+            size: grid size of the dense map
+
+        Returns:
+            sparse_density_map: SparseDensityMap
+        """
+        coords = np.stack(np.nonzero(crop > 0.0), axis=-1)
+        scores = crop[tuple(coords.T)]
+        coords += np.array(offset)
+        return cls(coords.astype(np.int16), scores.astype(np.float32), size)
+
+    def to_dense(self) -> NDArray[np.float32]:
+        density_map = np.zeros((self.size, self.size, self.size), dtype=np.float32)
+        density_map[tuple(self.coords.T)] = self.scores
+        return density_map
+
+    def __len__(self) -> int:
+        return self.coords.shape[0]
+
+    def get_kwargs(self):
+        return dict(coords=self.coords.tolist(), scores=self.scores.tolist(), size=self.size)
+
+    @classmethod
+    def from_kwargs(cls, coords, scores, size) -> SparseDensityMap:
+        return cls(
+            np.array(coords, dtype=np.int16).reshape(-1, 3),
+            np.array(scores, dtype=np.float32),
+            size,
+        )
+
+
 class DensityMapGraph:
     def __init__(
         self, center: tuple[float, float, float], resolution: float, size: int
@@ -35,14 +117,14 @@ class DensityMapGraph:
         self.size: int = size
 
         self.nodes: list[DensityMapNode] = []
-        self.edges: list[DensityMapEdge] = []
         self.node_dict: dict[str, list[DensityMapNode]] = {
             typ: [] for typ in INTERACTION_LIST
         }
-        self.edge_dict_nodes: dict[
-            tuple[DensityMapNode, DensityMapNode], DensityMapEdge
-        ] = {}
-        self.edge_dict_indices: dict[tuple[int, int], DensityMapEdge] = {}
+
+        # NOTE: pairwise arrays of the nodes (see `setup`)
+        self.node_centers: NDArray[np.float32] = np.empty((0, 3), dtype=np.float32)
+        self.node_radii: NDArray[np.float64] = np.empty((0,), dtype=np.float64)
+        self.distance_means: NDArray[np.float32] = np.empty((0, 0), dtype=np.float32)
 
         self.node_clusters: list[DensityMapNodeCluster] = []
         self.node_cluster_dict: dict[str, list[DensityMapNodeCluster]] = dict(
@@ -54,68 +136,78 @@ class DensityMapGraph:
         node_type: str,
         hotspot_position: tuple[float, float, float],
         score: float,
-        mask: NDArray[np.float_],
+        mask: NDArray[np.float_] | SparseDensityMap,
     ):
-        for grids, grid_scores in self.__extract_pharmacophores(mask):
-            grids, grid_scores = np.array(grids), np.array(grid_scores)
-            if len(grids) < 8:
-                continue
+        if not isinstance(mask, SparseDensityMap):
+            mask = SparseDensityMap.from_dense(mask)
+        # NOTE: each 26-connected component of the density map is a node
+        labels, counts, centroids = label_components(mask.coords, mask.scores)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        for label in np.flatnonzero(counts >= 8).tolist():
+            grids = mask.coords[order[offsets[label] : offsets[label + 1]]]
             new_node = DensityMapNode(
-                self, hotspot_position, node_type, score, grids, grid_scores
+                self, hotspot_position, node_type, score, grids, centroids[label]
             )
             self.nodes.append(new_node)
             self.node_dict[node_type].append(new_node)
-            for node in self.nodes:  # Add self loop
-                edge = new_node.add_neighbors(node)
-                self.edges.append(edge)
-                self.edge_dict_nodes[(node, new_node)] = edge
-                self.edge_dict_nodes[(new_node, node)] = edge
-                self.edge_dict_indices[(node.index, new_node.index)] = edge
-                self.edge_dict_indices[(new_node.index, node.index)] = edge
 
     def setup(self):
+        self.__setup_edges()
         self.__clustering()
 
     @staticmethod
-    def __extract_pharmacophores(
-        mask,
-    ) -> Iterator[tuple[list[tuple[int, int, int]], list[float]]]:
-        """Get Node From Mask by Clustering Algorithm
-
-        Args:
-            mask (NDArray): FloatArray[D, H, W]
-
-        Yields:
-            coordinates: list[tuple[int, int, int]] - [(x, y, z)]
-            grid_scores: list[float] - [score]
-        """
-        x_indices, y_indices, z_indices = np.where(mask > 0.0)
-        points = {
-            (int(x), int(y), int(z)) for x, y, z in zip(x_indices, y_indices, z_indices)
-        }
-        while len(points) > 0:
-            point = x, y, z = points.pop()
-            cluster = [point]
-            scores = [float(mask[x, y, z])]
-            search_center = cluster
-            for x, y, z in search_center:
-                new_center = []
-                for dx, dy, dz in itertools.product((-1, 0, 1), repeat=3):
-                    if dx == 0 and dy == 0 and dz == 0:
-                        continue
-                    new_point = _x, _y, _z = (x + dx, y + dy, z + dz)
-                    if new_point in points:
-                        new_center.append(new_point)
-                        scores.append(float(mask[_x, _y, _z]))
-                        points.remove(new_point)
-                cluster += new_center
-                search_center = new_center
-            yield cluster, scores
+    def get_edge_index(index1: int, index2: int) -> int:
+        """Index of the edge between two nodes (edges are ordered as (0, 0), (0, 1), (1, 1), (0, 2), ...)"""
+        if index2 < index1:
+            index1, index2 = index2, index1
+        return index2 * (index2 + 1) // 2 + index1
+
+    def __setup_edges(self):
+        """Pairwise distances of the nodes and the overlapped nodes"""
+        self.node_centers = np.array([node.center for node in self.nodes], dtype=np.float32).reshape(-1, 3)
+        self.node_radii = np.array([node.radius for node in self.nodes], dtype=np.float64)
+        self.distance_means = np.linalg.norm(
+            self.node_centers[:, None, :] - self.node_centers[None, :, :], axis=-1
+        )  # [N, N]
+        for node, is_overlapped in zip(self.nodes, self.distance_means < OVERLAP_DISTANCE, strict=True):
+            overlapped_indices = np.flatnonzero(is_overlapped).tolist()
+            # NOTE: a node is overlapped with itself, and the self loop is recorded at both ends.
+            overlapped_indices.insert(overlapped_indices.index(node.index), node.index)
+            node.overlapped_nodes = [self.nodes[index] for index in overlapped_indices]
+
+    def get_edge_arrays(self) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """Distance means and stds of all edges in the order of `get_edge_index`, without the edge objects"""
+        node_indices2, node_indices1 = np.tril_indices(len(self.nodes))
+        distance_means = self.distance_means[node_indices1, node_indices2].astype(np.float64)
+        distance_stds = np.sqrt(self.node_radii[node_indices1] ** 2 + self.node_radii[node_indices2] ** 2)
+        return distance_means, distance_stds
+
+    @cached_property
+    def edges(self) -> list[DensityMapEdge]:
+        """Edges of all node pairs (including self loops), see `get_edge_index`"""
+        distance_stds = np.sqrt(self.node_radii[:, None] ** 2 + self.node_radii[None, :] ** 2)
+        return [
+            DensityMapEdge(
+                self,
+                self.get_edge_index(index1, index2),
+                self.nodes[index1],
+                self.nodes[index2],
+                self.distance_means[index1, index2].item(),
+                distance_stds[index1, index2].item(),
+            )
+            for index2 in range(len(self.nodes))
+            for index1 in range(index2 + 1)
+        ]
 
     def __clustering(self):
-        def are_nodes_close(node1: DensityMapNode, node2: DensityMapNode):
-            edge = self.edge_dict_nodes[node1, node2]
-            return edge.distance_mean < CLUSTER_DISTANCE
+        num_nodes = len(self.nodes)
+        node_types = [node.type for node in self.nodes]
+        # NOTE: neighbor index of the cluster distance
+        is_close = self.distance_means < CLUSTER_DISTANCE  # [N, N]
+
+        def get_type_mask(prefix: str | tuple[str, ...]) -> NDArray[np.bool_]:
+            return np.array([typ.startswith(prefix) for typ in node_types], dtype=np.bool_).reshape(-1)
 
         # NOTE: Cation, Anion, Aromatic Aromatic
         GROUP_CLUSTER_CONFIGS = [
@@ -131,31 +223,30 @@ class DensityMapGraph:
                 "minor_type": "Hydrophobic",
             },
         ]
-        used_nodes = set()
+        for CONFIG in GROUP_CLUSTER_CONFIGS:
+            CONFIG["major_mask"] = get_type_mask(CONFIG["major_type"])
+            CONFIG["minor_indices"] = np.flatnonzero(get_type_mask(CONFIG["minor_type"])).tolist()
+        is_used = np.zeros((num_nodes,), dtype=np.bool_)
         for node in self.nodes:
-            if node in used_nodes:
+            if is_used[node.index]:
                 continue
             for CONFIG in GROUP_CLUSTER_CONFIGS:
-                if node.type.startswith(CONFIG["major_type"]):
-                    cluster_nodes = {node}
+                if CONFIG["major_mask"][node.index]:
+                    is_member = np.zeros((num_nodes,), dtype=np.bool_)
+                    is_member[node.index] = True
                     # NOTE: Add Overlapped Nodes
-                    cluster_nodes.update(
-                        overlapped_node
-                        for overlapped_node in node.overlapped_nodes
-                        if overlapped_node.type.startswith(CONFIG["major_type"])
-                    )
-                    # NOTE: Add Dependency Nodes
-                    cluster_nodes.update(
-                        _node
-                        for _node in self.nodes
-                        if _node.type.startswith(CONFIG["minor_type"])
-                        and any(
-                            are_nodes_close(_node, cluster_node)
-                            for cluster_node in cluster_nodes
-                        )
-                    )
-                    used_nodes.update(cluster_nodes)
+                    for overlapped_node in node.overlapped_nodes:
+                        if CONFIG["major_mask"][overlapped_node.index]:
+                            is_member[overlapped_node.index] = True
+                    # NOTE: Add Dependency Nodes (in order, a node close to an added node is also added)
+                    is_near = is_close[is_member].any(axis=0)
+                    for index in CONFIG["minor_indices"]:
+                        if is_near[index]:
+                            is_member[index] = True
+                            is_near |= is_close[index]
+                    is_used |= is_member
                     # NOTE: Add New Cluster
+                    cluster_nodes = {self.nodes[index] for index in np.flatnonzero(is_member).tolist()}
                     cluster = DensityMapNodeCluster(self, cluster_nodes, CONFIG["name"])
                     self.node_cluster_dict[CONFIG["name"]].append(cluster)
                     break
@@ -166,21 +257,19 @@ class DensityMapGraph:
             {"name": "Hydrophobic", "type": "Hydrophobic"},
             {"name": "Halogen", "type": "XBond"},
         ]
+        for CONFIG in SINGLE_CLUSTER_CONFIGS:
+            CONFIG["mask"] = get_type_mask(CONFIG["type"])
         for node in self.nodes:
-            if node in used_nodes:
+            if is_used[node.index]:
                 continue
             for CONFIG in SINGLE_CLUSTER_CONFIGS:
-                if node.type.startswith(CONFIG["type"]):
+                if CONFIG["mask"][node.index]:
                     # NOTE: Create New Cluster - [Node, Close Nodes]
-                    cluster_nodes = {
-                        _node
-                        for _node in self.nodes
-                        if _node.type.startswith(CONFIG["type"])
-                        and are_nodes_close(node, _node)
-                    }
-                    cluster_nodes.add(node)
+                    is_member = CONFIG["mask"] & is_close[node.index]
+                    is_member[node.index] = True
+                    cluster_nodes = {self.nodes[index] for index in np.flatnonzero(is_member).tolist()}
                     cluster = DensityMapNodeCluster(self, cluster_nodes, CONFIG["name"])
-                    used_nodes.update(cluster_nodes)
+                    is_used |= is_member
                     self.node_cluster_dict[CONFIG["name"]].append(cluster)
                     break
 
@@ -218,7 +307,7 @@ class DensityMapNode:
         node_type: str,
         score: float,
         grids: NDArray[np.int_],
-        grid_scores: NDArray[np.float_],
+        center_coords: NDArray[np.float_],
     ):
         self.graph: DensityMapGraph = graph
         self.index: int = len(self.graph.nodes)
@@ -228,7 +317,7 @@ class DensityMapNode:
         self.hotspot_position: tuple[float, float, float] = hotspot_position
 
         self.score: float = score
-        center_coords = np.average(grids, axis=0, weights=grid_scores)
+        # NOTE: center_coords is the score-weighted centroid of the grids
         self.center: NDArray[np.float32] = np.array(
             coords_to_position(
                 center_coords, self.graph.center, self.graph.resolution, self.graph.size
@@ -239,8 +328,12 @@ class DensityMapNode:
             1 / 3
         ) * self.graph.resolution
 
-        self.neighbor_edge_dict: dict[DensityMapNode, DensityMapEdge] = {}
-        self.overlapped_nodes: list[DensityMapNode] = []
+        self.overlapped_nodes: list[DensityMapNode] = []  # set in `DensityMapGraph.setup`
+
+    @property
+    def neighbor_edge_dict(self) -> dict[DensityMapNode, DensityMapEdge]:
+        edges = self.graph.edges
+        return {node: edges[self.graph.get_edge_index(self.index, node.index)] for node in self.graph.nodes}
 
     def __hash__(self):
         return self.index
@@ -248,18 +341,6 @@ class DensityMapNode:
     def __repr__(self):
         return f"DensityMapNode({self.index})[{self.type}]"
 
-    def add_neighbors(self, neighbor: DensityMapNode) -> DensityMapEdge:
-        assert neighbor not in self.neighbor_edge_dict
-        edge = DensityMapEdge(self.graph, self, neighbor)
-        self.neighbor_edge_dict[neighbor] = edge
-        neighbor.neighbor_edge_dict[self] = edge
-
-        if edge.overlapped:
-            self.overlapped_nodes.append(neighbor)
-            neighbor.overlapped_nodes.append(self)
-
-        return edge
-
 
 class DensityMapEdge:
     """Density Map Edge
@@ -274,16 +355,16 @@ class DensityMapEdge:
         overlapped: end nodes are overlapped
     """
 
-    def __init__(self, graph, node1, node2):
+    def __init__(self, graph, index, node1, node2, distance_mean, distance_std):
         self.graph = graph
-        self.index = len(self.graph.edges)
+        self.index = index
         if node2.index < node1.index:
             node1, node2 = node2, node1
         self.node_indices: tuple[int, int] = (node1.index, node2.index)
         self.nodes: tuple[DensityMapNode, DensityMapNode] = (node1, node2)
         type1, type2 = node1.type, node2.type
 
-        self.type: tuple[str, str] = (min(type1, type2), max(type1, type2))
-        self.distance_mean: float = np.linalg.norm(node1.center - node2.center).item()
-        self.distance_std: float = math.sqrt(node1.radius**2 + node2.radius**2)
+        self.type: tuple[str, str] = (type1, type2) if type1 <= type2 else (type2, type1)
+        self.distance_mean: float = distance_mean
+        self.distance_std: float = distance_std
         self.overlapped: bool = self.distance_mean < OVERLAP_DISTANCE
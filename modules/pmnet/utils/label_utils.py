@@ -0,0 +1,71 @@
+import itertools
+import numpy as np
+
+from numpy.typing import NDArray
+
+
+# NOTE: half of the 26-neighborhood (each voxel pair is visited once)
+NEIGHBOR_OFFSETS = np.array(
+    [offset for offset in itertools.product((-1, 0, 1), repeat=3) if offset > (0, 0, 0)],
+    dtype=np.int64,
+)
+
+
+def label_components(
+    coords: NDArray[np.int16],
+    scores: NDArray[np.float32],
+) -> tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.float64]]:
+    """26-connected components of the voxels
+
+    The components are numbered in the order of their first voxel.
+
+    Args:
+        coords: [N, 3] - (x, y, z) grid indices (unique)
+        scores: [N,]
+
+    Returns:
+        labels: [N,] component index of each voxel
+        counts: [K,] number of voxels of each component
+        centroids: [K, 3] score-weighted centroid (grid unit) of each component
+    """
+    N = coords.shape[0]
+    if N == 0:
+        return np.empty((0,), dtype=np.int64), np.empty((0,), dtype=np.int64), np.empty((0, 3), dtype=np.float64)
+    coords = coords.astype(np.int64)
+    lower = coords.min(axis=0)
+    local_coords = coords - lower
+    shape = tuple((local_coords.max(axis=0) + 1).tolist())
+    index_grid = np.full(shape, -1, dtype=np.int64)
+    index_grid[tuple(local_coords.T)] = np.arange(N)
+
+    # NOTE: adjacent voxel pairs
+    sources, targets = [], []
+    for offset in NEIGHBOR_OFFSETS:
+        neighbor_coords = local_coords + offset
+        valid = np.all((neighbor_coords >= 0) & (neighbor_coords < shape), axis=1)
+        neighbors = np.full((N,), -1, dtype=np.int64)
+        neighbors[valid] = index_grid[tuple(neighbor_coords[valid].T)]
+        is_adjacent = neighbors >= 0
+        sources.append(np.flatnonzero(is_adjacent))
+        targets.append(neighbors[is_adjacent])
+    sources, targets = np.concatenate(sources), np.concatenate(targets)
+
+    # NOTE: union-find by minimum label propagation with pointer jumping, root is the first voxel
+    roots = np.arange(N)
+    while True:
+        new_roots = roots.copy()
+        minimum = np.minimum(roots[sources], roots[targets])
+        np.minimum.at(new_roots, sources, minimum)
+        np.minimum.at(new_roots, targets, minimum)
+        new_roots = new_roots[new_roots]
+        if np.array_equal(new_roots, roots):
+            break
+        roots = new_roots
+
+    _, labels, counts = np.unique(roots, return_inverse=True, return_counts=True)
+    weights = scores.astype(np.float64)
+    weight_sums = np.bincount(labels, weights=weights)
+    centroids = np.stack(
+        [np.bincount(labels, weights=weights * coords[:, axis]) for axis in range(3)], axis=1
+    ) / weight_sums[:, None]
+    return labels, counts, centroids
@@ -0,0 +1,119 @@
+import numpy as np
+import numba as nb
+
+from numpy.typing import NDArray
+
+
+@nb.njit(
+    "int64(int16[:, ::1],float32[::1],int64[::1],int64[::1],float64[:, ::1])",
+    cache=True,
+)
+def __numba_label(
+    coords: NDArray[np.int16],
+    scores: NDArray[np.float32],
+    labels: NDArray[np.int64],
+    counts: NDArray[np.int64],
+    centroids: NDArray[np.float64],
+) -> int:
+    """26-connected component labelling (flood fill on the bounding box index grid)
+
+    Args:
+        coords: [N, 3]
+        scores: [N,]
+        labels: [N,] (output)
+        counts: [N,] (output, first num_labels are valid)
+        centroids: [N, 3] (output, first num_labels are valid)
+
+    Returns:
+        num_labels: int
+    """
+    N = coords.shape[0]
+    lower = np.empty(3, dtype=np.int64)
+    upper = np.empty(3, dtype=np.int64)
+    for axis in range(3):
+        lower[axis] = coords[0, axis]
+        upper[axis] = coords[0, axis]
+    for i in range(N):
+        for axis in range(3):
+            lower[axis] = min(lower[axis], coords[i, axis])
+            upper[axis] = max(upper[axis], coords[i, axis])
+    D = upper[0] - lower[0] + 1
+    H = upper[1] - lower[1] + 1
+    W = upper[2] - lower[2] + 1
+    index_grid = np.full((D, H, W), -1, dtype=np.int64)
+    for i in range(N):
+        index_grid[coords[i, 0] - lower[0], coords[i, 1] - lower[1], coords[i, 2] - lower[2]] = i
+
+    labels[:] = -1
+    stack = np.empty(N, dtype=np.int64)
+    num_labels = 0
+    for i in range(N):
+        if labels[i] >= 0:
+            continue
+        label = num_labels
+        num_labels += 1
+        labels[i] = label
+        stack[0] = i
+        top = 1
+        count = 0
+        weight_sum = 0.0
+        x_sum = 0.0
+        y_sum = 0.0
+        z_sum = 0.0
+        while top > 0:
+            top -= 1
+            j = stack[top]
+            x, y, z = coords[j, 0], coords[j, 1], coords[j, 2]
+            w = np.float64(scores[j])
+            count += 1
+            weight_sum += w
+            x_sum += w * x
+            y_sum += w * y
+            z_sum += w * z
+            x, y, z = x - lower[0], y - lower[1], z - lower[2]
+            for nx in range(max(x - 1, 0), min(x + 2, D)):
+                for ny in range(max(y - 1, 0), min(y + 2, H)):
+                    for nz in range(max(z - 1, 0), min(z + 2, W)):
+                        k = index_grid[nx, ny, nz]
+                        if k >= 0 and labels[k] < 0:
+                            labels[k] = label
+                            stack[top] = k
+                            top += 1
+        counts[label] = count
+        centroids[label, 0] = x_sum / weight_sum
+        centroids[label, 1] = y_sum / weight_sum
+        centroids[label, 2] = z_sum / weight_sum
+    return num_labels
+
+
+def label_components(
+    coords: NDArray[np.int16],
+    scores: NDArray[np.float32],
+) -> tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.float64]]:
+    """26-connected components of the voxels
+
+    The components are numbered in the order of their first voxel.
+
+    Args:
+        coords: [N, 3] - (x, y, z) grid indices (unique)
+        scores: [N,]
+
+    Returns:
+        labels: [N,] component index of each voxel
+        counts: [K,] number of voxels of each component
+        centroids: [K, 3] score-weighted centroid (grid unit) of each component
+    """
+    N = coords.shape[0]
+    labels = np.empty((N,), dtype=np.int64)
+    counts = np.empty((N,), dtype=np.int64)
+    centroids = np.empty((N, 3), dtype=np.float64)
+    if N == 0:
+        return labels, counts, centroids
+    num_labels = __numba_label(
+        np.ascontiguousarray(coords, dtype=np.int16),
+        np.ascontiguousarray(scores, dtype=np.float32),
+        labels,
+        counts,
+        centroids,
+    )
+    return labels, counts[:num_labels], centroids[:num_labels]
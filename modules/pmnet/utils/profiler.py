@@ -0,0 +1,172 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+
+
+def _get_rss() -> float | None:
+    """Current resident set size (MB)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# NOTE: interval of the RSS sampling thread of each stage (sec)
+RSS_SAMPLING_INTERVAL = 0.005
+
+
+class _RSSSampler:
+    """Peak resident set size during a stage, sampled on a background thread"""
+
+    def __init__(self, interval: float = RSS_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.peak: float | None = _get_rss()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._update(_get_rss())
+
+    def _update(self, rss: float | None):
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def stop(self, rss_end: float | None) -> float | None:
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+        self._update(rss_end)
+        return self.peak
+
+
+def _cuda_is_used() -> bool:
+    """True if torch is imported and CUDA is initialized (the profiler does not import torch itself)"""
+    torch = sys.modules.get("torch", None)
+    return torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized()
+
+
+@dataclass
+class StageRecord:
+    name: str
+    start: float  # sec, from the profiler creation
+    wall_time: float  # sec
+    cpu_time: float  # sec, process time of all threads
+    rss_start: float | None  # MB
+    rss_end: float | None  # MB
+    peak_rss: float | None  # MB, peak during the stage (sampled)
+    peak_tensor_memory: float | None  # MB, peak of the allocated CUDA tensors during the stage (None on CPU)
+
+
+class ModelingProfiler:
+    def __init__(self, enabled: bool = True):
+        """Per-stage wall time, CPU time and memory of pharmacophore modeling
+
+        Args:
+            enabled: if False, nothing is recorded
+        """
+        self.enabled = enabled
+        self.records: list[StageRecord] = []
+        self._origin = time.perf_counter()
+        # NOTE: running CUDA peaks of the open (nested) stages, since the peak statistics are reset at each stage
+        self._tensor_peaks: list[int] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        use_cuda = _cuda_is_used()
+        if use_cuda:
+            import torch
+
+            if len(self._tensor_peaks) > 0:
+                self._tensor_peaks[-1] = max(self._tensor_peaks[-1], torch.cuda.max_memory_allocated())
+            torch.cuda.reset_peak_memory_stats()
+            self._tensor_peaks.append(0)
+        rss_start = _get_rss()
+        sampler = _RSSSampler()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            end, cpu_end = time.perf_counter(), time.process_time()
+            rss_end = _get_rss()
+            peak_tensor_memory = None
+            if use_cuda:
+                peak = max(self._tensor_peaks.pop(), torch.cuda.max_memory_allocated())
+                if len(self._tensor_peaks) > 0:
+                    self._tensor_peaks[-1] = max(self._tensor_peaks[-1], peak)
+                peak_tensor_memory = peak / (1024 * 1024)
+            self.records.append(
+                StageRecord(
+                    name,
+                    start - self._origin,
+                    end - start,
+                    cpu_end - cpu_start,
+                    rss_start,
+                    rss_end,
+                    sampler.stop(rss_end),
+                    peak_tensor_memory,
+                )
+            )
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Total time and maximum of the per-stage memory peaks of each stage
+
+        Returns:
+            summary: {stage: {count, wall_time, cpu_time, peak_rss, peak_tensor_memory}}
+        """
+        summary: dict[str, dict[str, float]] = {}
+        for record in self.records:
+            stat = summary.setdefault(
+                record.name,
+                {"count": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_rss": 0.0, "peak_tensor_memory": 0.0},
+            )
+            stat["count"] += 1
+            stat["wall_time"] += record.wall_time
+            stat["cpu_time"] += record.cpu_time
+            if record.peak_rss is not None:
+                stat["peak_rss"] = max(stat["peak_rss"], record.peak_rss)
+            if record.peak_tensor_memory is not None:
+                stat["peak_tensor_memory"] = max(stat["peak_tensor_memory"], record.peak_tensor_memory)
+        return summary
+
+    def to_dict(self) -> dict:
+        return {"summary": self.summary(), "records": [asdict(record) for record in self.records]}
+
+    def save_json(self, path: str | os.PathLike):
+        with open(path, "w") as w:
+            json.dump(self.to_dict(), w, indent=2)
+
+    def save_chrome_trace(self, path: str | os.PathLike):
+        """Save the records in Chrome trace event format (chrome://tracing, Perfetto)"""
+        pid, tid = os.getpid(), threading.get_ident()
+        events = [
+            {
+                "name": record.name,
+                "ph": "X",
+                "ts": record.start * 1e6,
+                "dur": record.wall_time * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": {
+                    "cpu_time": record.cpu_time,
+                    "rss_end": record.rss_end,
+                    "peak_rss": record.peak_rss,
+                    "peak_tensor_memory": record.peak_tensor_memory,
+                },
+            }
+            for record in self.records
+        ]
+        with open(path, "w") as w:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, w)
@@ -25,49 +25,76 @@ class GaussianSmoothing(nn.Module):
         sigma = to_3tuple(sigma)
 
         # The gaussian kernel is the product of the
-        # gaussian function of each dimension.
-        meshgrids = torch.meshgrid(
-            [torch.arange(size, dtype=torch.float) for size in kernel_size],
-            indexing="ij",
-        )
-        kernel: torch.Tensor = None
-        for size, std, mgrid in zip(kernel_size, sigma, meshgrids):
+        # gaussian function of each dimension (separable).
+        for axis, (size, std) in enumerate(zip(kernel_size, sigma)):
             mean = (size - 1) / 2
+            mgrid = torch.arange(size, dtype=torch.float)
             # _kernel = 1 / (std * math.sqrt(2 * math.pi)) * torch.exp(-((mgrid - mean) / (2 * std)) ** 2)
-            _kernel = torch.exp(
-                -(((mgrid - mean) / (std)) ** 2) / 2
-            )  # omit constant part
-            if kernel is None:
-                kernel = _kernel
-            else:
-                kernel *= _kernel
-
-        # Make sure sum of values in gaussian kernel equals 1.
-        kernel /= torch.sum(kernel)  # (Kd, Kh, Kw), Kd, Kh, Kw: kernel_size
+            kernel = torch.exp(-(((mgrid - mean) / (std)) ** 2) / 2)  # omit constant part
 
-        # Reshape to depthwise convolutional weight
-        kernel = kernel.view(1, 1, *kernel.size())  # (1, 1, Kd, Kh, Kw)
-        kernel = kernel.repeat(1, 1, 1, 1, 1)  # (1, 1, Kd, Kh, Kw)
+            # Make sure sum of values in gaussian kernel equals 1.
+            kernel /= torch.sum(kernel)  # (K,)
 
-        self.register_buffer("weight", kernel)
-        self.pad: tuple[int, int, int, int, int, int] = (
-            kernel_size[0] // 2,
-            kernel_size[0] // 2,
-            kernel_size[1] // 2,
-            kernel_size[1] // 2,
-            kernel_size[2] // 2,
-            kernel_size[2] // 2,
+            # Reshape to depthwise convolutional weight of each axis
+            shape = [1, 1, 1, 1, 1]
+            shape[axis + 2] = size
+            self.register_buffer(f"weight_{axis}", kernel.view(shape))  # (1, 1, Kd, 1, 1), ...
+        self.kernel_size: tuple[int, int, int] = kernel_size
+        self.paddings: tuple[tuple[int, int, int], ...] = (
+            (kernel_size[0] // 2, 0, 0),
+            (0, kernel_size[1] // 2, 0),
+            (0, 0, kernel_size[2] // 2),
         )
+        self._weight_cache: dict[tuple[int, torch.dtype, torch.device], tuple[torch.Tensor, ...]] = {}
+
+    def _get_weights(self, channels: int, dtype: torch.dtype, device: torch.device) -> tuple[torch.Tensor, ...]:
+        """Depthwise weights of the 1D kernels for the number of channels (cached)"""
+        key = (channels, dtype, device)
+        weights = self._weight_cache.get(key, None)
+        if weights is None:
+            weights = tuple(
+                getattr(self, f"weight_{axis}").to(device, dtype).repeat(channels, 1, 1, 1, 1) for axis in range(3)
+            )
+            self._weight_cache[key] = weights
+        return weights
+
+    def _apply(self, fn, *args, **kwargs):
+        self._weight_cache.clear()
+        return super(GaussianSmoothing, self)._apply(fn, *args, **kwargs)
 
     @torch.no_grad()
     def forward(self, x):
         """
         Apply gaussian filter to input.
         Arguments:
-            input (torch.Tensor): Input to apply gaussian filter on.
+            input (torch.Tensor): Input to apply gaussian filter on. (C, D, H, W) or (N, C, D, H, W)
         Returns:
             filtered (torch.Tensor): Filtered output.
         """
-        x = F.pad(x, self.pad, mode="constant", value=0.0)
-        weight = self.weight.repeat(x.shape[-4], 1, 1, 1, 1)
-        return F.conv3d(x, weight=weight, groups=x.shape[-4])
+        channels = x.shape[-4]
+        for weight, padding in zip(self._get_weights(channels, x.dtype, x.device), self.paddings):
+            x = F.conv3d(x, weight=weight, padding=padding, groups=channels)
+        return x
+
+    @torch.no_grad()
+    def forward_support(self, x):
+        """
+        Apply gaussian filter to a single map within the bounding box of its support (nonzero area).
+        The output is the same to `forward`, since the output is zero far from the support.
+        Arguments:
+            input (torch.Tensor): Input to apply gaussian filter on. (D, H, W)
+        Returns:
+            filtered (torch.Tensor): Filtered output. (D, H, W)
+        """
+        out = torch.zeros_like(x)
+        nonzero = torch.nonzero(x)
+        if nonzero.size(0) == 0:
+            return out
+        bbox = tuple(
+            slice(max(start - size // 2, 0), min(end + 1 + size // 2, dim))
+            for start, end, size, dim in zip(
+                nonzero.min(0).values.tolist(), nonzero.max(0).values.tolist(), self.kernel_size, x.shape
+            )
+        )
+        out[bbox] = self.forward(x[bbox].unsqueeze(0)).squeeze(0)
+        return out